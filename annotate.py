@@ -0,0 +1,393 @@
+"""
+Headless batch annotation of a VCF or TSV with the chat tools
+
+    python annotate.py variants.vcf.gz annotated.jsonl
+    python annotate.py panel.tsv annotated.jsonl --tools gnomad,vep,mutationtaster --concurrency 8
+    python annotate.py exome.vcf.gz annotated_parquet --format parquet --classify --model mistral-small-latest
+
+Variants are streamed from the input and annotated in windows through the batch tools
+(one gnomAD, VEP and MutationTaster request per chunk of a window instead of one per variant),
+with at most --concurrency windows in flight. Results are written as each window finishes,
+so a rerun with the same output skips every variant already written and resumes where a
+crashed run stopped. Upstream requests are scheduled as bulk work, behind any interactive
+requests of the same process. A window fails when any of its tool requests or classifications
+does, it is not written and stops the run with a non-zero exit status; everything written before
+it is kept and the rerun annotates the window again.
+
+Coordinates are taken as GRCh37 (--assembly GRCh38 for GRCh38 input): VEP is asked on the Ensembl
+server of the assembly, MutationTaster only knows GRCh37 and is skipped for GRCh38, and the local
+dbVar index only answers when it was imported for the same assembly.
+
+TSV input needs a header with chrom, pos, ref and alt columns, and optionally rsid (or id).
+"""
+import argparse
+import asyncio
+import csv
+import glob
+import gzip
+import json
+import os
+import sys
+import time
+
+import async_tools
+import clinvar_index
+import dbvar_index
+from compact import summarize_gnomad_variant, summarize_mutation_taster_rows, summarize_vep
+from scheduler import BULK, priority
+
+TOOLS = ("gnomad", "vep", "mutationtaster", "dbsnp", "dbvar", "clinvar")
+ASSEMBLIES = ("GRCh37", "GRCh38")
+# The MutationTaster 2021 API only takes GRCh37 coordinates
+MUTATION_TASTER_ASSEMBLY = "GRCh37"
+GNOMAD_FIELDS = ["acmg"]
+
+CLASSIFY_PROMPT = ("You are an expert in genomic medicine. Classify the clinical significance of the variant below following "
+                   "the ACMG/AMP 2015 framework of Richards et al. using the annotations provided. Answer with a JSON object "
+                   "with keys classification (Pathogenic, Likely pathogenic, Uncertain significance, Likely benign or Benign), "
+                   "criteria (list of ACMG criteria codes) and rationale (one or two sentences).")
+
+
+def _open_text(path):
+    return gzip.open(path, "rt") if path.endswith(".gz") else open(path, newline="")
+
+
+def _variant(chrom, pos, ref, alt, rsid=None):
+    chrom = chrom[3:] if chrom.lower().startswith("chr") else chrom
+    rsid = rsid.lower() if rsid and rsid.lower().startswith("rs") else None
+    return {"key": f"{chrom}:{pos}:{ref}:{alt}", "chrom": chrom, "pos": int(pos), "ref": ref, "alt": alt, "rsid": rsid}
+
+
+def iter_vcf(path):
+    """Variants of a VCF, one per ALT allele"""
+    with _open_text(path) as f:
+        for line in f:
+            if line.startswith("#"):
+                continue
+            fields = line.rstrip("\n").split("\t")
+            chrom, pos, ids, ref, alts = fields[:5]
+            rsid = next((i for i in ids.split(";") if i.lower().startswith("rs")), None)
+            for alt in alts.split(","):
+                if alt not in (".", "*"):
+                    yield _variant(chrom, pos, ref, alt, rsid)
+
+
+def iter_tsv(path):
+    """Variants of a TSV with chrom/pos/ref/alt (and optionally rsid or id) columns"""
+    with _open_text(path) as f:
+        reader = csv.DictReader(f, delimiter="\t")
+        for row in reader:
+            row = {k.lower().lstrip("#"): v for k, v in row.items() if k}
+            yield _variant(row["chrom"], row["pos"], row["ref"], row["alt"], row.get("rsid") or row.get("id"))
+
+
+def iter_variants(path):
+    name = path[:-3] if path.endswith(".gz") else path
+    return iter_vcf(path) if name.endswith(".vcf") else iter_tsv(path)
+
+
+def _windows(variants, size, done):
+    window = []
+    for variant in variants:
+        if variant["key"] in done:
+            continue
+        window.append(variant)
+        if len(window) == size:
+            yield window
+            window = []
+    if window:
+        yield window
+
+
+def _vep_region(variant):
+    end = variant["pos"] + len(variant["ref"]) - 1
+    return {"region": f"{variant['chrom']}:{variant['pos']}-{end}:1", "allele": variant["alt"]}
+
+
+def _mutation_taster_key(variant):
+    return f"{variant['chrom']}:{variant['pos']}{variant['ref']}>{variant['alt']}"
+
+
+class AnnotationFailed(Exception):
+    pass
+
+
+async def annotate_window(window, tools, assembly=ASSEMBLIES[0]):
+    """Annotations of a window of variants, one record per variant, at coordinates of assembly"""
+    with_rsid = [v for v in window if v["rsid"]]
+    rsids = [v["rsid"] for v in with_rsid]
+    jobs = {}
+
+    if "gnomad" in tools and rsids:
+        jobs["gnomad"] = async_tools.tool_query_gnomad_by_rsids(rsids, GNOMAD_FIELDS)
+    if "vep" in tools:
+        jobs["vep"] = async_tools.tool_get_variant_consequences_by_regions_and_alleles(
+            [_vep_region(v) for v in window], assembly)
+    if "mutationtaster" in tools and assembly == MUTATION_TASTER_ASSEMBLY:
+        jobs["mutationtaster"] = async_tools.tool_get_mutation_tester_results([
+            {"chromosome_coordinate": f"{v['chrom']}:{v['pos']}", "original_reference_allele": v["ref"], "new_allele": v["alt"]}
+            for v in window
+        ])
+    if "dbsnp" in tools and rsids:
+        jobs["dbsnp"] = asyncio.gather(*(async_tools.tool_query_single_nucleotide_polymorphisms_db_by_rsid(r) for r in rsids))
+    if "dbvar" in tools and rsids:
+        jobs["dbvar"] = asyncio.gather(*(async_tools.tool_query_genomic_structural_variation_db_by_rsid(r) for r in rsids))
+
+    outcomes = dict(zip(jobs, await asyncio.gather(*jobs.values(), return_exceptions=True)))
+    failed = {name: outcome for name, outcome in outcomes.items() if isinstance(outcome, Exception)}
+    for name in ("dbsnp", "dbvar"):
+        # The single rsID tools answer None when their request failed
+        if name in outcomes and name not in failed and any(result is None for result in outcomes[name]):
+            failed[name] = async_tools.UpstreamError(f"{name} request failed")
+    if failed:
+        # Written records count as done, a window with a missing tool answer must be annotated again on resume
+        raise AnnotationFailed(f"{', '.join(failed)} failed for a window of {len(window)} variants: "
+                               f"{next(iter(failed.values()))!r}") from next(iter(failed.values()))
+
+    by_rsid = {}
+    for name in ("dbsnp", "dbvar"):
+        if outcomes.get(name) is not None:
+            by_rsid[name] = dict(zip(rsids, outcomes[name]))
+
+    dbvar = dbvar_index.get_index() if "dbvar" in tools else None
+    # Overlaps are looked up with the input coordinates, an index of another assembly can't answer them
+    dbvar_overlaps = dbvar is not None and dbvar.meta["assembly"] == assembly
+
+    records = []
+    for v in window:
+        annotations = {}
+        if outcomes.get("gnomad") is not None and v["rsid"]:
+            annotations["gnomad"] = outcomes["gnomad"].get(v["rsid"])
+        if outcomes.get("vep") is not None:
+            region = _vep_region(v)
+            annotations["vep"] = outcomes["vep"].get(f"{region['region']} {region['allele']}")
+        if outcomes.get("mutationtaster") is not None:
+            annotations["mutationtaster"] = outcomes["mutationtaster"].get(_mutation_taster_key(v))
+        for name in ("dbsnp", "dbvar"):
+            if name in by_rsid and v["rsid"]:
+                annotations[name] = by_rsid[name].get(v["rsid"])
+        if dbvar_overlaps:
+            # Overlaps need no rsID, the local index answers them for every variant without a request
+            end = v["pos"] + len(v["ref"]) - 1
+            annotations["dbvar_overlaps"] = dbvar_index.query_region(v["chrom"], v["pos"], end)["structural_variants"]
+        if "clinvar" in tools:
+            # ClinVar has no coordinate API, only the local index can answer per variant
+            annotations["clinvar"] = clinvar_index.lookup_variant(v["chrom"], v["pos"], v["ref"], v["alt"]) or \
+                (clinvar_index.lookup_rsid(v["rsid"]) if v["rsid"] else [])
+        records.append({**v, "annotations": annotations})
+    return records
+
+
+COMPACTORS = {
+    "gnomad": summarize_gnomad_variant,
+    "vep": summarize_vep,
+    "mutationtaster": summarize_mutation_taster_rows,
+}
+
+
+def compact_record(record):
+    """Record with the tool outputs reduced like in the chat, used for the LLM prompt and --compact"""
+    annotations = {}
+    for name, value in record["annotations"].items():
+        if name in COMPACTORS and value is not None:
+            value = COMPACTORS[name](value)
+        annotations[name] = value
+    return {**record, "annotations": annotations}
+
+
+def classify(client, model, record):
+    """ACMG classification of one annotated variant by the LLM"""
+    from mistralai.models.chat_completion import ChatMessage
+
+    response = client.chat(model=model, response_format={"type": "json_object"}, messages=[
+        ChatMessage(role="system", content=CLASSIFY_PROMPT),
+        ChatMessage(role="user", content=json.dumps(compact_record(record))),
+    ])
+    content = response.choices[0].message.content
+    try:
+        return json.loads(content)
+    except ValueError:
+        return {"rationale": content}
+
+
+class JsonlWriter:
+    def __init__(self, path):
+        self.path = path
+        _truncate_partial_line(path)
+        self.file = open(path, "a")
+
+    def done_keys(self):
+        return read_done_keys_jsonl(self.path)
+
+    def write(self, records):
+        for record in records:
+            self.file.write(json.dumps(record) + "\n")
+        # Flushed per window, so everything on disk is a completed variant to resume from
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+
+def _truncate_partial_line(path, block_size=65536):
+    """Cuts a line left unfinished by a crash off the end of path, so appended records start on a line of their own"""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        end = f.seek(0, os.SEEK_END)
+        position = end
+        while position > 0:
+            start = max(0, position - block_size)
+            f.seek(start)
+            newline = f.read(position - start).rfind(b"\n")
+            if newline != -1:
+                position = start + newline + 1
+                break
+            position = start
+        if position != end:
+            f.truncate(position)
+
+
+def read_done_keys_jsonl(path):
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for line in f:
+            try:
+                done.add(json.loads(line)["key"])
+            except (ValueError, KeyError):
+                # A line cut off by a crash, its variant is annotated again
+                pass
+    return done
+
+
+class ParquetWriter:
+    """Writes every window as one part file of a Parquet dataset directory, tool outputs as JSON strings"""
+
+    def __init__(self, path):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            sys.exit("Parquet output needs pyarrow: pip install pyarrow")
+        self.pa, self.pq = pyarrow, pyarrow.parquet
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.part = len(glob.glob(os.path.join(path, "part-*.parquet")))
+
+    def done_keys(self):
+        done = set()
+        for part in glob.glob(os.path.join(self.path, "part-*.parquet")):
+            done.update(self.pq.read_table(part, columns=["key"]).column("key").to_pylist())
+        return done
+
+    def write(self, records):
+        columns = {name: [r[name] for r in records] for name in ("key", "chrom", "pos", "ref", "alt", "rsid")}
+        columns["annotations"] = [json.dumps(r["annotations"]) for r in records]
+        if any("classification" in r for r in records):
+            columns["classification"] = [json.dumps(r.get("classification")) for r in records]
+        # Written under a temporary name first so a crash never leaves a truncated part behind
+        final = os.path.join(self.path, f"part-{self.part:06d}.parquet")
+        self.pq.write_table(self.pa.table(columns), final + ".tmp")
+        os.replace(final + ".tmp", final)
+        self.part += 1
+
+    def close(self):
+        pass
+
+
+async def run(args):
+    writer = ParquetWriter(args.output) if args.format == "parquet" else JsonlWriter(args.output)
+    done = writer.done_keys()
+    if done:
+        print(f"Resuming, {len(done)} variants already annotated in {args.output}", file=sys.stderr)
+
+    client = None
+    if args.classify:
+        from mistralai.client import MistralClient
+        client = MistralClient(api_key=os.environ["MISTRAL_API_KEY"])
+
+    tools = set(args.tools.split(","))
+    semaphore = asyncio.Semaphore(args.concurrency)
+    pending = set()
+    failures = []
+    count, start = 0, time.time()
+
+    async def process(window):
+        nonlocal count
+        try:
+            records = await annotate_window(window, tools, args.assembly)
+            if client is not None:
+                classifications = await asyncio.gather(*(asyncio.to_thread(classify, client, args.model, r) for r in records),
+                                                       return_exceptions=True)
+                errors = [c for c in classifications if isinstance(c, Exception)]
+                if errors:
+                    raise AnnotationFailed(f"classification failed for {len(errors)} variants: {errors[0]!r}") from errors[0]
+                for record, classification in zip(records, classifications):
+                    record["classification"] = classification
+            if args.compact:
+                records = [compact_record(r) for r in records]
+            writer.write(records)
+            count += len(records)
+            print(f"{count} variants annotated, {count / (time.time() - start):.1f}/s", file=sys.stderr)
+        finally:
+            semaphore.release()
+
+    def finished(task):
+        pending.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            failures.append(task.exception())
+
+    try:
+        for window in _windows(iter_variants(args.input), args.window, done):
+            # Reading stops while the maximum number of windows is in flight, memory stays bounded
+            await semaphore.acquire()
+            if failures:
+                break
+            task = asyncio.create_task(process(window))
+            pending.add(task)
+            task.add_done_callback(finished)
+        if failures:
+            for task in pending:
+                task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+    finally:
+        writer.close()
+    if failures:
+        raise AnnotationFailed(f"{len(failures)} windows failed, first error: {failures[0]!r}") from failures[0]
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="VCF or TSV, optionally gzipped")
+    parser.add_argument("output", help="JSONL file, or directory for --format parquet")
+    parser.add_argument("--format", choices=("jsonl", "parquet"), default="jsonl")
+    parser.add_argument("--tools", default=",".join(TOOLS), help=f"comma separated subset of {','.join(TOOLS)}")
+    parser.add_argument("--assembly", choices=ASSEMBLIES, default=ASSEMBLIES[0], help="reference genome of the input")
+    parser.add_argument("--window", type=int, default=200, help="variants annotated together through the batch tools")
+    parser.add_argument("--concurrency", type=int, default=4, help="windows in flight")
+    parser.add_argument("--compact", action="store_true", help="write the compacted tool outputs instead of the raw ones")
+    parser.add_argument("--classify", action="store_true", help="also ask the LLM for an ACMG classification per variant")
+    parser.add_argument("--model", default="mistral-large-latest", help="model used by --classify")
+    args = parser.parse_args()
+
+    unknown = set(args.tools.split(",")) - set(TOOLS)
+    if unknown:
+        parser.error(f"unknown tools {', '.join(sorted(unknown))}")
+
+    start = time.time()
+    if "mutationtaster" in args.tools.split(",") and args.assembly != MUTATION_TASTER_ASSEMBLY:
+        print(f"MutationTaster only takes {MUTATION_TASTER_ASSEMBLY} coordinates, skipped for {args.assembly}", file=sys.stderr)
+    with priority(BULK, session=f"annotate-{os.getpid()}"):
+        try:
+            count = asyncio.run(run(args))
+        except AnnotationFailed as e:
+            sys.exit(f"Annotation stopped, {e}. Rerun the same command to resume")
+    print(f"Annotated {count} variants in {time.time() - start:.1f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,423 @@
+"""
+Asyncio-native versions of the tools in tools.py, for fanning out many lookups from one process
+
+Every tool_* function of tools.py has a coroutine of the same name here, returning the same
+result and sharing the same cache entries. They go through one shared httpx.AsyncClient with
+per-host concurrency limits and rate limiters matching each upstream's published limits.
+tools.py stays the blocking API.
+
+    results = asyncio.run(tool_get_variant_consequences_by_ids(["rs699", "rs1042522"]))
+"""
+import asyncio
+import contextlib
+import email.utils
+import json
+import random
+import time
+import weakref
+import xml.etree.ElementTree as ET
+from urllib.parse import urlsplit
+
+import httpx
+
+import clinvar_index
+import dbvar_index
+import gnomad
+import gnomad_store
+import tracing
+import transport
+from cache import cached, get_cached_async, get_cached_equivalent_async, set_cached_async
+from clinvar import EFETCH_URL, clinvar_set_analyser
+from compact import get_raw_output
+from scheduler import NCBI_API_KEY, current, scheduler
+from tools import (
+    GNOMAD_BATCH_SIZE, MUTATION_TASTER_API, MUTATION_TASTER_MAX_URL_LENGTH, VEP_POST_MAX_SIZE,
+    _chunks, _mutation_taster_variant, _pack_variants, _parse_mutation_taster_line, _region_to_vep_input, _row_variant,
+)
+from xref import equivalent_calls, resolve
+
+ENSEMBL_SERVER = "https://rest.ensembl.org"
+# rest.ensembl.org is on GRCh38, GRCh37 coordinates have their own server
+ENSEMBL_SERVERS = {"GRCh38": ENSEMBL_SERVER, "GRCh37": "https://grch37.rest.ensembl.org"}
+
+# host -> max concurrent requests, request rates are set by the scheduler
+HOST_LIMITS = {
+    "rest.ensembl.org": 15,
+    "grch37.rest.ensembl.org": 15,
+    "eutils.ncbi.nlm.nih.gov": 10 if NCBI_API_KEY else 3,
+    "clinicaltables.nlm.nih.gov": 10,
+    "gnomad.broadinstitute.org": 4,
+    "www.genecascade.org": 2,
+}
+DEFAULT_HOST_LIMITS = 4
+
+
+def _retry_after(response):
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class AsyncToolClient:
+    """Shared httpx client with per-host limits, retries and the same timeouts as transport.py"""
+
+    def __init__(self, host_limits=HOST_LIMITS, max_retries=transport.MAX_RETRIES):
+        self.http = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=sum(host_limits.values()) + 8, max_keepalive_connections=32),
+        )
+        self.host_limits = host_limits
+        self.max_retries = max_retries
+        self.semaphores = {}
+
+    def _semaphore_for(self, host):
+        if host not in self.semaphores:
+            self.semaphores[host] = asyncio.Semaphore(self.host_limits.get(host, DEFAULT_HOST_LIMITS))
+        return self.semaphores[host]
+
+    def _target(self, url, kwargs):
+        connect_timeout, read_timeout = transport.timeout_for(url)
+        kwargs.setdefault("timeout", httpx.Timeout(read_timeout, connect=connect_timeout))
+        upstream = urlsplit(url).hostname
+        if transport.UPSTREAM_OVERRIDE:
+            url = transport.redirect(url, transport.UPSTREAM_OVERRIDE)
+        return url, upstream
+
+    async def _backoff(self, response, attempt):
+        delay = _retry_after(response) if response is not None else None
+        if delay is None:
+            delay = 0.5 * 2 ** attempt + random.uniform(0, 0.5)
+        await asyncio.sleep(delay)
+
+    async def request(self, method, url, **kwargs):
+        """
+        Sends a request within the limits of its host, retrying 429/5xx and connection errors
+        with jittered exponential backoff that honours Retry-After
+        :return: httpx.Response
+        """
+        url, upstream = self._target(url, kwargs)
+        semaphore = self._semaphore_for(upstream)
+
+        with tracing.span("http", method=method, host=urlsplit(url).netloc, path=urlsplit(url).path) as s:
+            for attempt in range(self.max_retries + 1):
+                async with semaphore:
+                    s.set(priority=current()[0], queue_ms=await scheduler.acquire_async(upstream))
+                    try:
+                        response = await self.http.request(method, url, **kwargs)
+                    except httpx.TransportError:
+                        if attempt == self.max_retries:
+                            raise
+                        response = None
+
+                if response is not None and (response.status_code not in transport.RETRY_STATUSES or attempt == self.max_retries):
+                    s.set(status=response.status_code, retries=attempt, ttfb_ms=round(response.elapsed.total_seconds() * 1000, 3),
+                          request_bytes=len(response.request.content), response_bytes=len(response.content))
+                    return response
+                await self._backoff(response, attempt)
+
+    @contextlib.asynccontextmanager
+    async def stream(self, method, url, **kwargs):
+        """
+        Same as request with the body left unread, for parsing it as it arrives
+        The response is read within the limits of its host and closed when the block exits.
+        """
+        url, upstream = self._target(url, kwargs)
+        semaphore = self._semaphore_for(upstream)
+
+        with tracing.span("http", method=method, host=urlsplit(url).netloc, path=urlsplit(url).path, streamed=True) as s:
+            for attempt in range(self.max_retries + 1):
+                async with semaphore:
+                    s.set(priority=current()[0], queue_ms=await scheduler.acquire_async(upstream))
+                    try:
+                        response = await self.http.send(self.http.build_request(method, url, **kwargs), stream=True)
+                    except httpx.TransportError:
+                        if attempt == self.max_retries:
+                            raise
+                        response = None
+
+                    if response is not None and (response.status_code not in transport.RETRY_STATUSES or attempt == self.max_retries):
+                        s.set(status=response.status_code, retries=attempt)
+                        try:
+                            yield response
+                        finally:
+                            await response.aclose()
+                            s.set(response_bytes=response.num_bytes_downloaded)
+                        return
+                    if response is not None:
+                        await response.aclose()
+                await self._backoff(response, attempt)
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+    async def aclose(self):
+        await self.http.aclose()
+
+
+# httpx clients and asyncio primitives belong to one event loop, so there is one shared client per loop
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_client():
+    """The shared AsyncToolClient of the running event loop"""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = _clients[loop] = AsyncToolClient()
+    return client
+
+
+class UpstreamError(RuntimeError):
+    """A request of a batch tool failed, its items have no answer rather than an empty one"""
+
+
+def _json_or_raise(response, upstream):
+    value = _json_or_none(response)
+    if value is None:
+        raise UpstreamError(f"{upstream} request failed with status {response.status_code}")
+    return value
+
+
+def _json_or_none(response):
+    if response.status_code == 200:
+        with tracing.span("parse", format="json", bytes=len(response.content)):
+            return response.json()
+    print("API request failed. Status code:", response.status_code)
+    return None
+
+
+@cached("gnomad")
+async def tool_query_gnomad_by_rsid(rsid, fields=None):
+    local = gnomad_store.query_frequencies(rsid, fields)
+    if local is not None:
+        return local
+    response = await get_client().post(gnomad.GNOMAD_API, data={'query': gnomad.build_query(rsid, fields)})
+    return _json_or_none(response)
+
+
+async def tool_query_gnomad_by_rsids(rsids, fields=None):
+    results = {}
+    missing = []
+    unique = list(dict.fromkeys(rsids))
+    hits = await asyncio.gather(*(get_cached_async("tool_query_gnomad_by_rsid", {"rsid": rsid, "fields": fields}) for rsid in unique))
+    for rsid, hit in zip(unique, hits):
+        hit = hit or gnomad_store.query_frequencies(rsid, fields)
+        if hit is not None:
+            results[rsid] = (hit.get("data") or {}).get("variant")
+        else:
+            missing.append(rsid)
+
+    async def fetch(chunk):
+        response = await get_client().post(gnomad.GNOMAD_API, data={'query': gnomad.build_query(chunk, fields)})
+        data = _json_or_raise(response, "gnomAD").get("data") or {}
+        for i, rsid in enumerate(chunk):
+            variant = data.get(f"v{i}")
+            results[rsid] = variant
+            if variant is not None:
+                await set_cached_async("tool_query_gnomad_by_rsid", {"rsid": rsid, "fields": fields}, "gnomad", {"data": {"variant": variant}})
+
+    await asyncio.gather(*(fetch(chunk) for chunk in _chunks(missing, GNOMAD_BATCH_SIZE)))
+    return {rsid: results.get(rsid) for rsid in rsids}
+
+
+@cached("dbvar")
+async def tool_query_genomic_structural_variation_db_by_rsid(rsid):
+    local = dbvar_index.query_term(rsid)
+    if local is not None:
+        return local
+    response = await get_client().get(f"https://clinicaltables.nlm.nih.gov/api/dbvar/v3/search?terms={rsid}")
+    return _json_or_none(response)
+
+
+@cached("dbsnp")
+async def tool_query_single_nucleotide_polymorphisms_db_by_rsid(rsid):
+    response = await get_client().get(f"https://clinicaltables.nlm.nih.gov/api/snps/v3/search?terms={rsid}")
+    return _json_or_none(response)
+
+
+async def _vep_get(ext):
+    response = await get_client().get(ENSEMBL_SERVER + ext, params={"Geno2MP": 1}, headers={"Content-Type": "application/json"})
+    return _json_or_none(response)
+
+
+@cached("ensembl")
+async def tool_get_variant_consequences_by_id(id):
+    return await _vep_get(f"/vep/human/id/{id}")
+
+
+@cached("ensembl", equivalents=equivalent_calls)
+async def tool_get_variant_consequences_by_hgvs(hgvs_code):
+    return await _vep_get(f"/vep/human/hgvs/{hgvs_code}")
+
+
+@cached("ensembl", equivalents=equivalent_calls)
+async def tool_get_variant_consequences_by_region_and_allele(region, allele):
+    return await _vep_get(f"/vep/human/region/{region}/{allele}")
+
+
+async def _vep_batch(ext, payload_key, inputs, single_tool, single_args, server=ENSEMBL_SERVER, equivalents=equivalent_calls):
+    results = {}
+    missing = []
+    unique = list(dict.fromkeys(inputs))
+    hits = await asyncio.gather(*(get_cached_equivalent_async(single_tool, single_args(item), equivalents) for item in unique))
+    for item, hit in zip(unique, hits):
+        if hit is not None:
+            results[item] = hit
+        else:
+            missing.append(item)
+
+    async def fetch(chunk):
+        response = await get_client().post(server + ext, params={"Geno2MP": 1},
+                                           headers={"Content-Type": "application/json", "Accept": "application/json"},
+                                           json={payload_key: chunk})
+        for annotation in _json_or_raise(response, "Ensembl VEP"):
+            results.setdefault(annotation.get("input"), []).append(annotation)
+
+    # Ensembl's limiter in get_client() bounds how many chunks are in flight
+    await asyncio.gather(*(fetch(chunk) for chunk in _chunks(missing, VEP_POST_MAX_SIZE)))
+    await asyncio.gather(*(set_cached_async(single_tool, single_args(item), "ensembl", results[item])
+                           for item in missing if item in results))
+    return {item: results.get(item) for item in inputs}
+
+
+async def tool_get_variant_consequences_by_ids(ids):
+    return await _vep_batch("/vep/human/id", "ids", ids,
+                            "tool_get_variant_consequences_by_id", lambda item: {"id": item})
+
+
+async def tool_get_variant_consequences_by_hgvs_codes(hgvs_codes):
+    return await _vep_batch("/vep/human/hgvs", "hgvs_notations", hgvs_codes,
+                            "tool_get_variant_consequences_by_hgvs", lambda item: {"hgvs_code": item})
+
+
+async def tool_get_variant_consequences_by_regions_and_alleles(variants, assembly="GRCh38"):
+    """:param assembly: reference genome of the regions, picks the Ensembl server"""
+    by_input = {_region_to_vep_input(v["region"], v["allele"]): v for v in variants}
+
+    def single_args(item):
+        args = {"region": by_input[item]["region"], "allele": by_input[item]["allele"]}
+        # Results of other assemblies are cached apart from the GRCh38 ones of the chat tools
+        return args if assembly == "GRCh38" else {**args, "assembly": assembly}
+
+    results = await _vep_batch("/vep/human/region", "variants", list(by_input), "tool_get_variant_consequences_by_region_and_allele",
+                               single_args, ENSEMBL_SERVERS[assembly], equivalent_calls if assembly == "GRCh38" else None)
+    return {f'{v["region"]} {v["allele"]}': results[item] for item, v in by_input.items()}
+
+
+async def _mutation_taster_rows(variants):
+    """Parsed rows of one MutationTaster request, None if it failed"""
+    client = get_client()
+    url = f"{MUTATION_TASTER_API}?variants={','.join(variants)}"
+    response = await client.get(url)
+    if response.status_code != 200:
+        print("API request failed. Status code:", response.status_code)
+        return None
+    with tracing.span("parse", format="tsv", variants=len(variants)):
+        lines = response.iter_lines()
+        next(lines, None)  # header
+        return [_parse_mutation_taster_line(line.encode()) for line in lines if line]
+
+
+@cached("mutationtaster", equivalents=equivalent_calls)
+async def tool_get_mutation_tester_result(chromosome_coordinate, original_reference_allele, new_allele):
+    rows = await _mutation_taster_rows([_mutation_taster_variant(chromosome_coordinate, original_reference_allele, new_allele)])
+    if rows is None:
+        return None
+    return json.dumps(rows, indent=2)
+
+
+async def tool_get_mutation_tester_results(variants):
+    by_variant = {}
+    for v in variants:
+        args = {"chromosome_coordinate": v["chromosome_coordinate"],
+                "original_reference_allele": v["original_reference_allele"],
+                "new_allele": v["new_allele"]}
+        by_variant[_mutation_taster_variant(**args)] = args
+
+    results = {}
+    missing = []
+    hits = await asyncio.gather(*(get_cached_equivalent_async("tool_get_mutation_tester_result", args, equivalent_calls)
+                                  for args in by_variant.values()))
+    for variant, hit in zip(by_variant, hits):
+        if hit is not None:
+            results[variant] = json.loads(hit)
+        else:
+            missing.append(variant)
+
+    async def fetch(pack):
+        rows = await _mutation_taster_rows(pack)
+        if rows is None:
+            raise UpstreamError(f"MutationTaster request for {len(pack)} variants failed")
+        for row in rows:
+            key = row['id'] if row['id'] in by_variant else _row_variant(row)
+            results.setdefault(key, []).append(row)
+
+    await asyncio.gather(*(fetch(pack) for pack in _pack_variants(missing, MUTATION_TASTER_MAX_URL_LENGTH)))
+    await asyncio.gather(*(set_cached_async("tool_get_mutation_tester_result", by_variant[variant], "mutationtaster",
+                                            json.dumps(results[variant], indent=2))
+                           for variant in missing if variant in results))
+    return {variant: results.get(variant) for variant in by_variant}
+
+
+async def clinvar_rcv_records(rcv):
+    """Records of an RCV, fed chunk by chunk to a pull parser that drops each ClinVarSet once analysed"""
+    params = {"db": "clinvar", "rettype": "clinvarset", "id": rcv}
+    if NCBI_API_KEY:
+        params["api_key"] = NCBI_API_KEY
+    async with get_client().stream("GET", EFETCH_URL, params=params) as response:
+        if response.status_code != 200:
+            print("No response from clinvar!")
+            return None
+
+        records = []
+        parser = ET.XMLPullParser(events=("end",))
+        with tracing.span("parse", format="xml"):
+            async for chunk in response.aiter_bytes(64 * 1024):
+                parser.feed(chunk)
+                for _, elem in parser.read_events():
+                    if elem.tag == "ClinVarSet":
+                        records.append(clinvar_set_analyser(elem))
+                        elem.clear()
+            parser.close()
+    return records
+
+
+@cached("clinvar")
+async def tool_get_clinvar_data_by_rcv_code(rcv):
+    record = await asyncio.to_thread(clinvar_index.lookup_rcv, rcv)
+    if record is not None:
+        return record
+    records = await clinvar_rcv_records(rcv)
+    if records:
+        return records[-1]
+
+
+async def tool_get_raw_tool_output(raw_ref):
+    stored = await asyncio.to_thread(get_raw_output, raw_ref)
+    if stored is None:
+        return {"error": f"No raw output stored under {raw_ref}, call the original tool again"}
+    return stored
+
+
+async def tool_resolve_variant_identifiers(identifier):
+    # Local SQLite lookup, off the event loop like the other database reads
+    return await asyncio.to_thread(resolve, identifier)
+
+
+async def tool_query_structural_variants_by_region(chromosome, start, end, variant_type=None):
+    # Bisections over memory mapped arrays, quick enough to run on the event loop
+    return dbvar_index.query_region(chromosome, start, end, variant_type)
+
+
+async def tool_find_nearest_structural_variants(chromosome, position, count=5, variant_type=None):
+    return dbvar_index.query_nearest(chromosome, position, count, variant_type)
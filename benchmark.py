@@ -0,0 +1,386 @@
+"""
+Offline benchmark of the tool layer and the chat/tool dispatch loop
+
+Upstream APIs (gnomAD, Ensembl VEP, clinicaltables, eutils, MutationTaster) are
+replaced by a local stub server replaying the responses in benchmark_fixtures/,
+with configurable latency and error injection, and Mistral by a scripted client.
+
+    python benchmark.py
+    python benchmark.py --latency-ms 80 --error-rate 0.05 --iterations 50
+    python benchmark.py --budget single_variant_turn=400 --json bench.json
+
+With --budget SCENARIO=MS the exit code is 1 when a scenario's p95 exceeds its budget,
+which is how a CI job catches performance regressions without network access.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_fixtures")
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES, name), "rb") as f:
+        return f.read()
+
+
+class StubUpstream(ThreadingHTTPServer):
+    """Serves the recorded fixtures on every upstream path the tools use"""
+
+    daemon_threads = True
+
+    def __init__(self, latency_ms=0, jitter_ms=0, error_rate=0.0, port=0, seed=0):
+        super().__init__(("127.0.0.1", port), StubHandler)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.reset_counters()
+        self.gnomad_variant = json.loads(load_fixture("gnomad_variant.json"))["data"]["variant"]
+        self.vep = json.loads(load_fixture("vep.json"))
+        self.snps = load_fixture("snps.json")
+        self.dbvar = load_fixture("dbvar.json")
+        self.clinvar = load_fixture("clinvar.xml")
+        header, row = load_fixture("mutationtaster.tsv").decode().splitlines()
+        self.mutationtaster_header, self.mutationtaster_row = header, row
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def reset_counters(self):
+        with self.lock:
+            self.requests = 0
+            self.errors = 0
+            self.bytes_in = 0
+            self.bytes_out = 0
+
+    def count(self, bytes_in, bytes_out, error=False):
+        with self.lock:
+            self.requests += 1
+            self.errors += error
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def _select(value, words):
+    """Keeps only the fields a GraphQL query asked for, like the real API"""
+    if isinstance(value, dict):
+        return {k: _select(v, words) for k, v in value.items() if k in words}
+    if isinstance(value, list):
+        return [_select(v, words) for v in value]
+    return value
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes, without this delayed ACKs add ~40 ms per request
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body, content_type="application/json", bytes_in=0):
+        if isinstance(body, str):
+            body = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.count(bytes_in, len(body), error=status >= 400)
+
+    def _delay_or_fail(self, bytes_in):
+        server = self.server
+        delay = server.latency_ms + server.random.uniform(0, server.jitter_ms)
+        time.sleep(delay / 1000)
+        if server.error_rate and server.random.random() < server.error_rate:
+            self._reply(503, '{"error": "injected failure"}', bytes_in=bytes_in)
+            return True
+        return False
+
+    def do_GET(self):
+        if self._delay_or_fail(0):
+            return
+        parts = urlsplit(self.path)
+        path, query = parts.path, parse_qs(parts.query)
+        server = self.server
+
+        if path.startswith("/vep/human/"):
+            item = path.rsplit("/", 1)[-1] if "/id/" in path or "/hgvs/" in path else path.split("/region/", 1)[-1]
+            self._reply(200, json.dumps([dict(server.vep[0], input=item)]))
+        elif path == "/api/snps/v3/search":
+            self._reply(200, server.snps)
+        elif path == "/api/dbvar/v3/search":
+            self._reply(200, server.dbvar)
+        elif path == "/entrez/eutils/efetch.fcgi":
+            self._reply(200, server.clinvar, content_type="text/xml")
+        elif path == "/MT2021/MT_API102.cgi":
+            lines = [server.mutationtaster_header]
+            for variant in query.get("variants", [""])[0].split(","):
+                match = re.match(r"(\w+):(\d+)(\w+)>(\w+)", variant)
+                if match:
+                    chrom, pos, ref, alt = match.groups()
+                    lines.append(server.mutationtaster_row.format(variant=variant, chr=chrom, pos=pos, ref=ref, alt=alt))
+            self._reply(200, "\n".join(lines) + "\n", content_type="text/plain")
+        else:
+            self._reply(404, '{"error": "no fixture"}')
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        if self._delay_or_fail(length):
+            return
+        path = urlsplit(self.path).path
+        server = self.server
+
+        if path == "/api/":
+            query = parse_qs(body.decode())["query"][0]
+            words = set(re.findall(r"\w+", query))
+            variant = _select(server.gnomad_variant, words)
+            aliases = re.findall(r"(\w+): variant\(rsid: \"(\w+)\"", query)
+            if aliases:
+                data = {alias: dict(variant, rsid=rsid) for alias, rsid in aliases}
+            else:
+                data = {"variant": variant}
+            self._reply(200, json.dumps({"data": data}), bytes_in=length)
+        elif path.startswith("/vep/human/"):
+            payload = json.loads(body)
+            inputs = next(iter(payload.values()))
+            self._reply(200, json.dumps([dict(server.vep[0], input=item) for item in inputs]), bytes_in=length)
+        else:
+            self._reply(404, '{"error": "no fixture"}', bytes_in=length)
+
+
+class ScriptedMistralClient:
+    """Stands in for MistralClient.chat_stream: asks for a fixed set of tools, then streams an answer"""
+
+    def __init__(self, tool_calls, answer, latency_ms=0, chunk_size=20):
+        self.tool_calls = tool_calls
+        self.answer = answer
+        self.latency_ms = latency_ms
+        self.chunk_size = chunk_size
+
+    def _chunk(self, content=None, tool_calls=None, finish_reason=None, usage=None):
+        from mistralai.models.chat_completion import (
+            ChatCompletionResponseStreamChoice, ChatCompletionStreamResponse, DeltaMessage,
+        )
+        return ChatCompletionStreamResponse(
+            id="bench", model="bench", usage=usage,
+            choices=[ChatCompletionResponseStreamChoice(
+                index=0, delta=DeltaMessage(content=content, tool_calls=tool_calls), finish_reason=finish_reason,
+            )],
+        )
+
+    def chat_stream(self, messages, model=None, tools=None, tool_choice=None, **kwargs):
+        from mistralai.models.chat_completion import FunctionCall, ToolCall
+        from mistralai.models.common import UsageInfo
+
+        time.sleep(self.latency_ms / 1000)
+        prompt_tokens = sum(len(str(m.content)) for m in messages) // 4
+        if tool_choice != "none" and messages[-1].role == "user":
+            calls = [ToolCall(function=FunctionCall(name=name, arguments=json.dumps(args))) for name, args in self.tool_calls]
+            usage = UsageInfo(prompt_tokens=prompt_tokens, completion_tokens=20 * len(calls), total_tokens=prompt_tokens + 20 * len(calls))
+            yield self._chunk(tool_calls=calls, finish_reason="tool_calls", usage=usage)
+            return
+
+        for i in range(0, len(self.answer), self.chunk_size):
+            yield self._chunk(content=self.answer[i:i + self.chunk_size])
+        completion_tokens = len(self.answer) // 4
+        yield self._chunk(content="", finish_reason="stop",
+                          usage=UsageInfo(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, total_tokens=prompt_tokens + completion_tokens))
+
+
+SINGLE_VARIANT_TOOLS = [
+    ("tool_query_gnomad_by_rsid", {"rsid": "rs699"}),
+    ("tool_get_variant_consequences_by_id", {"id": "rs699"}),
+    ("tool_get_mutation_tester_result", {"chromosome_coordinate": "1:230845794", "original_reference_allele": "A", "new_allele": "G"}),
+    ("tool_query_single_nucleotide_polymorphisms_db_by_rsid", {"rsid": "rs699"}),
+]
+
+ANSWER = ("The variant rs699 (AGT p.Met268Thr) is common in gnomAD (popmax FAF95 2.1% in NFE), predicted tolerated by SIFT "
+          "and benign by PolyPhen. Per ACMG/AMP BA1 it is classified as benign for Mendelian disease. ") * 4
+
+
+def run_turn(client, tools_module, messages, service=None):
+    """The app's two round tool flow, without Streamlit rendering, with the tool calls run by service if given"""
+    from mistralai.models.chat_completion import ChatMessage
+    from chat import stream_chat, tool_round
+    from dispatch import run_tool_calls
+    from registry import build_registry
+
+    registry = build_registry(tools_module)
+    completion, deltas = tool_round(client, None, "bench", messages=messages, tools=tools_module.tools_json)
+    if deltas is not None:
+        "".join(deltas)
+    messages.append(completion.message)
+    if completion.tool_calls:
+        outputs = service.run_tool_calls(completion.tool_calls) if service is not None else run_tool_calls(completion.tool_calls, registry)
+        for function_name, output in outputs:
+            messages.append(ChatMessage(role="tool", function_name=function_name, content=output))
+        completion = stream_chat(client, model="bench", messages=messages, tools=tools_module.tools_json, tool_choice="none")
+        "".join(completion)
+        messages.append(completion.message)
+    return messages
+
+
+def scenarios(tools_module, llm_latency_ms, panel_size, sessions=8):
+    from mistralai.models.chat_completion import ChatMessage
+
+    client = ScriptedMistralClient(SINGLE_VARIANT_TOOLS, ANSWER, latency_ms=llm_latency_ms)
+    rsids = [f"rs{1000 + i}" for i in range(panel_size)]
+
+    def single_variant_turn():
+        run_turn(client, tools_module, [ChatMessage(role="system", content="bench"),
+                                        ChatMessage(role="user", content="Classify rs699")])
+
+    services = []
+
+    def shared_service_sessions():
+        # Concurrent sessions sharing one tool service with half as many workers as sessions
+        from tool_service import ToolService
+        if not services:
+            services.append(ToolService(tools_module.__name__, workers=max(1, sessions // 2)))
+        threads = [threading.Thread(target=run_turn, args=(client, tools_module, [
+            ChatMessage(role="system", content="bench"), ChatMessage(role="user", content="Classify rs699")], services[0]))
+            for _ in range(sessions)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    return {
+        "single_variant_turn": single_variant_turn,
+        "shared_service_sessions": shared_service_sessions,
+        "gnomad_single": lambda: tools_module.tool_query_gnomad_by_rsid("rs699"),
+        "gnomad_frequencies": lambda: tools_module.tool_query_gnomad_by_rsid("rs699", ["frequencies"]),
+        "clinvar_rcv": lambda: tools_module.tool_get_clinvar_data_by_rcv_code("RCV000019686"),
+        "panel_vep_ids": lambda: tools_module.tool_get_variant_consequences_by_ids(rsids),
+        "panel_gnomad_rsids": lambda: tools_module.tool_query_gnomad_by_rsids(rsids, ["frequencies"]),
+        "panel_mutationtaster": lambda: tools_module.tool_get_mutation_tester_results([
+            {"chromosome_coordinate": f"1:{230845794 + i}", "original_reference_allele": "A", "new_allele": "G"}
+            for i in range(panel_size)
+        ]),
+    }
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux and bytes on macOS; this is the process high-water mark
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def run_benchmarks(selected, iterations, warm, stub, tools_module, caches, llm_latency_ms, panel_size):
+    results = []
+    for name, operation in scenarios(tools_module, llm_latency_ms, panel_size).items():
+        if selected and name not in selected:
+            continue
+        stub.reset_counters()
+        timings = []
+        start = time.perf_counter()
+        for _ in range(iterations):
+            if not warm:
+                for cache in caches:
+                    cache.clear()
+            t0 = time.perf_counter()
+            operation()
+            timings.append((time.perf_counter() - t0) * 1000)
+        total = time.perf_counter() - start
+        results.append({
+            "scenario": name,
+            "iterations": iterations,
+            "p50_ms": round(statistics.median(timings), 2),
+            "p95_ms": round(percentile(timings, 95), 2),
+            "max_ms": round(max(timings), 2),
+            "throughput_per_s": round(iterations / total, 2),
+            "upstream_requests": stub.requests,
+            "upstream_errors": stub.errors,
+            "bytes_sent": stub.bytes_in,
+            "bytes_received": stub.bytes_out,
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+        })
+    return results
+
+
+def print_table(results):
+    columns = ["scenario", "p50_ms", "p95_ms", "throughput_per_s", "upstream_requests", "upstream_errors",
+               "bytes_sent", "bytes_received", "peak_rss_mb"]
+    widths = [max(len(c), *(len(str(r[c])) for r in results)) for c in columns]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+    for r in results:
+        print("  ".join(str(r[c]).ljust(w) for c, w in zip(columns, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=50, help="stub upstream latency per request")
+    parser.add_argument("--jitter-ms", type=float, default=10, help="random extra upstream latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of upstream requests answered with 503")
+    parser.add_argument("--llm-latency-ms", type=float, default=0, help="scripted Mistral latency per round")
+    parser.add_argument("--panel-size", type=int, default=250)
+    parser.add_argument("--upstream-rate", type=float, default=1000,
+                        help="requests per second the scheduler allows each upstream, the real APIs' limits would dominate the timings")
+    parser.add_argument("--warm", action="store_true", help="keep the tool and completion caches between iterations")
+    parser.add_argument("--scenario", action="append", help="only run this scenario, can be repeated")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--budget", action="append", default=[], metavar="SCENARIO=MS",
+                        help="fail when the scenario's p95 is above MS milliseconds")
+    args = parser.parse_args()
+
+    stub = StubUpstream(args.latency_ms, args.jitter_ms, args.error_rate).start()
+    workdir = tempfile.mkdtemp(prefix="llmhack-bench-")
+    # Configuration is read at import time, so it has to be in place before importing the tool modules
+    os.environ["LLMHACK_UPSTREAM_OVERRIDE"] = stub.url
+    os.environ["LLMHACK_CACHE_PATH"] = os.path.join(workdir, "cache.sqlite")
+    os.environ["LLMHACK_CLINVAR_INDEX"] = os.path.join(workdir, "clinvar_index.sqlite")
+    os.environ["LLMHACK_COMPLETION_CACHE_PATH"] = os.path.join(workdir, "completion_cache.sqlite")
+    os.environ["LLMHACK_RAW_OUTPUT_PATH"] = os.path.join(workdir, "raw_outputs.sqlite")
+    os.environ["LLMHACK_TRACE_PATH"] = ""
+    os.environ.setdefault("LLMHACK_MAX_RETRIES", "3")
+
+    import tools
+    from cache import tool_cache
+    from chat import completion_cache
+    from compact import raw_output_cache
+    from scheduler import scheduler
+    scheduler.rates, scheduler.default_rate = {}, args.upstream_rate
+
+    results = run_benchmarks(args.scenario, args.iterations, args.warm, stub, tools, (tool_cache, completion_cache, raw_output_cache),
+                             args.llm_latency_ms, args.panel_size)
+    print_table(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    budgets = dict(b.split("=", 1) for b in args.budget)
+    failed = [r for r in results if r["scenario"] in budgets and r["p95_ms"] > float(budgets[r["scenario"]])]
+    for r in failed:
+        print(f"{r['scenario']}: p95 {r['p95_ms']} ms is over the budget of {budgets[r['scenario']]} ms")
+    stub.shutdown()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,383 @@
+import asyncio
+import functools
+import inspect
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_PATH = os.getenv("LLMHACK_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".tool_cache.sqlite"))
+MEMORY_MAX_ENTRIES = int(os.getenv("LLMHACK_CACHE_MEMORY_ENTRIES", "512"))
+DISK_MAX_ENTRIES = int(os.getenv("LLMHACK_CACHE_DISK_ENTRIES", "50000"))
+# Disk hits whose access times are written together, they only order the trimming of the file
+ACCESS_BATCH = 100
+
+logger = logging.getLogger(__name__)
+
+DAY = 24 * 60 * 60
+
+# How long a response from each upstream stays valid, in seconds
+SOURCE_TTLS = {
+    "gnomad": 30 * DAY,
+    "ensembl": 7 * DAY,
+    "dbsnp": 30 * DAY,
+    "dbvar": 30 * DAY,
+    "mutationtaster": 30 * DAY,
+    "clinvar": 1 * DAY,
+}
+DEFAULT_TTL = 1 * DAY
+
+
+class ToolCache:
+    """
+    Two tier response cache: an in-process LRU in front of a SQLite file shared by all sessions
+    Both tiers hold the values as JSON, every hit decodes a copy of its own that the caller is free to modify.
+    """
+
+    def __init__(self, path=CACHE_PATH, memory_max_entries=MEMORY_MAX_ENTRIES, disk_max_entries=DISK_MAX_ENTRIES):
+        self.path = path
+        self.memory_max_entries = memory_max_entries
+        self.disk_max_entries = disk_max_entries
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+        self._db = None
+        self._writes = 0
+        # key -> access time of the disk hits not written yet
+        self._accessed = {}
+
+    def _connection(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            # WAL lets several Streamlit processes read while one writes
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key TEXT PRIMARY KEY, source TEXT, value TEXT, expires REAL, accessed REAL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        return self._db
+
+    def get(self, key, count_miss=True):
+        """
+        Returns the cached value or None on a miss
+        :param count_miss: False for a second look after a miss already counted
+        """
+        text = self._get_text(key, count_miss)
+        return json.loads(text) if text is not None else None
+
+    def _get_text(self, key, count_miss):
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                expires, text = entry
+                if expires > now:
+                    self.memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    return text
+                del self.memory[key]
+
+            try:
+                db = self._connection()
+                row = db.execute("SELECT value, expires FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None and row[1] > now:
+                    self._accessed[key] = now
+                    if len(self._accessed) >= ACCESS_BATCH:
+                        self._write_accessed(db)
+                        db.commit()
+                    self._remember(key, row[1], row[0])
+                    self.stats["disk_hits"] += 1
+                    return row[0]
+            except sqlite3.Error as e:
+                logger.warning("Tool cache read failed: %s", e)
+
+            if count_miss:
+                self.stats["misses"] += 1
+            return None
+
+    def set(self, key, source, value, ttl):
+        """Stores value, returns its JSON encoding"""
+        now = time.time()
+        expires = now + ttl
+        text = json.dumps(value)
+        with self.lock:
+            self._remember(key, expires, text)
+            try:
+                db = self._connection()
+                db.execute(
+                    "INSERT OR REPLACE INTO responses (key, source, value, expires, accessed) VALUES (?, ?, ?, ?, ?)",
+                    (key, source, text, expires, now),
+                )
+                self._accessed.pop(key, None)
+                self._writes += 1
+                # Trimming on every write would be wasteful, a bit of overshoot is fine
+                if self._writes % 100 == 0:
+                    self._write_accessed(db)
+                    self._trim_disk(db, now)
+                db.commit()
+            except sqlite3.Error as e:
+                logger.warning("Tool cache write failed: %s", e)
+        return text
+
+    def _remember(self, key, expires, text):
+        self.memory[key] = (expires, text)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_max_entries:
+            self.memory.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def _write_accessed(self, db):
+        db.executemany("UPDATE responses SET accessed = ? WHERE key = ?", [(accessed, key) for key, accessed in self._accessed.items()])
+        self._accessed.clear()
+
+    def _trim_disk(self, db, now):
+        db.execute("DELETE FROM responses WHERE expires <= ?", (now,))
+        db.execute(
+            "DELETE FROM responses WHERE key IN "
+            "(SELECT key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+            (self.disk_max_entries,),
+        )
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            self._accessed.clear()
+            try:
+                db = self._connection()
+                db.execute("DELETE FROM responses")
+                db.commit()
+            except sqlite3.Error as e:
+                logger.warning("Tool cache clear failed: %s", e)
+
+
+tool_cache = ToolCache()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls: the first caller of a key runs the function,
+    callers arriving while it is in flight wait for it and get the same result or exception.
+    Works across threads, and across tasks of an event loop for coroutine functions.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.tasks = {}
+        self.stats = {"leaders": 0, "coalesced": 0}
+
+    def do(self, key, func, *args, **kwargs):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+            self.stats["leaders" if leader else "coalesced"] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = func(*args, **kwargs)
+            return call.value
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+    async def do_async(self, key, func, *args, **kwargs):
+        # Futures belong to one event loop, each loop coalesces its own tasks
+        task_key = (id(asyncio.get_running_loop()), key)
+        with self.lock:
+            task = self.tasks.get(task_key)
+            leader = task is None
+            if leader:
+                task = self.tasks[task_key] = asyncio.ensure_future(func(*args, **kwargs))
+                task.add_done_callback(lambda _: self._forget(task_key))
+            self.stats["leaders" if leader else "coalesced"] += 1
+        # Shielded so a cancelled caller does not cancel the request the others are waiting for
+        return await asyncio.shield(task)
+
+    def _forget(self, task_key):
+        with self.lock:
+            self.tasks.pop(task_key, None)
+
+
+single_flight = SingleFlight()
+
+
+def cache_stats():
+    """Hit/miss counters of the shared tool cache"""
+    with tool_cache.lock:
+        stats = dict(tool_cache.stats)
+        stats["memory_entries"] = len(tool_cache.memory)
+    with single_flight.lock:
+        stats.update(single_flight.stats)
+    return stats
+
+
+def _normalize(name, value):
+    if isinstance(value, str):
+        value = value.strip()
+        # rsIDs are case insensitive, rs123 and RS123 are the same variant
+        if name in ("rsid", "id") and value[:2].lower() == "rs":
+            value = value.lower()
+    elif isinstance(value, (list, tuple)):
+        value = [_normalize(name, item) for item in value]
+    elif isinstance(value, dict):
+        value = {k: _normalize(k, v) for k, v in value.items()}
+    return value
+
+
+def cache_key(tool_name, args):
+    """Normalized key for a tool call: tool name plus its arguments in a canonical form"""
+    normalized = {name: _normalize(name, value) for name, value in args.items()}
+    return json.dumps([tool_name, normalized], sort_keys=True)
+
+
+def get_cached(tool_name, args):
+    """Cached result of tool_name(**args), or None"""
+    return tool_cache.get(cache_key(tool_name, args))
+
+
+_store_listeners = []
+
+
+def on_store(listener):
+    """Registers listener(tool_name, args, value), called with every fresh tool result that gets cached"""
+    _store_listeners.append(listener)
+    return listener
+
+
+def _notify_store(tool_name, args, value):
+    for listener in _store_listeners:
+        try:
+            listener(tool_name, args, value)
+        except Exception as e:
+            # Listeners only derive extra data, a failing one must not fail the tool call
+            logger.warning("Tool cache listener %s failed for %s: %r", listener.__name__, tool_name, e)
+
+
+def set_cached(tool_name, args, source, value, ttl=None):
+    """Stores value as the result of tool_name(**args), e.g. for results fetched by a batch call"""
+    ttl = ttl if ttl is not None else SOURCE_TTLS.get(source, DEFAULT_TTL)
+    tool_cache.set(cache_key(tool_name, args), source, value, ttl)
+    _notify_store(tool_name, args, value)
+
+
+def get_cached_equivalent(tool_name, args, equivalents):
+    """
+    Cached result of tool_name(**args) or, failing that, of an equivalent call
+    :param equivalents: callable(tool_name, args) giving (tool_name, args) pairs that return the same data
+    """
+    value = get_cached(tool_name, args)
+    if value is not None or equivalents is None:
+        return value
+    for other_tool, other_args in equivalents(tool_name, args):
+        value = get_cached(other_tool, other_args)
+        if value is not None:
+            return value
+    return None
+
+
+# The cache lookups and stores touch SQLite (and the listeners, the xref index), coroutines run
+# them on a worker thread so they don't hold up the event loop
+
+async def get_cached_async(tool_name, args):
+    return await asyncio.to_thread(get_cached, tool_name, args)
+
+
+async def set_cached_async(tool_name, args, source, value, ttl=None):
+    await asyncio.to_thread(set_cached, tool_name, args, source, value, ttl)
+
+
+async def get_cached_equivalent_async(tool_name, args, equivalents):
+    return await asyncio.to_thread(get_cached_equivalent, tool_name, args, equivalents)
+
+
+def _store(key, tool_name, arguments, source, value, ttl):
+    text = tool_cache.set(key, source, value, ttl)
+    _notify_store(tool_name, arguments, value)
+    return text
+
+
+def cached(source, ttl=None, equivalents=None):
+    """
+    Decorator caching a tool function's successful results
+    :param source: upstream name used to pick the TTL, see SOURCE_TTLS
+    :param ttl: overrides the source TTL, in seconds
+    :param equivalents: optional callable(tool_name, args) giving other (tool_name, args) calls
+        whose cached results answer this call too, checked on a miss
+    """
+    ttl = ttl if ttl is not None else SOURCE_TTLS.get(source, DEFAULT_TTL)
+
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = cache_key(func.__name__, bound.arguments)
+
+            value = get_cached_equivalent(func.__name__, dict(bound.arguments), equivalents)
+            if value is not None:
+                return value
+            # Identical calls made while this one is in flight wait for its result instead of hitting the upstream,
+            # each caller decodes a copy of its own
+            return json.loads(single_flight.do(key, fetch, key, dict(bound.arguments), *args, **kwargs))
+
+        def fetch(key, arguments, *args, **kwargs):
+            # A leader of the same key may have stored the result between the lookup above and this one taking over
+            text = tool_cache._get_text(key, count_miss=False)
+            if text is not None:
+                return text
+            value = func(*args, **kwargs)
+            # Failed lookups come back as None and are retried next time
+            if value is None:
+                return "null"
+            return _store(key, func.__name__, arguments, source, value, ttl)
+
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = cache_key(func.__name__, bound.arguments)
+
+            value = await get_cached_equivalent_async(func.__name__, dict(bound.arguments), equivalents)
+            if value is not None:
+                return value
+            return json.loads(await single_flight.do_async(key, async_fetch, key, dict(bound.arguments), *args, **kwargs))
+
+        async def async_fetch(key, arguments, *args, **kwargs):
+            text = await asyncio.to_thread(tool_cache._get_text, key, False)
+            if text is not None:
+                return text
+            value = await func(*args, **kwargs)
+            if value is None:
+                return "null"
+            return await asyncio.to_thread(_store, key, func.__name__, arguments, source, value, ttl)
+
+        # Async tools share the cache entries of their sync counterparts of the same name
+        wrapper = async_wrapper if inspect.iscoroutinefunction(func) else wrapper
+        wrapper.uncached = func
+        return wrapper
+
+    return decorator
@@ -0,0 +1,190 @@
+import hashlib
+import json
+import os
+
+from mistralai.models.chat_completion import ChatMessage
+
+import tracing
+from cache import DAY, ToolCache
+
+# Model of the round where tools are picked, empty for the model that answers
+TOOL_MODEL = os.getenv("LLMHACK_TOOL_MODEL", "")
+
+# LLMHACK_COMPLETION_CACHE=1 answers identical requests (demo cases, reruns of saved sessions) from
+# this cache instead of asking the model again
+COMPLETION_CACHE_ENABLED = os.getenv("LLMHACK_COMPLETION_CACHE", "0") == "1"
+COMPLETION_CACHE_PATH = os.getenv("LLMHACK_COMPLETION_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".completion_cache.sqlite"))
+COMPLETION_CACHE_TTL = int(os.getenv("LLMHACK_COMPLETION_CACHE_TTL", str(DAY)))
+COMPLETION_CACHE_MEMORY_ENTRIES = int(os.getenv("LLMHACK_COMPLETION_CACHE_MEMORY_ENTRIES", "64"))
+COMPLETION_CACHE_DISK_ENTRIES = int(os.getenv("LLMHACK_COMPLETION_CACHE_DISK_ENTRIES", "2000"))
+
+completion_cache = ToolCache(COMPLETION_CACHE_PATH, COMPLETION_CACHE_MEMORY_ENTRIES, COMPLETION_CACHE_DISK_ENTRIES)
+
+
+class StreamedCompletion:
+    """Iterates over the text deltas of a streamed chat completion while assembling the final message"""
+
+    def __init__(self, chunks, span=None, on_complete=None):
+        self.chunks = chunks
+        self.span = span
+        # Called with the completion once the model has finished, not when the stream is abandoned
+        self.on_complete = on_complete
+        self.content = []
+        self.tool_calls = []
+        self.usage = None
+        self.finish_reason = None
+        self._deltas = None
+
+    def __iter__(self):
+        self._deltas = self._iter_deltas()
+        return self._deltas
+
+    def _iter_deltas(self):
+        try:
+            for chunk in self.chunks:
+                if self.span is not None and "ttft_ms" not in self.span.attrs:
+                    self.span.set(ttft_ms=round(self.span.elapsed_ms(), 3))
+                if chunk.usage is not None:
+                    self.usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                choice = chunk.choices[0]
+                if choice.delta.tool_calls:
+                    self.tool_calls.extend(choice.delta.tool_calls)
+                if choice.delta.content:
+                    self.content.append(choice.delta.content)
+                    yield choice.delta.content
+                if choice.finish_reason is not None:
+                    self.finish_reason = choice.finish_reason
+        finally:
+            if self.span is not None:
+                self.span.set(
+                    finish_reason=self.finish_reason,
+                    tool_calls=len(self.tool_calls),
+                    completion_chars=sum(len(c) for c in self.content),
+                    prompt_tokens=self.usage.prompt_tokens if self.usage else None,
+                    completion_tokens=self.usage.completion_tokens if self.usage else None,
+                )
+                self.span.end()
+            if self.on_complete is not None and self.finish_reason is not None:
+                self.on_complete(self)
+
+    def consume(self):
+        """Drains the stream without rendering it"""
+        for _ in self:
+            pass
+        return self
+
+    def close(self):
+        """Abandons the completion, closing its stream and the connection it is read from"""
+        if self._deltas is not None:
+            self._deltas.close()
+        close = getattr(self.chunks, "close", None)
+        if close is not None:
+            close()
+
+    @property
+    def message(self):
+        return ChatMessage(role="assistant", content="".join(self.content), tool_calls=self.tool_calls or None)
+
+    def to_dict(self):
+        return {
+            "content": "".join(self.content),
+            "tool_calls": [tool_call.model_dump(mode="json") for tool_call in self.tool_calls],
+            "finish_reason": self.finish_reason,
+            "usage": self.usage.model_dump(mode="json") if self.usage is not None else None,
+        }
+
+
+def _replay(value, model):
+    """The chunk stream of a cached completion"""
+    from mistralai.models.chat_completion import (
+        ChatCompletionResponseStreamChoice, ChatCompletionStreamResponse, DeltaMessage, ToolCall,
+    )
+    from mistralai.models.common import UsageInfo
+
+    yield ChatCompletionStreamResponse(
+        id="cached", model=model or "cached",
+        usage=UsageInfo(**value["usage"]) if value["usage"] else None,
+        choices=[ChatCompletionResponseStreamChoice(
+            index=0,
+            delta=DeltaMessage(content=value["content"] or None,
+                               tool_calls=[ToolCall(**tool_call) for tool_call in value["tool_calls"]] or None),
+            finish_reason=value["finish_reason"],
+        )],
+    )
+
+
+def _jsonable(value):
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(item) for item in value]
+    return value.model_dump(mode="json") if hasattr(value, "model_dump") else value
+
+
+def completion_key(kwargs):
+    """Hash of everything the completion depends on: model, messages, tools, tool choice and sampling settings"""
+    payload = json.dumps({name: _jsonable(value) for name, value in kwargs.items()}, sort_keys=True, default=str)
+    return "completion:" + hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _message_bytes(messages):
+    return sum(len(json.dumps(m.model_dump() if hasattr(m, "model_dump") else m, default=str)) for m in messages)
+
+
+def stream_chat(client, use_cache=COMPLETION_CACHE_ENABLED, **kwargs):
+    """
+    Starts a streamed chat completion, kwargs are those of MistralClient.chat
+    :param use_cache: answer an exact repeat of an earlier request from the completion cache
+    """
+    span = tracing.start_span(
+        "llm",
+        model=kwargs.get("model"),
+        tool_choice=kwargs.get("tool_choice"),
+        messages=len(kwargs.get("messages", [])),
+        request_bytes=_message_bytes(kwargs.get("messages", [])),
+    )
+    if not use_cache:
+        return StreamedCompletion(client.chat_stream(**kwargs), span)
+
+    key = completion_key(kwargs)
+    value = completion_cache.get(key)
+    if value is not None:
+        span.set(cached=True)
+        return StreamedCompletion(_replay(value, kwargs.get("model")), span)
+    return StreamedCompletion(client.chat_stream(**kwargs), span,
+                              on_complete=lambda completion: completion_cache.set(key, "llm", completion.to_dict(), COMPLETION_CACHE_TTL))
+
+
+def tool_round(client, tool_model, answer_model, **kwargs):
+    """
+    First round of a turn, where the model may call tools
+    With a tool_model other than answer_model, that model only picks the tools: when it starts
+    answering with text instead, the answer model is asked for the answer, without tools.
+    :param kwargs: those of MistralClient.chat, except model and tool_choice
+    :return: (completion, iterator over its text deltas or None if it only has tool calls)
+    """
+    completion = stream_chat(client, model=tool_model or answer_model, tool_choice="auto", **kwargs)
+    deltas = first_and_rest(completion)
+    if deltas is None or not tool_model or tool_model == answer_model:
+        return completion, deltas
+    # The tool model's text is not shown, its stream is closed before the answer model is asked
+    completion.close()
+    completion = stream_chat(client, model=answer_model, tool_choice="none", **kwargs)
+    return completion, iter(completion)
+
+
+def first_and_rest(completion):
+    """
+    Waits for the first text delta of a completion
+    :return: iterator over all text deltas, or None if the completion has no text (e.g. only tool calls)
+    """
+    deltas = iter(completion)
+    first = next(deltas, None)
+    if first is None:
+        return None
+
+    def all_deltas():
+        yield first
+        yield from deltas
+
+    return all_deltas()
@@ -1,5 +1,10 @@
+import gzip
 import xml.etree.ElementTree as ET
-import requests
+import transport
+import tracing
+
+EFETCH_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi"
+
 
 def clinvar_rcv_retriever(rcv):
     """
@@ -8,10 +13,9 @@ def clinvar_rcv_retriever(rcv):
     :return: XML root (element tree format)
     """
 
-    url = f"https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi?" \
-                      "db=clinvar&rettype=clinvarset&id={rcv}"
+    url = EFETCH_URL
 
-    response = requests.get(url)
+    response = transport.get(url, params={"db": "clinvar", "rettype": "clinvarset", "id": rcv})
 
     if response.status_code != 200:
         print("No response from clinvar!")
@@ -21,6 +25,67 @@ def clinvar_rcv_retriever(rcv):
         return root
 
 
+def _join(values):
+    if not values:
+        return "None"
+    t = ",".join(values)
+    if t[-1] == ",": t = t[:-1]
+    return t
+
+
+def clinvar_set_analyser(child):
+    """
+    Python style storing of the information of a single ClinVarSet element
+    :param child: ClinVarSet element
+    :return: Python dictionary having variant information
+    """
+    clinvar_info = {}
+
+    # Latest update time
+    assertion = child.find("ReferenceClinVarAssertion")
+    clinvar_info["last_update"] = assertion.attrib.get("DateLastUpdated")
+
+    # RCV accession to check with our RCVs
+    accession = child.find("ReferenceClinVarAssertion/ClinVarAccession")
+    clinvar_info["accession"] = accession.attrib.get("Acc") if accession is not None else None
+
+    # Clinical significance of the variant
+    if (clinvar_sig := child.find("ReferenceClinVarAssertion/ClinicalSignificance/Description")) is not None:
+        clinvar_info["clinvar_sig"] = clinvar_sig.text
+
+    # The source of the significance and any annotations
+    method_type = child.find("ReferenceClinVarAssertion/ObservedIn/Method/MethodType")
+    clinvar_info["source_type"] = method_type.text if method_type is not None else None
+
+    # Functional and molecular consequences of the variants if any
+    fcons_list, mcons_list = [], []
+    for node in child.findall("ReferenceClinVarAssertion/MeasureSet/Measure/AttributeSet"):
+        # Functional Consequences
+        cons_node2 = node.find("Attribute[@Type='FunctionalConsequence']")
+        if cons_node2 is not None and cons_node2.text:
+            fcons_list.append(cons_node2.text)
+
+        # Molecular Consequences
+        cons_node3 = node.find("Attribute[@Type='MolecularConsequence']")
+        if cons_node3 is not None and cons_node3.text:
+            mcons_list.append(cons_node3.text)
+
+    clinvar_info["functional_consq"] = _join(fcons_list)
+    clinvar_info["molecular_consq"] = _join(mcons_list)
+
+    # Disease mechanism of the variants
+    trait_list = []
+    for node in child.findall("ReferenceClinVarAssertion/TraitSet/Trait/AttributeSet"):
+        # Disease mechanism
+        trait_node2 = node.find("Attribute[@Type='disease mechanism']")
+        if trait_node2 is not None and trait_node2.text:
+            trait_list.append(trait_node2.text)
+
+    clinvar_info["disease_mech"] = _join(trait_list)
+
+    return clinvar_info
+
+
 def clinvar_rcv_analyser(root):
     """
     Python style storing of variant information from ClinVar XML
@@ -30,70 +95,49 @@ def clinvar_rcv_analyser(root):
     clinvar_info = {}
 
     for child in root:
+        clinvar_info = clinvar_set_analyser(child)
+
+    return clinvar_info
 
-        # Latest update time
-        clinvar_info["last_update"] = child.find("ReferenceClinVarAssertion").attrib["DateLastUpdated"]
-
-        # RCV accession to check with our RCVs
-        clinvar_info["accession"] = child.find("ReferenceClinVarAssertion/ClinVarAccession").attrib["Acc"]
-
-        # Clinical significance of the variant
-        
-        if clinvar_sig := child.find("ReferenceClinVarAssertion/ClinicalSignificance/Description") is not None:
-          clinvar_info["clinvar_sig"] = clinvar_sig.text
-
-        # The source of the significance and any annotations
-        clinvar_info["source_type"] = child.find("ReferenceClinVarAssertion/ObservedIn/Method/MethodType").text
-
-        # Functional and molecular consequences of the variants if any
-        cons_node = child.find("ReferenceClinVarAssertion/MeasureSet/Measure").findall("AttributeSet")
-        fcons_list, mcons_list = [], []
-        for node in cons_node:
-            # Functional Consequences
-            cons_node2 = node.find("Attribute[@Type='FunctionalConsequence']")
-            if cons_node2 is not None:
-                fcons_list.append(cons_node2.text)
-            else:
-                continue
-
-            # Molecular Consequences
-            cons_node3 = node.find("Attribute[@Type='MolecularConsequence']")
-            if cons_node3 is not None:
-                mcons_list.apend(cons_node3.text)
-            else:
-                continue
-
-        if not fcons_list:
-            clinvar_info["functional_consq"] = "None"
-        else:
-            t = ",".join(fcons_list)
-            if t[-1] == ",": t = t[:-1]
-            clinvar_info["functional_consq"] = t
-
-        if not mcons_list:
-            clinvar_info["molecular_consq"] = "None"
-        else:
-            t = ",".join(mcons_list)
-            if t[-1] == ",": t = t[:-1]
-            clinvar_info["molecular_consq"] = t
-
-        # Disease mechanism of the variants
-        trait_node = child.find("ReferenceClinVarAssertion/TraitSet/Trait").findall("AttributeSet")
-        trait_list = []
-
-        for node in trait_node:
-            # Disease mechanism
-            trait_node2 = node.find("Attribute[@Type='disease mechanism']")
-            if trait_node2 is not None:
-                trait_list.append(trait_node2.text)
-            else:
-                continue
-
-        if not trait_list:
-            clinvar_info["disease_mech"] = "None"
-        else:
-            t = ",".join(trait_list)
-            if t[-1] == ",": t = t[:-1]
-            clinvar_info["disease_mech"] = t
-
-    return clinvar_info
\ No newline at end of file
+
+def iter_clinvar_sets(source, analyser=clinvar_set_analyser):
+    """
+    Streams ClinVarSet records out of ClinVar XML with flat memory use
+    :param source: path of a ClinVar XML file (optionally .gz, e.g. ClinVarFullRelease) or a binary file object
+    :param analyser: function turning one ClinVarSet element into a record
+    :return: generator of records, one per ClinVarSet
+    """
+    if isinstance(source, str) and source.endswith(".gz"):
+        with gzip.open(source, "rb") as f:
+            yield from iter_clinvar_sets(f, analyser)
+        return
+
+    root = None
+    for event, elem in ET.iterparse(source, events=("start", "end")):
+        if root is None:
+            root = elem
+        if event == "end" and elem.tag == "ClinVarSet":
+            yield analyser(elem)
+            # Drop the parsed set and its now empty shell from the document root
+            elem.clear()
+            root.clear()
+
+
+def clinvar_rcv_records(rcv):
+    """
+    Streams the records of an RCV straight from the ClinVar API response
+    :param rcv: Variant Disease Record id
+    :return: list of Python dictionaries having variant information, None if ClinVar did not answer
+    """
+    response = transport.get(EFETCH_URL, params={"db": "clinvar", "rettype": "clinvarset", "id": rcv}, stream=True)
+
+    if response.status_code != 200:
+        print("No response from clinvar!")
+        response.close()
+        return None
+
+    with response, tracing.span("parse", format="xml") as s:
+        response.raw.decode_content = True
+        records = list(iter_clinvar_sets(response.raw))
+        s.set(records=len(records))
+        return records
@@ -0,0 +1,240 @@
+"""
+Local ClinVar index for offline RCV, rsID and chrom/pos/ref/alt lookups
+
+Build it from a ClinVar release, either the XML (ClinVarFullRelease_*.xml.gz)
+or the variant_summary.txt.gz TSV:
+
+    python clinvar_index.py import ClinVarFullRelease_00-latest.xml.gz
+    python clinvar_index.py import variant_summary.txt.gz --assembly GRCh37
+"""
+import argparse
+import csv
+import gzip
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from clinvar import clinvar_set_analyser, iter_clinvar_sets
+
+INDEX_PATH = os.getenv("LLMHACK_CLINVAR_INDEX", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".clinvar_index.sqlite"))
+DEFAULT_ASSEMBLY = "GRCh37"
+BATCH_SIZE = 10000
+
+_local = threading.local()
+
+
+def _normalize_rsid(rsid):
+    rsid = str(rsid).strip().lower()
+    return rsid if rsid.startswith("rs") else "rs" + rsid
+
+
+def _normalize_chrom(chrom):
+    chrom = str(chrom).strip()
+    return chrom[3:] if chrom.lower().startswith("chr") else chrom
+
+
+def _variant_key(chrom, pos, ref, alt):
+    return (_normalize_chrom(chrom), int(pos), ref.upper(), alt.upper())
+
+
+def _xml_index_keys(elem, assembly):
+    """rsIDs and VCF style coordinates of a ClinVarSet element"""
+    rsids, variants = set(), set()
+    for measure in elem.iterfind("ReferenceClinVarAssertion/MeasureSet/Measure"):
+        for xref in measure.iterfind("XRef[@DB='dbSNP']"):
+            if xref.get("ID"):
+                rsids.add(_normalize_rsid(xref.get("ID")))
+        for location in measure.iterfind(f"SequenceLocation[@Assembly='{assembly}']"):
+            pos, ref, alt = location.get("positionVCF"), location.get("referenceAlleleVCF"), location.get("alternateAlleleVCF")
+            if pos and ref and alt:
+                variants.add(_variant_key(location.get("Chr"), pos, ref, alt))
+    return rsids, variants
+
+
+def iter_xml_entries(path, assembly=DEFAULT_ASSEMBLY):
+    """(record, rsids, variants) for every ClinVarSet of a ClinVar XML release"""
+    def analyser(elem):
+        rsids, variants = _xml_index_keys(elem, assembly)
+        return clinvar_set_analyser(elem), rsids, variants
+
+    return iter_clinvar_sets(path, analyser)
+
+
+def iter_variant_summary_entries(path, assembly=DEFAULT_ASSEMBLY):
+    """(record, rsids, variants) for every RCV of a variant_summary TSV, in the clinvar_rcv_analyser shape"""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", newline="") as f:
+        for row in csv.DictReader(f, delimiter="\t"):
+            if row.get("Assembly") != assembly:
+                continue
+
+            rs = row.get("RS# (dbSNP)", "-1")
+            rsids = {_normalize_rsid(rs)} if rs not in ("", "-1") else set()
+            variants = set()
+            if row.get("PositionVCF", "-1") not in ("", "-1", "na") and row.get("ReferenceAlleleVCF", "na") != "na":
+                variants.add(_variant_key(row["Chromosome"], row["PositionVCF"], row["ReferenceAlleleVCF"], row["AlternateAlleleVCF"]))
+
+            for accession in filter(None, row.get("RCVaccession", "").split("|")):
+                # The summary has no per-RCV assertion details, those fields stay "None" like in the analyser
+                record = {
+                    "last_update": row.get("LastEvaluated"),
+                    "accession": accession,
+                    "clinvar_sig": row.get("ClinicalSignificance"),
+                    "source_type": None,
+                    "functional_consq": "None",
+                    "molecular_consq": "None",
+                    "disease_mech": "None",
+                }
+                yield record, rsids, variants
+
+
+def _create_schema(db):
+    db.executescript("""
+        CREATE TABLE IF NOT EXISTS records (accession TEXT PRIMARY KEY, record TEXT);
+        CREATE TABLE IF NOT EXISTS rsids (rsid TEXT, accession TEXT);
+        CREATE TABLE IF NOT EXISTS variants (chrom TEXT, pos INTEGER, ref TEXT, alt TEXT, accession TEXT);
+    """)
+
+
+def _create_indexes(db):
+    db.executescript("""
+        CREATE INDEX IF NOT EXISTS rsids_rsid ON rsids (rsid);
+        CREATE INDEX IF NOT EXISTS variants_key ON variants (chrom, pos, ref, alt);
+    """)
+
+
+def import_release(path, index_path=INDEX_PATH, assembly=DEFAULT_ASSEMBLY):
+    """
+    Builds the local index from a ClinVar release, replacing any previous index
+    :param path: ClinVar XML (.xml/.xml.gz) or variant_summary TSV (.txt/.txt.gz/.tsv)
+    :param index_path: where to write the SQLite index
+    :param assembly: assembly of the indexed coordinates
+    :return: number of indexed RCV records
+    """
+    is_xml = ".xml" in os.path.basename(path)
+    entries = iter_xml_entries(path, assembly) if is_xml else iter_variant_summary_entries(path, assembly)
+
+    tmp_path = index_path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    db = sqlite3.connect(tmp_path)
+    # A half written index is thrown away anyway, no need for durability while importing
+    db.execute("PRAGMA journal_mode=OFF")
+    db.execute("PRAGMA synchronous=OFF")
+    _create_schema(db)
+
+    records, rsid_rows, variant_rows = [], [], []
+    count = 0
+
+    def flush():
+        db.executemany("INSERT OR REPLACE INTO records VALUES (?, ?)", records)
+        db.executemany("INSERT INTO rsids VALUES (?, ?)", rsid_rows)
+        db.executemany("INSERT INTO variants VALUES (?, ?, ?, ?, ?)", variant_rows)
+        records.clear(); rsid_rows.clear(); variant_rows.clear()
+
+    for record, rsids, variants in entries:
+        accession = record.get("accession")
+        if not accession:
+            continue
+        records.append((accession, json.dumps(record, separators=(",", ":"))))
+        rsid_rows.extend((rsid, accession) for rsid in rsids)
+        variant_rows.extend(variant + (accession,) for variant in variants)
+        count += 1
+        if len(records) >= BATCH_SIZE:
+            flush()
+    flush()
+
+    _create_indexes(db)
+    db.commit()
+    db.close()
+    stale = getattr(_local, "connections", {}).pop(index_path, None)
+    if stale is not None:
+        stale.close()
+    os.replace(tmp_path, index_path)
+    return count
+
+
+def _connection(index_path=INDEX_PATH):
+    """Read only connection of this thread, None if no index was imported"""
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    if index_path not in connections:
+        if not os.path.exists(index_path):
+            return None
+        connections[index_path] = sqlite3.connect(f"file:{index_path}?mode=ro", uri=True)
+    return connections[index_path]
+
+
+def _records(db, accessions):
+    records = []
+    for accession in dict.fromkeys(accessions):
+        row = db.execute("SELECT record FROM records WHERE accession = ?", (accession,)).fetchone()
+        if row is not None:
+            records.append(json.loads(row[0]))
+    return records
+
+
+def lookup_rcv(rcv, index_path=INDEX_PATH):
+    """Indexed record of an RCV accession, None if not indexed"""
+    db = _connection(index_path)
+    if db is None:
+        return None
+    row = db.execute("SELECT record FROM records WHERE accession = ?", (rcv.strip().upper(),)).fetchone()
+    return json.loads(row[0]) if row is not None else None
+
+
+def lookup_rsid(rsid, index_path=INDEX_PATH):
+    """Indexed records of all RCVs of an rsID"""
+    db = _connection(index_path)
+    if db is None:
+        return []
+    rows = db.execute("SELECT accession FROM rsids WHERE rsid = ?", (_normalize_rsid(rsid),)).fetchall()
+    return _records(db, [row[0] for row in rows])
+
+
+def lookup_variant(chrom, pos, ref, alt, index_path=INDEX_PATH):
+    """Indexed records of all RCVs of a chrom/pos/ref/alt variant"""
+    db = _connection(index_path)
+    if db is None:
+        return []
+    rows = db.execute(
+        "SELECT accession FROM variants WHERE chrom = ? AND pos = ? AND ref = ? AND alt = ?",
+        _variant_key(chrom, pos, ref, alt),
+    ).fetchall()
+    return _records(db, [row[0] for row in rows])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = subparsers.add_parser("import", help="build the index from a ClinVar release")
+    import_parser.add_argument("release", help="ClinVar XML or variant_summary TSV, optionally gzipped")
+    import_parser.add_argument("--index", default=INDEX_PATH, help="index file to write")
+    import_parser.add_argument("--assembly", default=DEFAULT_ASSEMBLY, help="assembly of the indexed coordinates")
+
+    lookup_parser = subparsers.add_parser("lookup", help="look a variant up in the index")
+    lookup_parser.add_argument("key", help="RCV accession, rsID or chrom:pos:ref:alt")
+    lookup_parser.add_argument("--index", default=INDEX_PATH, help="index file to read")
+
+    args = parser.parse_args()
+    if args.command == "import":
+        start = time.time()
+        count = import_release(args.release, args.index, args.assembly)
+        print(f"Indexed {count} RCV records into {args.index} in {time.time() - start:.1f}s")
+    else:
+        key = args.key.strip()
+        if key.upper().startswith("RCV"):
+            result = lookup_rcv(key, args.index)
+        elif key.lower().startswith("rs"):
+            result = lookup_rsid(key, args.index)
+        else:
+            result = lookup_variant(*key.split(":"), index_path=args.index)
+        print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+import hashlib
+import json
+import os
+
+from cache import DAY, ToolCache
+
+# Set LLMHACK_COMPACT_TOOL_OUTPUT=0 to send raw tool payloads to the model again
+COMPACT_TOOL_OUTPUT = os.getenv("LLMHACK_COMPACT_TOOL_OUTPUT", "1") != "0"
+RAW_OUTPUT_TTL = 7 * DAY
+# Raw payloads are large and only fetched back on demand, they get a cache of their own so they
+# don't evict the tool responses
+RAW_OUTPUT_PATH = os.getenv("LLMHACK_RAW_OUTPUT_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".raw_outputs.sqlite"))
+RAW_OUTPUT_MEMORY_ENTRIES = int(os.getenv("LLMHACK_RAW_OUTPUT_MEMORY_ENTRIES", "32"))
+RAW_OUTPUT_DISK_ENTRIES = int(os.getenv("LLMHACK_RAW_OUTPUT_DISK_ENTRIES", "5000"))
+
+raw_output_cache = ToolCache(RAW_OUTPUT_PATH, RAW_OUTPUT_MEMORY_ENTRIES, RAW_OUTPUT_DISK_ENTRIES)
+
+# Continental groups, the XX/XY splits are left out of the summary
+GNOMAD_POPULATIONS = ("afr", "amr", "asj", "eas", "fin", "nfe", "oth", "sas")
+
+
+def _af(ac, an):
+    return round(ac / an, 6) if an else None
+
+
+def summarize_gnomad_variant(variant):
+    """Frequency and canonical consequence of a gnomAD variant, what ACMG population frequency criteria need"""
+    if not variant:
+        return variant
+    summary = {key: variant.get(key) for key in ("variantId", "rsid", "chrom", "pos", "ref", "alt") if key in variant}
+    if variant.get("flags"):
+        summary["flags"] = variant["flags"]
+
+    for sequencing_type in ("exome", "genome"):
+        data = variant.get(sequencing_type)
+        if not data:
+            continue
+        faf95 = data.get("faf95") or {}
+        summary[sequencing_type] = {
+            "ac": data.get("ac"),
+            "an": data.get("an"),
+            "af": _af(data.get("ac"), data.get("an")),
+            "ac_hom": data.get("ac_hom"),
+            "ac_hemi": data.get("ac_hemi"),
+            "popmax_faf95": faf95.get("popmax"),
+            "popmax_population": faf95.get("popmax_population"),
+            "filters": data.get("filters"),
+            "populations": {
+                p["id"]: {"ac": p.get("ac"), "an": p.get("an"), "ac_hom": p.get("ac_hom")}
+                for p in data.get("populations") or [] if p.get("id") in GNOMAD_POPULATIONS
+            },
+        }
+
+    consequences = variant.get("sortedTranscriptConsequences") or []
+    canonical = next((c for c in consequences if c.get("canonical")), consequences[0] if consequences else None)
+    if canonical:
+        summary["canonical_consequence"] = {
+            key: canonical.get(key) for key in (
+                "gene_symbol", "transcript_id", "major_consequence", "hgvsc", "hgvsp",
+                "lof", "lof_filter", "sift_prediction", "polyphen_prediction",
+            ) if canonical.get(key) is not None
+        }
+    return summary
+
+
+def summarize_gnomad(result):
+    # Single lookups come as the raw GraphQL answer, batches as rsid -> variant
+    if isinstance(result, dict) and "data" in result:
+        summary = {"variant": summarize_gnomad_variant((result.get("data") or {}).get("variant"))}
+        if result.get("errors"):
+            summary["errors"] = [e.get("message") for e in result["errors"]]
+        return summary
+    return {rsid: summarize_gnomad_variant(variant) for rsid, variant in result.items()}
+
+
+def summarize_vep_annotation(annotation):
+    """Location, most severe consequence and canonical transcript effect of one VEP result"""
+    summary = {key: annotation.get(key) for key in ("input", "id", "allele_string", "most_severe_consequence", "assembly_name")
+               if annotation.get(key) is not None}
+    summary["location"] = f"{annotation.get('seq_region_name')}:{annotation.get('start')}-{annotation.get('end')}"
+
+    colocated = annotation.get("colocated_variants") or []
+    if colocated:
+        summary["colocated"] = [
+            {key: c.get(key) for key in ("id", "clin_sig", "minor_allele_freq", "frequencies") if c.get(key) is not None}
+            for c in colocated
+        ]
+
+    transcripts = annotation.get("transcript_consequences") or []
+    canonical = next((t for t in transcripts if t.get("canonical")), transcripts[0] if transcripts else None)
+    if canonical:
+        summary["canonical_transcript"] = {
+            key: canonical.get(key) for key in (
+                "gene_symbol", "transcript_id", "consequence_terms", "impact", "hgvsc", "hgvsp", "amino_acids",
+                "protein_start", "sift_prediction", "sift_score", "polyphen_prediction", "polyphen_score",
+            ) if canonical.get(key) is not None
+        }
+    summary["transcript_count"] = len(transcripts)
+    return summary
+
+
+def summarize_vep(result):
+    if isinstance(result, dict):
+        return {key: summarize_vep(annotations) if annotations is not None else None for key, annotations in result.items()}
+    return [summarize_vep_annotation(annotation) for annotation in result]
+
+
+def summarize_mutation_taster_rows(rows):
+    summary = []
+    for row in rows:
+        compact_row = {key: row.get(key) for key in ("id", "chr", "pos", "ref", "alt", "transcript_stable", "prediction", "model", "tree_vote")}
+        if compact_row not in summary:
+            summary.append(compact_row)
+    return summary
+
+
+def summarize_mutation_taster(result):
+    # The single variant tool returns a JSON string, the batch tool variant -> rows
+    if isinstance(result, str):
+        result = json.loads(result)
+    if isinstance(result, dict):
+        return {variant: summarize_mutation_taster_rows(rows) if rows is not None else None for variant, rows in result.items()}
+    return summarize_mutation_taster_rows(result)
+
+
+SUMMARIZERS = {
+    "tool_query_gnomad_by_rsid": summarize_gnomad,
+    "tool_query_gnomad_by_rsids": summarize_gnomad,
+    "tool_get_variant_consequences_by_id": summarize_vep,
+    "tool_get_variant_consequences_by_hgvs": summarize_vep,
+    "tool_get_variant_consequences_by_region_and_allele": summarize_vep,
+    "tool_get_variant_consequences_by_ids": summarize_vep,
+    "tool_get_variant_consequences_by_hgvs_codes": summarize_vep,
+    "tool_get_variant_consequences_by_regions_and_alleles": summarize_vep,
+    "tool_get_mutation_tester_result": summarize_mutation_taster,
+    "tool_get_mutation_tester_results": summarize_mutation_taster,
+}
+
+
+def store_raw_output(function_name, args, result):
+    """Keeps a raw tool payload out of the chat, returns the reference it can be fetched with"""
+    digest = hashlib.sha1(json.dumps([function_name, args, result], sort_keys=True).encode()).hexdigest()[:16]
+    ref = f"raw-{digest}"
+    raw_output_cache.set(ref, "raw", {"tool": function_name, "arguments": args, "output": result}, RAW_OUTPUT_TTL)
+    return ref
+
+
+def get_raw_output(ref):
+    """Raw payload stored under ref, None if unknown or expired"""
+    return raw_output_cache.get(ref)
+
+
+def compact_tool_output(function_name, args, result):
+    """
+    Reduces a tool payload to the ACMG relevant fields before it goes into the model's context
+    :param function_name: tool that produced the result
+    :param args: arguments of the call
+    :param result: the tool's return value
+    :return: JSON serializable value to send to the model
+    """
+    summarizer = SUMMARIZERS.get(function_name)
+    if not COMPACT_TOOL_OUTPUT or summarizer is None or result is None:
+        return result
+    try:
+        summary = summarizer(result)
+    except (AttributeError, KeyError, TypeError, ValueError) as e:
+        print(f"Could not compact output of {function_name}: {e!r}")
+        return result
+    return {"summary": summary, "raw_ref": store_raw_output(function_name, args, result)}
@@ -0,0 +1,181 @@
+import json
+import logging
+import os
+import re
+
+from mistralai.models.chat_completion import ChatMessage
+
+import tracing
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("LLMHACK_CONTEXT_TOKEN_BUDGET", "24000"))
+SUMMARY_MODEL = os.getenv("LLMHACK_SUMMARY_MODEL", "mistral-small-latest")
+KEEP_RECENT_TURNS = int(os.getenv("LLMHACK_KEEP_RECENT_TURNS", "2"))
+
+# Rough count for Mistral's tokenizer on English and JSON, good enough to decide when to trim
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4
+
+VARIANT_PATTERNS = [
+    re.compile(r"\brs\d+\b", re.IGNORECASE),
+    re.compile(r"\bRCV\d{6,}\b", re.IGNORECASE),
+    re.compile(r"\b(?:NM|NC|NP|NR|ENST|ENSP)_?\d+(?:\.\d+)?:[cgnpr]\.[^\s,;\"')]+"),
+    re.compile(r"\b(?:chr)?(?:\d{1,2}|X|Y|MT?)[:-]\d+[:-]?[ACGT]+(?:>|-)[ACGT]+\b", re.IGNORECASE),
+]
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PROMPT = ("Summarize the following genetic variant analysis conversation for your own later reference. "
+                  "Keep every variant identifier, population frequency, predicted impact, clinical significance and "
+                  "ACMG criterion that was established, and the user's open questions. Be concise.")
+
+
+def message_tokens(message):
+    """Estimated token count of one chat message"""
+    size = len(message.content or "")
+    if message.tool_calls:
+        size += sum(len(call.function.name) + len(call.function.arguments) for call in message.tool_calls)
+    return size // CHARS_PER_TOKEN + MESSAGE_OVERHEAD_TOKENS
+
+
+def count_tokens(messages):
+    return sum(message_tokens(message) for message in messages)
+
+
+def variant_facts(messages):
+    """Variant identifiers mentioned anywhere in the conversation, in order of first mention"""
+    found = {}
+    for message in messages:
+        for pattern in VARIANT_PATTERNS:
+            for match in pattern.findall(message.content or ""):
+                found.setdefault(match.lower() if match[:2].lower() in ("rs", "rc") else match, None)
+    return list(found)
+
+
+def _turn_starts(messages):
+    # A turn starts at a user message, keeping assistant tool calls next to their tool results
+    return [i for i, message in enumerate(messages) if message.role == "user"]
+
+
+def elide_tool_payload(message):
+    """Replaces a tool message's content by a stub pointing to its raw payload"""
+    raw_ref = None
+    try:
+        content = json.loads(message.content)
+        if isinstance(content, dict):
+            raw_ref = content.get("raw_ref")
+    except (TypeError, ValueError):
+        pass
+    stub = {"elided": "output of an earlier tool call, summarized in the conversation"}
+    if raw_ref:
+        stub["raw_ref"] = raw_ref
+    return message.model_copy(update={"content": json.dumps(stub)})
+
+
+def drop_stale_tool_payloads(messages):
+    """Elides tool outputs of all but the latest turn"""
+    starts = _turn_starts(messages)
+    latest = starts[-1] if starts else 0
+    return [elide_tool_payload(m) if m.role == "tool" and i < latest else m for i, m in enumerate(messages)]
+
+
+def _transcript(messages):
+    lines = []
+    for message in messages:
+        if message.role == "tool":
+            lines.append(f"[tool output] {message.content}")
+        elif message.tool_calls:
+            lines.append("[assistant called] " + ", ".join(f"{c.function.name}({c.function.arguments})" for c in message.tool_calls))
+        elif message.content:
+            lines.append(f"[{message.role}] {message.content}")
+    return "\n".join(lines)
+
+
+def summarize(client, messages, previous_summary=None, model=SUMMARY_MODEL):
+    """Summary of messages, extending previous_summary, made with a cheaper model"""
+    transcript = _transcript(messages)
+    if previous_summary:
+        transcript = f"[summary of the conversation before] {previous_summary}\n{transcript}"
+    with tracing.span("llm", model=model, purpose="context_summary", messages=len(messages)) as s:
+        response = client.chat(model=model, messages=[
+            ChatMessage(role="system", content=SUMMARY_PROMPT),
+            ChatMessage(role="user", content=transcript),
+        ])
+        if response.usage is not None:
+            s.set(prompt_tokens=response.usage.prompt_tokens, completion_tokens=response.usage.completion_tokens)
+    return response.choices[0].message.content
+
+
+class ContextManager:
+    """
+    Keeps what is sent to the model under a token budget. The displayed history is left untouched:
+    stale tool payloads are elided first, then older turns are replaced by a rolling summary,
+    while the system prompt and the variants under discussion stay pinned.
+    """
+
+    def __init__(self, budget_tokens=CONTEXT_TOKEN_BUDGET, summary_model=SUMMARY_MODEL, keep_recent_turns=KEEP_RECENT_TURNS):
+        if keep_recent_turns < 1:
+            # The latest turn holds the question being answered, it can't be summarized away
+            raise ValueError(f"keep_recent_turns must be at least 1, got {keep_recent_turns}")
+        self.budget_tokens = budget_tokens
+        self.summary_model = summary_model
+        self.keep_recent_turns = keep_recent_turns
+
+    def prepare(self, client, messages, state):
+        """
+        Messages to send for the next completion
+        :param client: MistralClient, used for summaries
+        :param messages: full conversation, starting with the system prompt
+        :param state: dictionary persisted across turns (e.g. in st.session_state) holding the rolling summary
+        :return: list of ChatMessage within the budget where possible
+        """
+        with tracing.span("context", messages=len(messages)) as s:
+            tokens = count_tokens(messages)
+            s.set(tokens_before=tokens)
+            if tokens <= self.budget_tokens:
+                return messages
+
+            trimmed = drop_stale_tool_payloads(messages)
+            tokens = count_tokens(trimmed)
+            if tokens <= self.budget_tokens:
+                s.set(tokens_after=tokens, strategy="elide_tool_payloads")
+                return trimmed
+
+            starts = _turn_starts(trimmed)
+            if len(starts) <= self.keep_recent_turns:
+                s.set(tokens_after=tokens, strategy="elide_tool_payloads")
+                return trimmed
+
+            system = [m for m in trimmed[:1] if m.role == "system"]
+            cut = starts[-self.keep_recent_turns]
+            older, recent = trimmed[len(system):cut], trimmed[cut:]
+
+            # The summary rolls forward: only messages not covered by the previous one are summarized again
+            covered, summary = state.get("summary", (0, None))
+            if cut > covered and state.get("summary_failed") != cut:
+                try:
+                    summary = summarize(client, older[max(0, covered - len(system)):], summary, self.summary_model)
+                except Exception as e:
+                    # Not retried for this cut, prepare() runs again for the answer of the same turn
+                    logger.warning("Context summary failed: %r", e)
+                    state["summary_failed"] = cut
+                    s.set(summary_error=repr(e))
+                else:
+                    covered = cut
+                    state["summary"] = (cut, summary)
+                    state.pop("summary_failed", None)
+
+            # Without a fresh summary, what the last one doesn't cover is sent as is, with tool payloads elided
+            if cut > covered:
+                if summary is None:
+                    s.set(tokens_after=tokens, strategy="elide_tool_payloads")
+                    return trimmed
+                recent = trimmed[max(covered, len(system)):]
+
+            pinned = system[0].content if system else ""
+            facts = variant_facts(messages)
+            if facts:
+                pinned += "\n\nVariants under discussion: " + ", ".join(facts)
+            pinned += "\n\nSummary of the earlier conversation: " + summary
+            prepared = [ChatMessage(role="system", content=pinned)] + recent
+            s.set(tokens_after=count_tokens(prepared), strategy="summarize")
+            return prepared
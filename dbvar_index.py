@@ -0,0 +1,603 @@
+"""
+Local dbVar interval index for structural variant overlap queries
+
+Converts the GRCh37 germline dbVar data set (the VCF or the TSV downloads) into column files
+that are memory mapped on use:
+
+    python dbvar_index.py import GRCh37.variant_region.all.vcf.gz
+    python dbvar_index.py import GRCh37.nr_deletions.tsv.gz GRCh37.nr_duplications.tsv.gz
+    python dbvar_index.py overlap 1:230840000-230850000
+    python dbvar_index.py nearest 1:230845794 --count 3
+
+Structural variants are split into size tiers, sorted by chromosome and start within each.
+Next to each end the index keeps the running maximum of the ends of its tier and chromosome so
+far, so the variants of a tier overlapping a region are found by two bisections and a scan of the
+candidates between them; the tiers keep a few chromosome sized CNVs from making every scan span the
+whole chromosome. Accessions (nsv, esv, nssv, essv) have their own sorted index, which answers
+accession searches of the dbVar tool locally.
+"""
+import argparse
+import contextlib
+import gzip
+import heapq
+import itertools
+import json
+import mmap
+import os
+import shutil
+import sys
+import tempfile
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+
+INDEX_PATH = os.getenv("LLMHACK_DBVAR_INDEX", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".dbvar_index"))
+DEFAULT_ASSEMBLY = "GRCh37"
+FORMAT_VERSION = 1
+
+CHROMOSOMES = [str(i) for i in range(1, 23)] + ["X", "Y", "MT"]
+CHROM_CODES = {chrom: code for code, chrom in enumerate(CHROMOSOMES, start=1)}
+
+ACCESSION_PREFIXES = ["nsv", "esv", "nssv", "essv", "nstd", "estd"]
+
+# VCF SVTYPE -> dbVar variant type
+VCF_TYPES = {
+    "DEL": "deletion",
+    "DUP": "duplication",
+    "INS": "insertion",
+    "INV": "inversion",
+    "CNV": "copy number variation",
+    "DEL:ME": "mobile element deletion",
+    "INS:ME": "mobile element insertion",
+    "BND": "translocation",
+}
+
+# Column names of the TSV downloads and of hand made TSVs, first match wins
+TSV_COLUMNS = {
+    "chrom": ("chr", "chrom", "chromosome"),
+    "start": ("outermost_start", "start", "outer_start", "inner_start"),
+    "end": ("outermost_stop", "stop", "end", "outer_stop", "inner_stop"),
+    "type": ("variant_type", "type", "svtype"),
+    "id": ("variant", "variant_id", "accession", "id"),
+    "clinical": ("clinical_assertion", "clinical_significance", "clinical_interpretation"),
+}
+
+# name -> array typecode, one file per column
+COLUMNS = {
+    "locus": "Q",  # chrom code << 32 | start
+    "end": "I",
+    "max_end": "I",  # highest end of the tier and chromosome's rows up to this one
+    "type": "B",  # index into the types
+    "clinical": "B",  # index into the clinical significances, 0 if none
+}
+
+# Upper bound of the variant sizes of each tier, in bp
+TIER_SIZES = [1000, 10000, 100000, 1000000, 10000000, 2 ** 32]
+
+DEFAULT_MAX_RESULTS = 50
+
+WRITE_BATCH = 100000
+# Rows sorted at once when numpy isn't installed, the sorted runs are merged from temporary files
+SORT_CHUNK = 2000000
+
+
+def _chrom(chrom):
+    chrom = chrom[3:] if chrom.lower().startswith("chr") else chrom
+    return "MT" if chrom.upper() == "M" else chrom.upper()
+
+
+def _locus(chrom, pos):
+    return CHROM_CODES[_chrom(chrom)] << 32 | int(pos)
+
+
+def _accession_key(accession):
+    """prefix code << 32 | number of a dbVar accession, 0 if it isn't one"""
+    accession = accession.strip().lower()
+    prefix = accession.rstrip("0123456789")
+    number = accession[len(prefix):]
+    if prefix not in ACCESSION_PREFIXES or not number:
+        return 0
+    return (ACCESSION_PREFIXES.index(prefix) + 1) << 32 | int(number)
+
+
+def _open(path):
+    return gzip.open(path, "rt") if path.endswith((".gz", ".bgz")) else open(path)
+
+
+def iter_vcf_entries(path):
+    """(chrom, start, end, type, accessions, clinical significance) of the records of a dbVar VCF"""
+    with _open(path) as f:
+        for line in f:
+            if line.startswith("#"):
+                continue
+            chrom, pos, record_id, ref, alt, _, _, info = line.rstrip("\n").split("\t", 8)[:8]
+            values = dict(item.partition("=")[::2] for item in info.split(";"))
+            start = int(pos)
+            end = int(values["END"]) if values.get("END", "").isdigit() else start + max(len(ref), 1) - 1
+            svtype = values.get("SVTYPE") or alt.strip("<>")
+            accessions = values.get("DBVARID") or record_id
+            yield chrom, start, end, VCF_TYPES.get(svtype.upper(), svtype.lower()), accessions, values.get("CLNSIG", "")
+
+
+def iter_tsv_entries(path):
+    """Same as iter_vcf_entries for a TSV with a header row"""
+    with _open(path) as f:
+        header = None
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            if header is None:
+                names = [name.lstrip("#").strip().lower() for name in fields]
+                header = {key: next((names.index(a) for a in aliases if a in names), None) for key, aliases in TSV_COLUMNS.items()}
+                missing = [key for key in ("chrom", "start", "end") if header[key] is None]
+                if missing:
+                    raise ValueError(f"{path} has no {', '.join(missing)} column")
+                continue
+            if line.startswith("#") or not line.strip():
+                continue
+
+            def value(key):
+                index = header[key]
+                return fields[index].strip() if index is not None and index < len(fields) else ""
+
+            if not value("start").isdigit() or not value("end").isdigit():
+                continue
+            yield value("chrom"), int(value("start")), int(value("end")), value("type").lower(), value("id"), value("clinical")
+
+
+def iter_entries(path):
+    return iter_vcf_entries(path) if ".vcf" in os.path.basename(path) else iter_tsv_entries(path)
+
+
+def import_files(paths, index_path=INDEX_PATH, assembly=DEFAULT_ASSEMBLY):
+    """
+    Builds the index from dbVar VCF or TSV downloads, replacing any previous one
+    :param paths: files of the same assembly, in any order
+    :param index_path: index directory
+    :param assembly: reference genome of the files
+    :return: number of imported structural variants
+    """
+    tmp = index_path + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    # Columns in the order of the files, sorted into the index below
+    unsorted = os.path.join(tmp, "unsorted")
+    os.makedirs(unsorted)
+
+    def unsorted_path(name):
+        return os.path.join(unsorted, f"{name}.bin")
+
+    # value -> code, in order of first appearance
+    types, clinical = {}, {"": 0}
+    tier_rows = [0] * len(TIER_SIZES)
+    names = [name for name in COLUMNS if name != "max_end"]
+    with contextlib.ExitStack() as files:
+        columns = {name: files.enter_context(_ColumnFile(unsorted_path(name), COLUMNS[name])) for name in names}
+        # tier << 40 | locus, the sort order of the index
+        sort_keys = files.enter_context(_ColumnFile(unsorted_path("sort_key"), "Q"))
+        ids = files.enter_context(_ColumnFile(unsorted_path("ids"), "B"))
+        id_offsets = files.enter_context(_ColumnFile(unsorted_path("id_offsets"), "Q"))
+        id_offsets.append(0)
+        for path in paths:
+            for chrom, start, end, svtype, accessions, significance in iter_entries(path):
+                if _chrom(chrom) not in CHROM_CODES:
+                    continue
+                type_code = types.setdefault(svtype, len(types))
+                clinical_code = clinical.setdefault(significance, len(clinical))
+                if type_code > 255 or clinical_code > 255:
+                    raise ValueError("More than 256 distinct variant types or clinical significances, are these dbVar files?")
+                end = max(end, start)
+                tier = bisect_left(TIER_SIZES, end - start + 1)
+                tier_rows[tier] += 1
+                locus = _locus(chrom, start)
+                columns["locus"].append(locus)
+                columns["end"].append(end)
+                columns["type"].append(type_code)
+                columns["clinical"].append(clinical_code)
+                sort_keys.append(tier << 40 | locus)
+                ids.extend(accessions.encode())
+                id_offsets.append(ids.count)
+        count = sort_keys.count
+
+    # Downloads are sorted by study or variant type rather than by position
+    order_path = unsorted_path("order")
+    _write_order(unsorted_path("sort_key"), order_path, count)
+    for name in names:
+        _write_ordered(unsorted_path(name), COLUMNS[name], order_path, os.path.join(tmp, f"{name}.bin"))
+    _write_ordered(unsorted_path("sort_key"), "Q", order_path, unsorted_path("sorted_key"))
+    # [size bound, first row, end row] of each tier
+    tiers, first = [], 0
+    for size, rows in zip(TIER_SIZES, tier_rows):
+        tiers.append([size, first, first + rows])
+        first += rows
+
+    section, running, id_count = None, 0, 0
+    with contextlib.ExitStack() as files:
+        max_end = files.enter_context(_ColumnFile(os.path.join(tmp, "max_end.bin"), "I"))
+        ordered_ids = files.enter_context(_ColumnFile(os.path.join(tmp, "ids.bin"), "B"))
+        ordered_offsets = files.enter_context(_ColumnFile(os.path.join(tmp, "id_offsets.bin"), "Q"))
+        ordered_offsets.append(0)
+        id_keys = files.enter_context(_ColumnFile(unsorted_path("id_keys"), "Q"))
+        id_rows = files.enter_context(_ColumnFile(unsorted_path("id_rows"), "I"))
+        ids = files.enter_context(_mapped(unsorted_path("ids"), "B"))
+        id_offsets = files.enter_context(_mapped(unsorted_path("id_offsets"), "Q"))
+        rows = _read_values(files.enter_context(open(order_path, "rb")), "Q")
+        keys = _read_values(files.enter_context(open(unsorted_path("sorted_key"), "rb")), "Q")
+        ends = _read_values(files.enter_context(open(os.path.join(tmp, "end.bin"), "rb")), "I")
+        for new_row, (row, key, end) in enumerate(zip(rows, keys, ends)):
+            # key >> 32 is tier << 8 | chromosome code
+            if key >> 32 != section:
+                section, running = key >> 32, 0
+            running = max(running, end)
+            max_end.append(running)
+            accessions = bytes(ids[id_offsets[row]:id_offsets[row + 1]])
+            ordered_ids.extend(accessions)
+            ordered_offsets.append(ordered_ids.count)
+            # Rows of merged regions list several accessions
+            for accession in accessions.decode().split(","):
+                accession_key = _accession_key(accession)
+                if accession_key:
+                    id_keys.append(accession_key)
+                    id_rows.append(new_row)
+        id_count = id_keys.count
+
+    # Entries come in row order, the stable sort keeps the rows of an accession sorted
+    id_order_path = unsorted_path("id_order")
+    _write_order(unsorted_path("id_keys"), id_order_path, id_count)
+    _write_ordered(unsorted_path("id_keys"), "Q", id_order_path, os.path.join(tmp, "id_keys.bin"))
+    _write_ordered(unsorted_path("id_rows"), "I", id_order_path, os.path.join(tmp, "id_rows.bin"))
+    shutil.rmtree(unsorted)
+
+    meta = {
+        "version": FORMAT_VERSION, "rows": count, "assembly": assembly, "byteorder": sys.byteorder,
+        "sources": [os.path.basename(path) for path in paths], "columns": COLUMNS, "tiers": tiers,
+        "types": list(types), "clinical": list(clinical),
+    }
+    with open(os.path.join(tmp, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+
+    old = index_path + ".old"
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(index_path):
+        os.replace(index_path, old)
+    os.replace(tmp, index_path)
+    shutil.rmtree(old, ignore_errors=True)
+    return count
+
+
+class _ColumnFile:
+    """Column file written in batches"""
+
+    def __init__(self, path, typecode):
+        self.file = open(path, "wb")
+        self.buffer = array(typecode)
+        self.count = 0
+
+    def append(self, value):
+        self.buffer.append(value)
+        self.count += 1
+        if len(self.buffer) >= WRITE_BATCH:
+            self.flush()
+
+    def extend(self, values):
+        self.buffer.extend(values)
+        self.count += len(values)
+        if len(self.buffer) >= WRITE_BATCH:
+            self.flush()
+
+    def flush(self):
+        self.buffer.tofile(self.file)
+        del self.buffer[:]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        try:
+            self.flush()
+        finally:
+            self.file.close()
+
+
+@contextlib.contextmanager
+def _mapped(path, typecode):
+    """Read only view of a column file"""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield memoryview(b"").cast(typecode)
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped).cast(typecode)
+            try:
+                yield view
+            finally:
+                view.release()
+
+
+def _read_values(f, typecode):
+    while True:
+        block = array(typecode)
+        try:
+            block.fromfile(f, WRITE_BATCH)
+        except EOFError:
+            # fromfile keeps the items read before the end of the file
+            pass
+        if not block:
+            return
+        yield from block
+
+
+def _read_pairs(f):
+    values = _read_values(f, "Q")
+    return zip(values, values)
+
+
+def _write_order(keys_path, order_path, count):
+    """Rows sorted by key, ties in row order, written without holding a list of all rows"""
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+    if numpy is not None:
+        keys = numpy.fromfile(keys_path, dtype=numpy.uint64, count=count)
+        keys.argsort(kind="stable").astype(numpy.uint64).tofile(order_path)
+        return
+
+    # Sorted runs of (key, row) pairs of SORT_CHUNK rows in temporary files, merged into the order
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(order_path)) as runs_dir:
+        runs = []
+        with open(keys_path, "rb") as f:
+            for first in range(0, count, SORT_CHUNK):
+                keys = array("Q")
+                keys.fromfile(f, min(SORT_CHUNK, count - first))
+                run = array("Q", itertools.chain.from_iterable(sorted(zip(keys, range(first, first + len(keys))))))
+                runs.append(os.path.join(runs_dir, f"{len(runs)}.bin"))
+                with open(runs[-1], "wb") as run_file:
+                    run.tofile(run_file)
+                del keys, run
+        with contextlib.ExitStack() as files:
+            run_files = [files.enter_context(open(run, "rb")) for run in runs]
+            order = files.enter_context(_ColumnFile(order_path, "Q"))
+            for _, row in heapq.merge(*(_read_pairs(run_file) for run_file in run_files)):
+                order.append(row)
+
+
+def _write_ordered(path, typecode, order_path, ordered_path):
+    """The column file at path with its rows in the order of order_path"""
+    with _mapped(path, typecode) as values, open(order_path, "rb") as order, _ColumnFile(ordered_path, typecode) as ordered:
+        for row in _read_values(order, "Q"):
+            ordered.append(values[row])
+
+
+class DbvarIndex:
+    """Memory mapped interval index"""
+
+    def __init__(self, path=INDEX_PATH):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        if self.meta["byteorder"] != sys.byteorder or self.meta["version"] != FORMAT_VERSION:
+            raise ValueError(f"dbVar index {path} was written for another platform or format version, import it again")
+        self.rows = self.meta["rows"]
+        self._maps = []
+        self.columns = {name: self._map(f"{name}.bin", typecode) for name, typecode in self.meta["columns"].items()}
+        self.ids = self._map("ids.bin", "B")
+        self.id_offsets = self._map("id_offsets.bin", "Q")
+        self.id_keys = self._map("id_keys.bin", "Q")
+        self.id_rows = self._map("id_rows.bin", "I")
+
+    def _map(self, name, typecode):
+        with open(os.path.join(self.path, name), "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return memoryview(b"").cast(typecode)
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(mapped)
+        return memoryview(mapped).cast(typecode)
+
+    def _chromosome_rows(self, chrom):
+        """(first row, end row) of the chromosome in each tier"""
+        code = CHROM_CODES.get(_chrom(chrom))
+        if code is None:
+            return []
+        locus = self.columns["locus"]
+        return [(bisect_left(locus, code << 32, first, end), bisect_left(locus, (code + 1) << 32, first, end))
+                for _, first, end in self.meta["tiers"] if end > first]
+
+    def variant(self, row, distance=None):
+        locus = self.columns["locus"][row]
+        start, end = locus & 0xFFFFFFFF, self.columns["end"][row]
+        variant = {
+            "id": bytes(self.ids[self.id_offsets[row]:self.id_offsets[row + 1]]).decode(),
+            "chrom": CHROMOSOMES[(locus >> 32) - 1],
+            "start": start,
+            "end": end,
+            "size": end - start + 1,
+            "type": self.meta["types"][self.columns["type"][row]],
+            "clinical_significance": self.meta["clinical"][self.columns["clinical"][row]] or None,
+        }
+        if distance is not None:
+            variant["distance"] = distance
+        return variant
+
+    def overlapping_rows(self, chrom, start, end):
+        """Rows of the structural variants overlapping chrom:start-end, by tier then start"""
+        ends = self.columns["end"]
+        rows = []
+        for first, last in self._chromosome_rows(chrom):
+            # Rows from hi on start after the region, rows before lo and all earlier ones end before it
+            hi = bisect_right(self.columns["locus"], _locus(chrom, end), first, last)
+            lo = bisect_left(self.columns["max_end"], start, first, hi)
+            rows += [row for row in range(lo, hi) if ends[row] >= start]
+        return rows
+
+    def nearest_rows(self, chrom, pos, count):
+        """(distance, row) of the count structural variants closest to chrom:pos, overlapping ones at distance 0"""
+        locus, ends, max_end = self.columns["locus"], self.columns["end"], self.columns["max_end"]
+        # Max heap of the best count so far, as (-distance, row)
+        best = []
+
+        def offer(distance, row):
+            if len(best) < count:
+                heapq.heappush(best, (-distance, row))
+            elif distance < -best[0][0]:
+                heapq.heapreplace(best, (-distance, row))
+
+        for first, last in self._chromosome_rows(chrom):
+            split = bisect_right(locus, _locus(chrom, pos), first, last)
+            # Starting after pos, the distance grows with the row
+            for row in range(split, last):
+                distance = (locus[row] & 0xFFFFFFFF) - pos
+                if len(best) == count and distance >= -best[0][0]:
+                    break
+                offer(distance, row)
+            # Starting at or before pos, none of the rows up to one whose running max end is too far can be closer
+            for row in range(split - 1, first - 1, -1):
+                if len(best) == count and (best[0][0] == 0 or pos - max_end[row] >= -best[0][0]):
+                    break
+                offer(max(0, pos - ends[row]), row)
+        return sorted((-distance, row) for distance, row in best)
+
+    def rows_of_accession(self, accession):
+        key = _accession_key(accession)
+        if not key:
+            return []
+        start = bisect_left(self.id_keys, key)
+        end = bisect_right(self.id_keys, key, start)
+        return sorted(set(self.id_rows[start:end]))
+
+
+_index = None
+
+
+def get_index(path=INDEX_PATH):
+    """The index at path, None if nothing was imported there"""
+    global _index
+    if _index is None or _index.path != path:
+        if not os.path.exists(os.path.join(path, "meta.json")):
+            return None
+        _index = DbvarIndex(path)
+    return _index
+
+
+def _types_filter(index, variant_type):
+    if not variant_type:
+        return None
+    wanted = variant_type.strip().lower()
+    return {i for i, name in enumerate(index.meta["types"]) if wanted in name}
+
+
+def _missing_index():
+    return {"error": f"No local dbVar index in {INDEX_PATH}, it is built with python dbvar_index.py import"}
+
+
+def query_region(chromosome, start, end, variant_type=None, max_results=DEFAULT_MAX_RESULTS):
+    """Structural variants overlapping a GRCh37 region, largest overlap first"""
+    index = get_index()
+    if index is None:
+        return _missing_index()
+    start, end = sorted((int(start), int(end)))
+    types = _types_filter(index, variant_type)
+    locus, ends, type_column = index.columns["locus"], index.columns["end"], index.columns["type"]
+    rows = [row for row in index.overlapping_rows(chromosome, start, end) if types is None or type_column[row] in types]
+
+    def ranked():
+        # Ranked on the columns, only the variants returned are built as dicts
+        for row in rows:
+            row_start, row_end = locus[row] & 0xFFFFFFFF, ends[row]
+            overlap = min(end, row_end) - max(start, row_start) + 1
+            reciprocal = round(min(overlap / (row_end - row_start + 1), overlap / (end - start + 1)), 4)
+            # Ties go to the earlier row
+            yield reciprocal, -row, overlap
+
+    variants = []
+    for reciprocal, negated_row, overlap in heapq.nlargest(max_results, ranked()):
+        variant = index.variant(-negated_row)
+        variant["overlap_bp"] = overlap
+        variant["reciprocal_overlap"] = reciprocal
+        variants.append(variant)
+    return {
+        "assembly": index.meta["assembly"],
+        "region": f"{_chrom(chromosome)}:{start}-{end}",
+        "total": len(rows),
+        "structural_variants": variants,
+    }
+
+
+def query_nearest(chromosome, position, count=5, variant_type=None):
+    """The count structural variants closest to a GRCh37 position"""
+    index = get_index()
+    if index is None:
+        return _missing_index()
+    types = _types_filter(index, variant_type)
+    if types is None:
+        nearest = index.nearest_rows(chromosome, int(position), count)
+    else:
+        # Rare types need a wider net, the filter is applied on a growing candidate list
+        wanted = count
+        while True:
+            nearest = [(d, row) for d, row in index.nearest_rows(chromosome, int(position), wanted)
+                       if index.columns["type"][row] in types]
+            if len(nearest) >= count or wanted >= index.rows:
+                break
+            wanted *= 8
+        nearest = nearest[:count]
+    return {
+        "assembly": index.meta["assembly"],
+        "position": f"{_chrom(chromosome)}:{int(position)}",
+        "structural_variants": [index.variant(row, distance) for distance, row in nearest],
+    }
+
+
+def query_term(term):
+    """
+    Local answer to tool_query_genomic_structural_variation_db_by_rsid for dbVar accessions
+    :return: the clinicaltables API response shape, or None when the search has to go to the API
+    """
+    index = get_index()
+    if index is None or not _accession_key(str(term)):
+        return None
+    rows = index.rows_of_accession(term)
+    if not rows:
+        return None
+    variants = [index.variant(row) for row in rows]
+    return [len(variants), [v["id"] for v in variants], None,
+            [[v["id"], v["chrom"], str(v["start"]), str(v["end"]), v["type"]] for v in variants]]
+
+
+def _parse_region(region):
+    chrom, _, span = region.replace(",", "").partition(":")
+    start, _, end = span.partition("-")
+    return chrom, int(start), int(end or start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = subparsers.add_parser("import", help="build the index from dbVar VCF or TSV downloads")
+    import_parser.add_argument("files", nargs="+", help="dbVar VCFs or TSVs, optionally gzipped")
+    import_parser.add_argument("--assembly", default=DEFAULT_ASSEMBLY, help="reference genome of the files")
+    import_parser.add_argument("--index", default=INDEX_PATH, help="index directory")
+
+    overlap_parser = subparsers.add_parser("overlap", help="structural variants overlapping a region")
+    overlap_parser.add_argument("region", help="chrom:start-end")
+    overlap_parser.add_argument("--type", help="only this variant type, e.g. deletion")
+
+    nearest_parser = subparsers.add_parser("nearest", help="structural variants closest to a position")
+    nearest_parser.add_argument("position", help="chrom:pos")
+    nearest_parser.add_argument("--count", type=int, default=5)
+    nearest_parser.add_argument("--type", help="only this variant type, e.g. deletion")
+
+    args = parser.parse_args()
+    if args.command == "import":
+        start = time.time()
+        count = import_files(args.files, args.index, args.assembly)
+        print(f"Imported {count} structural variants into {args.index} in {time.time() - start:.1f}s")
+    elif args.command == "overlap":
+        print(json.dumps(query_region(*_parse_region(args.region), variant_type=args.type), indent=2))
+    else:
+        chrom, pos, _ = _parse_region(args.position)
+        print(json.dumps(query_nearest(chrom, pos, args.count, args.type), indent=2))
+
+
+if __name__ == "__main__":
+    main()
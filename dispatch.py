@@ -0,0 +1,124 @@
+import contextvars
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import tracing
+from cache import get_cached
+from compact import compact_tool_output
+from registry import LOCAL, ToolValidationError, tool_registry
+
+logger = logging.getLogger(__name__)
+
+
+def run_tool_call(registry, function_name, args_dict, warmups=()):
+    """
+    Runs one validated tool call
+    :param registry: ToolRegistry the tool is registered in
+    :param function_name: tool name as given by the model
+    :param args_dict: decoded and validated arguments
+    :param warmups: futures of batch calls filling this call's cache entry, waited for first
+    :return: JSON encoded tool output
+    """
+    # A failed batch only means the call goes upstream on its own
+    wait(warmups)
+    with tracing.span("tool", tool=function_name, args=args_dict) as s:
+        result = registry.function(function_name)(**args_dict)
+        # The model gets the ACMG relevant summary, the full payload stays retrievable by reference
+        output = json.dumps(compact_tool_output(function_name, args_dict, result))
+        s.set(output_bytes=len(output))
+    return output
+
+
+def _run_batch(registry, function_name, args_dict):
+    with tracing.span("tool", tool=function_name, warmup=True):
+        registry.function(function_name)(**args_dict)
+
+
+def _warm_batches(calls, registry, submit):
+    """Runs the batch version of single variant tools called several times in one round, returns index -> futures"""
+    groups = {}
+    for index, (name, tool, args, _) in enumerate(calls):
+        if tool is not None and tool.batchable and not (tool.cacheable and get_cached(name, args) is not None):
+            groups.setdefault(name, []).append(index)
+
+    warmups = {}
+    for name, indexes in groups.items():
+        if len(indexes) < 2:
+            continue
+        futures = [submit(_run_batch, registry, batch_name, batch_args)
+                   for batch_name, batch_args in registry.get(name).batch([calls[i][2] for i in indexes])]
+        for index in indexes:
+            warmups[index] = futures
+    return warmups
+
+
+def run_tool_calls(tool_calls, registry=tool_registry, timeout=None):
+    """
+    Runs independent tool calls in parallel
+    :param tool_calls: tool calls of a single completion, in the model's order
+    :param registry: ToolRegistry resolving and validating the calls
+    :param timeout: seconds each call may take, defaults to each tool's own timeout
+    :return: list of (function_name, output) in the same order as tool_calls
+    """
+    if not tool_calls:
+        return []
+
+    # Malformed calls are answered right away, without any upstream request
+    calls = []
+    for tool_call in tool_calls:
+        function_name = tool_call.function.name
+        try:
+            tool, args = registry.validate(function_name, tool_call.function.arguments)
+            calls.append((function_name, tool, args, None))
+        except ToolValidationError as e:
+            logger.warning("Rejected %s: %s", function_name, e)
+            calls.append((function_name, None, None, json.dumps({"error": str(e)})))
+
+    # One worker per network call so every call starts right away, local calls run inline
+    remote = [call for call in calls if call[1] is not None and call[1].cost != LOCAL]
+    executor = ThreadPoolExecutor(max_workers=max(1, 2 * len(remote)))
+
+    def submit(func, *args):
+        # Each call runs in a copy of the caller's context so its spans end up in the current turn
+        return executor.submit(contextvars.copy_context().run, func, *args)
+
+    started = time.monotonic()
+    warmups = _warm_batches(calls, registry, submit)
+    futures = {}
+    for index, (function_name, tool, args, error) in enumerate(calls):
+        if tool is not None and tool.cost != LOCAL:
+            futures[index] = submit(run_tool_call, registry, function_name, args, warmups.get(index, ()))
+
+    results = []
+    for index, (function_name, tool, args, error) in enumerate(calls):
+        if error is not None:
+            results.append((function_name, error))
+            continue
+        if index not in futures:
+            try:
+                output = run_tool_call(registry, function_name, args)
+            except Exception as e:
+                logger.warning("%s failed: %r", function_name, e)
+                output = json.dumps({"error": f"{function_name} failed: {e}"})
+            results.append((function_name, output))
+            continue
+
+        call_timeout = timeout if timeout is not None else tool.timeout
+        future = futures[index]
+        wait([future], timeout=max(0, started + call_timeout - time.monotonic()))
+        if not future.done():
+            # A running thread can't be killed, it is left to finish in the background
+            future.cancel()
+            logger.warning("%s timed out after %ss", function_name, call_timeout)
+            output = json.dumps({"error": f"{function_name} timed out after {call_timeout} seconds"})
+        elif future.exception() is not None:
+            logger.warning("%s failed: %r", function_name, future.exception())
+            output = json.dumps({"error": f"{function_name} failed: {future.exception()}"})
+        else:
+            output = future.result()
+        results.append((function_name, output))
+
+    executor.shutdown(wait=False, cancel_futures=True)
+    return results
@@ -0,0 +1,160 @@
+import json
+
+GNOMAD_API = "https://gnomad.broadinstitute.org/api/"
+GNOMAD_DATASET = "gnomad_r2_1"
+
+HISTOGRAM = """
+    bin_edges
+    bin_freq
+    n_smaller
+    n_larger
+"""
+
+# Selections inside the exome { } and genome { } blocks
+SEQUENCING_TYPE_GROUPS = {
+    "frequencies": """
+            ac
+            an
+            ac_hemi
+            ac_hom
+            faf95 {
+                popmax
+                popmax_population
+            }
+            filters
+            populations {
+                id
+                ac
+                an
+                ac_hemi
+                ac_hom
+            }
+    """,
+    "age_distribution": """
+            age_distribution {
+                het { %(h)s }
+                hom { %(h)s }
+            }
+    """ % {"h": HISTOGRAM},
+    "quality_metrics": """
+            qualityMetrics {
+                alleleBalance {
+                    alt { %(h)s }
+                }
+                genotypeDepth {
+                    all { %(h)s }
+                    alt { %(h)s }
+                }
+                genotypeQuality {
+                    all { %(h)s }
+                    alt { %(h)s }
+                }
+            }
+    """ % {"h": HISTOGRAM},
+}
+
+# Selections directly on the variant
+VARIANT_GROUPS = {
+    "colocated_variants": """
+            colocatedVariants
+            multiNucleotideVariants {
+                combined_variant_id
+                changes_amino_acids
+                n_individuals
+                other_constituent_snvs
+            }
+    """,
+    "consequences": """
+            sortedTranscriptConsequences {
+                canonical
+                gene_id
+                gene_version
+                gene_symbol
+                hgvs
+                hgvsc
+                hgvsp
+                lof
+                lof_flags
+                lof_filter
+                major_consequence
+                polyphen_prediction
+                sift_prediction
+                transcript_id
+                transcript_version
+            }
+    """,
+}
+
+# Always selected so results can be matched to variants
+IDENTITY = """
+            variantId
+            reference_genome
+            chrom
+            pos
+            ref
+            alt
+            rsid
+            flags
+"""
+
+FIELD_GROUPS = list(SEQUENCING_TYPE_GROUPS) + list(VARIANT_GROUPS)
+
+PRESETS = {
+    "everything": FIELD_GROUPS,
+    # What ACMG population frequency and protein impact steps need
+    "acmg": ["frequencies", "consequences"],
+}
+
+
+def resolve_fields(fields):
+    """
+    Expands presets and checks group names
+    :param fields: None, a preset name, or a list of field group and preset names
+    :return: list of field groups, in FIELD_GROUPS order
+    """
+    if fields is None:
+        fields = ["everything"]
+    elif isinstance(fields, str):
+        fields = [fields]
+
+    groups = set()
+    for name in fields:
+        if name in PRESETS:
+            groups.update(PRESETS[name])
+        elif name in FIELD_GROUPS:
+            groups.add(name)
+        else:
+            raise ValueError(f"Unknown gnomAD field group {name!r}, expected one of {FIELD_GROUPS + list(PRESETS)}")
+    return [group for group in FIELD_GROUPS if group in groups]
+
+
+def build_selection(fields=None):
+    """GraphQL selection set of a variant for the requested field groups"""
+    groups = resolve_fields(fields)
+    selection = IDENTITY
+
+    sequencing_type = "".join(SEQUENCING_TYPE_GROUPS[group] for group in groups if group in SEQUENCING_TYPE_GROUPS)
+    if sequencing_type:
+        selection += "exome {%s}\ngenome {%s}\n" % (sequencing_type, sequencing_type)
+
+    selection += "".join(VARIANT_GROUPS[group] for group in groups if group in VARIANT_GROUPS)
+    return selection
+
+
+def build_query(rsids, fields=None):
+    """
+    GraphQL query for one or many variants
+    :param rsids: a single rsid, or a list of rsids which are then aliased v0, v1, ...
+    :param fields: field groups to request, see resolve_fields
+    :return: query string
+    """
+    # Indentation is only there for reading, no need to send it
+    selection = " ".join(build_selection(fields).split())
+    if isinstance(rsids, str):
+        return '{ variant(rsid: %s, dataset: %s) { %s } }' % (json.dumps(rsids.lower()), GNOMAD_DATASET, selection)
+
+    aliases = " ".join(
+        'v%d: variant(rsid: %s, dataset: %s) { %s }' % (i, json.dumps(rsid.lower()), GNOMAD_DATASET, selection)
+        for i, rsid in enumerate(rsids)
+    )
+    return "{ %s }" % aliases
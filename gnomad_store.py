@@ -0,0 +1,497 @@
+"""
+Local gnomAD frequency store for offline population frequency lookups
+
+Converts gnomAD sites VCFs into fixed width column files that are memory mapped on use,
+one store per sequencing type, optionally restricted to some chromosomes:
+
+    python gnomad_store.py import gnomad.exomes.r2.1.1.sites.vcf.bgz --type exome
+    python gnomad_store.py import gnomad.genomes.r2.1.1.sites.{1,2,X}.vcf.bgz --type genome --chromosomes 1,2,X
+    python gnomad_store.py lookup rs699
+
+Rows are kept in VCF order, so the chrom/pos column is sorted and searched by bisection;
+rsIDs have their own sorted (rsid, row) index. Frequency only gnomAD queries are answered
+from the store in the shape of the GraphQL API response.
+"""
+import argparse
+import gzip
+import heapq
+import json
+import mmap
+import os
+import shutil
+import sys
+import tempfile
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+
+import gnomad
+from compact import GNOMAD_POPULATIONS
+
+STORE_PATH = os.getenv("LLMHACK_GNOMAD_STORE", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".gnomad_store"))
+SEQUENCING_TYPES = ("exome", "genome")
+DEFAULT_ASSEMBLY = "GRCh37"
+FORMAT_VERSION = 1
+
+CHROMOSOMES = [str(i) for i in range(1, 23)] + ["X", "Y", "MT"]
+CHROM_CODES = {chrom: code for code, chrom in enumerate(CHROMOSOMES, start=1)}
+
+FILTERS = ["AC0", "AS_VQSR", "InbreedingCoeff", "RF"]
+FLAGS = ["lcr", "segdup"]
+POPULATION_FIELDS = ("ac", "an", "ac_hom", "ac_hemi")
+# The API's faf95.popmax leaves out the populations with a founder effect (asj, fin) and oth
+FAF_POPMAX_POPULATIONS = ("afr", "amr", "eas", "nfe", "sas")
+
+# name -> array typecode, one file per column
+COLUMNS = {
+    "locus": "Q",  # chrom code << 32 | pos
+    "rsid": "I",  # numeric part of the rsID, 0 if none
+    "ac": "I",
+    "an": "I",
+    "af": "f",
+    "ac_hom": "I",
+    "ac_hemi": "I",
+    "faf95_popmax": "f",
+    "popmax_population": "B",  # index into the populations, 0 if none
+    "filters": "B",  # bit mask over FILTERS
+    "flags": "B",  # bit mask over FLAGS
+}
+COLUMNS.update({f"{field}_{population}": "I" for population in GNOMAD_POPULATIONS for field in POPULATION_FIELDS})
+
+WRITE_BATCH = 100000
+# rsID index entries sorted in memory at a time when numpy is missing, 8 bytes each
+RSID_SORT_CHUNK = 10000000
+
+
+def _chrom(chrom):
+    chrom = chrom[3:] if chrom.lower().startswith("chr") else chrom
+    return "MT" if chrom.upper() == "M" else chrom.upper()
+
+
+def _locus(chrom, pos):
+    return CHROM_CODES[_chrom(chrom)] << 32 | int(pos)
+
+
+def _rsid_number(rsid):
+    rsid = str(rsid).strip().lower()
+    return int(rsid[2:]) if rsid.startswith("rs") and rsid[2:].isdigit() else 0
+
+
+def _number(value, cast=int):
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _open_vcf(path):
+    # .bgz is plain gzip to the gzip module
+    return gzip.open(path, "rt") if path.endswith((".gz", ".bgz")) else open(path)
+
+
+def _parse_info(info, allele_index):
+    values = {}
+    for item in info.split(";"):
+        key, has_value, value = item.partition("=")
+        if "," in value:
+            parts = value.split(",")
+            value = parts[allele_index] if allele_index < len(parts) else ""
+        # Flags such as lcr or nonpar have no value
+        values[key] = value if has_value else True
+    return values
+
+
+def _row(chrom, pos, ids, ref, alt, filters, info):
+    """Column values of one VCF record"""
+    row = {
+        "locus": _locus(chrom, pos),
+        "rsid": next((_rsid_number(i) for i in ids.split(";") if _rsid_number(i)), 0),
+        "ac": _number(info.get("AC")),
+        "an": _number(info.get("AN")),
+        "af": _number(info.get("AF"), float),
+        "ac_hom": _number(info.get("nhomalt")),
+        "filters": sum(1 << i for i, name in enumerate(FILTERS) if name in filters.split(";")),
+        "flags": sum(1 << i for i, name in enumerate(FLAGS) if info.get(name) is True),
+    }
+
+    # Hemizygous counts only exist outside the pseudoautosomal regions of X and Y
+    hemizygous = _chrom(chrom) in ("X", "Y") and info.get("nonpar") is True
+    row["ac_hemi"] = _number(info.get("AC_hemi", info.get("AC_XY", info.get("AC_male")))) if hemizygous else 0
+
+    for population in GNOMAD_POPULATIONS:
+        row[f"ac_{population}"], row[f"an_{population}"] = _number(info.get(f"AC_{population}")), _number(info.get(f"AN_{population}"))
+        row[f"ac_hom_{population}"] = _number(info.get(f"nhomalt_{population}"))
+        row[f"ac_hemi_{population}"] = _number(info.get(f"AC_{population}_XY", info.get(f"AC_{population}_male"))) if hemizygous else 0
+
+    # The API's faf95.popmax is the highest filtering allele frequency over FAF_POPMAX_POPULATIONS,
+    # r2.1 VCFs only have the per population values
+    popmax, popmax_population = 0.0, 0
+    for population in FAF_POPMAX_POPULATIONS:
+        faf = _number(info.get(f"faf95_{population}"), float)
+        if faf > popmax:
+            popmax, popmax_population = faf, GNOMAD_POPULATIONS.index(population) + 1
+    row["faf95_popmax"], row["popmax_population"] = popmax, popmax_population
+    return row
+
+
+def iter_vcf_rows(paths, chromosomes=None):
+    """(row, ref, alt) of every allele of the VCFs, in file order"""
+    wanted = {_chrom(c) for c in chromosomes} if chromosomes else None
+    for path in paths:
+        with _open_vcf(path) as f:
+            for line in f:
+                if line.startswith("#"):
+                    continue
+                chrom, pos, ids, ref, alts, _, filters, info = line.rstrip("\n").split("\t", 8)[:8]
+                if _chrom(chrom) not in CHROM_CODES or (wanted and _chrom(chrom) not in wanted):
+                    continue
+                for index, alt in enumerate(alts.split(",")):
+                    if alt != "*":
+                        yield _row(chrom, pos, ids, ref, alt, filters, _parse_info(info, index)), ref, alt
+
+
+def _first_locus(path):
+    with _open_vcf(path) as f:
+        for line in f:
+            if not line.startswith("#"):
+                chrom, pos = line.split("\t", 2)[:2]
+                return _locus(chrom, pos) if _chrom(chrom) in CHROM_CODES else 0
+    return 0
+
+
+def import_vcfs(paths, store_path=STORE_PATH, sequencing_type="exome", chromosomes=None,
+                assembly=DEFAULT_ASSEMBLY, dataset=gnomad.GNOMAD_DATASET):
+    """
+    Builds the store of one sequencing type from sorted gnomAD sites VCFs, replacing any previous one
+    :param paths: VCFs, e.g. one per chromosome, in any order
+    :param store_path: store directory, holding one sub directory per sequencing type
+    :param sequencing_type: exome or genome
+    :param chromosomes: only import these chromosomes
+    :param assembly: reference genome of the VCFs
+    :param dataset: gnomAD dataset the VCFs come from, only queries of the same dataset are answered locally
+    :return: number of imported variants
+    """
+    if sequencing_type not in SEQUENCING_TYPES:
+        raise ValueError(f"Unknown sequencing type {sequencing_type!r}, expected one of {SEQUENCING_TYPES}")
+    # Per chromosome VCFs may be given in any order, the locus column must come out sorted
+    paths = sorted(paths, key=_first_locus)
+
+    target = os.path.join(store_path, sequencing_type)
+    tmp = target + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    files = {name: open(os.path.join(tmp, f"{name}.bin"), "wb") for name in COLUMNS}
+    alleles_file = open(os.path.join(tmp, "alleles.bin"), "wb")
+    offsets_file = open(os.path.join(tmp, "allele_offsets.bin"), "wb")
+    buffers = {name: array(typecode) for name, typecode in COLUMNS.items()}
+    offsets, alleles = array("Q", [0]), bytearray()
+    offset, count, previous = 0, 0, 0
+
+    def flush():
+        for name, buffer in buffers.items():
+            buffer.tofile(files[name])
+            del buffer[:]
+        offsets.tofile(offsets_file)
+        del offsets[:]
+        alleles_file.write(alleles)
+        alleles.clear()
+
+    try:
+        for row, ref, alt in iter_vcf_rows(paths, chromosomes):
+            if row["locus"] < previous:
+                raise ValueError("Variants must be sorted by chromosome and position, as in the gnomAD release VCFs")
+            previous = row["locus"]
+            for name, buffer in buffers.items():
+                buffer.append(row[name])
+            encoded = f"{ref}\t{alt}".encode()
+            alleles += encoded
+            offset += len(encoded)
+            offsets.append(offset)
+            count += 1
+            if count % WRITE_BATCH == 0:
+                flush()
+        flush()
+    finally:
+        for f in list(files.values()) + [alleles_file, offsets_file]:
+            f.close()
+
+    _write_rsid_index(os.path.join(tmp, "rsid.bin"), os.path.join(tmp, "rsid_index.bin"), count)
+
+    meta = {
+        "version": FORMAT_VERSION, "sequencing_type": sequencing_type, "rows": count, "assembly": assembly,
+        "dataset": dataset, "byteorder": sys.byteorder, "chromosomes": sorted(chromosomes) if chromosomes else None,
+        "columns": COLUMNS, "populations": list(GNOMAD_POPULATIONS), "filters": FILTERS, "flags": FLAGS,
+    }
+    with open(os.path.join(tmp, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+
+    old = target + ".old"
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(target):
+        os.replace(target, old)
+    os.replace(tmp, target)
+    shutil.rmtree(old, ignore_errors=True)
+    return count
+
+
+def _write_rsid_index(rsid_path, index_path, count):
+    """Sorted (rsid << 32 | row) of the rows with an rsID, written without holding a list of all rows"""
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+    if numpy is not None:
+        rsids = numpy.fromfile(rsid_path, dtype=numpy.uint32, count=count)
+        rows = numpy.flatnonzero(rsids).astype(numpy.uint64)
+        index = rsids[rows].astype(numpy.uint64) << numpy.uint64(32) | rows
+        index.sort()
+        index.tofile(index_path)
+        return
+
+    # Sorted runs of RSID_SORT_CHUNK rows in temporary files, merged into the index
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(index_path)) as runs_dir:
+        runs = []
+        with open(rsid_path, "rb") as f:
+            for first in range(0, count, RSID_SORT_CHUNK):
+                rsids = array("I")
+                rsids.fromfile(f, min(RSID_SORT_CHUNK, count - first))
+                run = array("Q", sorted(rsid << 32 | row for row, rsid in enumerate(rsids, start=first) if rsid))
+                runs.append(os.path.join(runs_dir, f"{len(runs)}.bin"))
+                with open(runs[-1], "wb") as run_file:
+                    run.tofile(run_file)
+                del rsids, run
+        run_files = [open(run, "rb") for run in runs]
+        try:
+            with open(index_path, "wb") as f:
+                merged = array("Q")
+                for key in heapq.merge(*(_read_run(run_file) for run_file in run_files)):
+                    merged.append(key)
+                    if len(merged) == WRITE_BATCH:
+                        merged.tofile(f)
+                        del merged[:]
+                merged.tofile(f)
+        finally:
+            for run_file in run_files:
+                run_file.close()
+
+
+def _read_run(f):
+    while True:
+        block = array("Q")
+        try:
+            block.fromfile(f, WRITE_BATCH)
+        except EOFError:
+            # fromfile keeps the items read before the end of the file
+            pass
+        if not block:
+            return
+        yield from block
+
+
+class _Columns:
+    """Memory mapped columns of one sequencing type"""
+
+    def __init__(self, path):
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        if self.meta["byteorder"] != sys.byteorder or self.meta["version"] != FORMAT_VERSION:
+            raise ValueError(f"gnomAD store {path} was written for another platform or format version, import it again")
+        self.rows = self.meta["rows"]
+        self._maps = []
+        self.columns = {name: self._map(path, f"{name}.bin", typecode) for name, typecode in self.meta["columns"].items()}
+        self.offsets = self._map(path, "allele_offsets.bin", "Q")
+        self.alleles = self._map(path, "alleles.bin", "B")
+        self.rsid_index = self._map(path, "rsid_index.bin", "Q")
+
+    def _map(self, path, name, typecode):
+        with open(os.path.join(path, name), "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return memoryview(b"").cast(typecode)
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(mapped)
+        return memoryview(mapped).cast(typecode)
+
+    def alleles_of(self, row):
+        ref, alt = bytes(self.alleles[self.offsets[row]:self.offsets[row + 1]]).decode().split("\t")
+        return ref, alt
+
+    def rows_of_rsid(self, rsid):
+        number = _rsid_number(rsid)
+        if not number:
+            return []
+        start = bisect_left(self.rsid_index, number << 32)
+        end = bisect_left(self.rsid_index, (number + 1) << 32, start)
+        return [self.rsid_index[i] & 0xFFFFFFFF for i in range(start, end)]
+
+    def row_of_variant(self, chrom, pos, ref, alt):
+        locus = self.columns["locus"]
+        key = _locus(chrom, pos)
+        ref, alt = ref.upper(), alt.upper()
+        for row in range(bisect_left(locus, key), bisect_right(locus, key)):
+            if self.alleles_of(row) == (ref, alt):
+                return row
+        return None
+
+    def identity(self, row):
+        locus = self.columns["locus"][row]
+        chrom, pos = CHROMOSOMES[(locus >> 32) - 1], locus & 0xFFFFFFFF
+        ref, alt = self.alleles_of(row)
+        rsid = self.columns["rsid"][row]
+        return chrom, pos, ref, alt, f"rs{rsid}" if rsid else None
+
+    def frequencies(self, row):
+        """Frequency block of a row in the API's exome { } / genome { } shape"""
+        value = {name: self.columns[name][row] for name in ("ac", "an", "ac_hemi", "ac_hom")}
+        popmax_population = self.columns["popmax_population"][row]
+        value["faf95"] = {
+            "popmax": round(self.columns["faf95_popmax"][row], 6) if popmax_population else None,
+            "popmax_population": self.meta["populations"][popmax_population - 1] if popmax_population else None,
+        }
+        filters = self.columns["filters"][row]
+        value["filters"] = [name for i, name in enumerate(self.meta["filters"]) if filters & (1 << i)]
+        value["populations"] = [
+            {"id": population, **{field: self.columns[f"{field}_{population}"][row] for field in POPULATION_FIELDS}}
+            for population in self.meta["populations"]
+        ]
+        return value
+
+    def flags(self, row):
+        flags = self.columns["flags"][row]
+        return [name for i, name in enumerate(self.meta["flags"]) if flags & (1 << i)]
+
+
+def _signature(path):
+    """Identity of the meta.json of each sequencing type, an import replaces them"""
+    signature = []
+    for sequencing_type in SEQUENCING_TYPES:
+        try:
+            stat = os.stat(os.path.join(path, sequencing_type, "meta.json"))
+            signature.append((stat.st_ino, stat.st_mtime_ns))
+        except FileNotFoundError:
+            signature.append(None)
+    return tuple(signature)
+
+
+class GnomadStore:
+    def __init__(self, path=STORE_PATH):
+        self.path = path
+        self.signature = _signature(path)
+        self.types = {}
+        for sequencing_type in SEQUENCING_TYPES:
+            if os.path.exists(os.path.join(path, sequencing_type, "meta.json")):
+                self.types[sequencing_type] = _Columns(os.path.join(path, sequencing_type))
+
+    def covers(self, chrom, dataset=gnomad.GNOMAD_DATASET):
+        """
+        Whether the store has everything the API has on chrom: both sequencing types, of dataset, with chrom imported.
+        A store missing a part of it would answer with no data where the API has some.
+        """
+        for sequencing_type in SEQUENCING_TYPES:
+            columns = self.types.get(sequencing_type)
+            if columns is None or columns.meta["dataset"] != dataset:
+                return False
+            chromosomes = columns.meta["chromosomes"]
+            if chromosomes and _chrom(chrom) not in {_chrom(c) for c in chromosomes}:
+                return False
+        return True
+
+    def variants_of_rsid(self, rsid):
+        """Distinct chrom/pos/ref/alt of an rsID over all sequencing types"""
+        found = {}
+        for columns in self.types.values():
+            for row in columns.rows_of_rsid(rsid):
+                found.setdefault(columns.identity(row)[:4], None)
+        return list(found)
+
+    def variant(self, chrom, pos, ref, alt):
+        """Frequency data of a variant in the API's variant { } shape, None if in no sequencing type"""
+        variant = None
+        for sequencing_type in SEQUENCING_TYPES:
+            columns = self.types.get(sequencing_type)
+            row = columns.row_of_variant(chrom, pos, ref, alt) if columns is not None else None
+            if row is None:
+                continue
+            if variant is None:
+                chrom, pos, ref, alt, rsid = columns.identity(row)
+                variant = {
+                    "variantId": f"{chrom}-{pos}-{ref}-{alt}",
+                    "reference_genome": columns.meta["assembly"],
+                    "chrom": chrom, "pos": pos, "ref": ref, "alt": alt,
+                    "rsid": rsid,
+                    "flags": [],
+                    "exome": None,
+                    "genome": None,
+                }
+            variant["flags"] = sorted(set(variant["flags"]) | set(columns.flags(row)))
+            variant[sequencing_type] = columns.frequencies(row)
+        return variant
+
+
+_store = None
+
+
+def get_store(path=STORE_PATH):
+    """The store at path, None if nothing was imported there. Opened again after an import."""
+    global _store
+    signature = _signature(path)
+    if not any(signature):
+        return None
+    if _store is None or _store.path != path or _store.signature != signature:
+        _store = GnomadStore(path)
+    return _store if _store.types else None
+
+
+def query_frequencies(rsid, fields=None):
+    """
+    Local answer to tool_query_gnomad_by_rsid for frequency only field selections
+    :return: the API response shape, or None when the query has to go to the API
+    """
+    try:
+        if gnomad.resolve_fields(fields) != ["frequencies"]:
+            return None
+    except ValueError:
+        return None
+    store = get_store()
+    if store is None:
+        return None
+    variants = store.variants_of_rsid(rsid)
+    # The API refuses rsIDs of several variants, those and unknown ones are left to it
+    if len(variants) != 1 or not store.covers(variants[0][0]):
+        return None
+    return {"data": {"variant": store.variant(*variants[0])}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = subparsers.add_parser("import", help="build the store of a sequencing type from gnomAD sites VCFs")
+    import_parser.add_argument("vcfs", nargs="+", help="gnomAD sites VCFs, optionally bgzipped")
+    import_parser.add_argument("--type", choices=SEQUENCING_TYPES, required=True, help="sequencing type of the VCFs")
+    import_parser.add_argument("--chromosomes", help="comma separated chromosomes to import, all by default")
+    import_parser.add_argument("--assembly", default=DEFAULT_ASSEMBLY, help="reference genome of the VCFs")
+    import_parser.add_argument("--dataset", default=gnomad.GNOMAD_DATASET, help="gnomAD dataset of the VCFs")
+    import_parser.add_argument("--store", default=STORE_PATH, help="store directory")
+
+    lookup_parser = subparsers.add_parser("lookup", help="look a variant up in the store")
+    lookup_parser.add_argument("key", help="rsID or chrom-pos-ref-alt")
+    lookup_parser.add_argument("--store", default=STORE_PATH, help="store directory")
+
+    args = parser.parse_args()
+    if args.command == "import":
+        start = time.time()
+        chromosomes = args.chromosomes.split(",") if args.chromosomes else None
+        count = import_vcfs(args.vcfs, args.store, args.type, chromosomes, args.assembly, args.dataset)
+        print(f"Imported {count} {args.type} variants into {args.store} in {time.time() - start:.1f}s")
+    else:
+        store = get_store(args.store)
+        if store is None:
+            sys.exit(f"No gnomAD store in {args.store}")
+        key = args.key.strip()
+        variants = store.variants_of_rsid(key) if key.lower().startswith("rs") else [tuple(key.replace(":", "-").split("-"))]
+        print(json.dumps([store.variant(*variant) for variant in variants], indent=2))
+
+
+if __name__ == "__main__":
+    main()
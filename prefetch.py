@@ -0,0 +1,157 @@
+"""
+Speculative prefetch of the tools the model is likely to call next
+
+After gnomAD is queried for a variant the model nearly always asks VEP and MutationTaster about
+the same variant in its following turn. Once a round of tool calls is done, the identifiers learnt
+by the cross-reference index give the arguments of those follow-up calls, and they are run in the
+background so that the responses are already cached when the model asks.
+
+Prefetching has its own small thread pool and request rate, and a session's queued prefetches are
+dropped as soon as it schedules new ones or is cancelled.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import tracing
+from cache import get_cached_equivalent
+from scheduler import BULK, priority
+from xref import describe, equivalent_calls, records_for_call, xref_index
+
+logger = logging.getLogger(__name__)
+
+# Set LLMHACK_PREFETCH=0 to only ever call the tools the model asks for
+PREFETCH_ENABLED = os.getenv("LLMHACK_PREFETCH", "1") != "0"
+PREFETCH_MAX_CONCURRENCY = int(os.getenv("LLMHACK_PREFETCH_CONCURRENCY", "2"))
+# Upstream requests per second spent on guesses, shared by all sessions
+PREFETCH_RATE = float(os.getenv("LLMHACK_PREFETCH_RATE", "2"))
+PREFETCH_MAX_PENDING = 32
+# An rsID can stand for several alleles, only the first few are worth guessing for
+PREFETCH_MAX_VARIANTS = 3
+
+# Single variant tools whose calls say which variant the conversation is about
+TRIGGER_TOOLS = (
+    "tool_query_gnomad_by_rsid",
+    "tool_get_variant_consequences_by_id",
+    "tool_get_variant_consequences_by_hgvs",
+    "tool_get_variant_consequences_by_region_and_allele",
+    "tool_get_mutation_tester_result",
+)
+PREFETCH_TOOLS = (
+    "tool_query_gnomad_by_rsid",
+    "tool_get_variant_consequences_by_id",
+    "tool_get_mutation_tester_result",
+)
+
+
+class Prefetcher:
+    def __init__(self, max_concurrency=PREFETCH_MAX_CONCURRENCY, rate=PREFETCH_RATE, max_pending=PREFETCH_MAX_PENDING):
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="prefetch")
+        self.rate = rate
+        self.max_pending = max_pending
+        self.lock = threading.Lock()
+        self.generations = {}
+        self.pending = 0
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.stats = {"scheduled": 0, "completed": 0, "already_cached": 0, "cancelled": 0, "dropped": 0, "failed": 0}
+
+    def cancel(self, session):
+        """Drops the session's queued prefetches, returns its new generation"""
+        with self.lock:
+            generation = self.generations[session] = self.generations.get(session, 0) + 1
+        return generation
+
+    def _stale(self, session, generation):
+        with self.lock:
+            return self.generations.get(session) != generation
+
+    def schedule(self, session, tool_calls, resolve):
+        """
+        Prefetches the likely follow-ups of a round of tool calls
+        :param session: key of the conversation, a newer round of the same session supersedes this one
+        :param tool_calls: tool calls of a completion, as given by the model
+        :param resolve: callable mapping a tool name to the python function, or to its calls on the tool service
+        """
+        calls = []
+        for tool in tool_calls:
+            try:
+                calls.append((tool.function.name, json.loads(tool.function.arguments)))
+            except (TypeError, ValueError):
+                continue
+        generation = self.cancel(session)
+        if any(name in TRIGGER_TOOLS for name, _ in calls):
+            self.executor.submit(self._plan, session, generation, calls, resolve)
+
+    def _plan(self, session, generation, calls, resolve):
+        # The index learns in the background, the identifiers of this round's results must be in first
+        xref_index.flush()
+        called = {name for name, _ in calls}
+        candidates = {}
+        for name, args in calls:
+            if name not in TRIGGER_TOOLS:
+                continue
+            for record in records_for_call(name, args)[:PREFETCH_MAX_VARIANTS]:
+                for tool, tool_args in describe(record)["tool_arguments"].items():
+                    if tool in PREFETCH_TOOLS and tool not in called:
+                        candidates.setdefault(json.dumps([tool, tool_args], sort_keys=True), (tool, tool_args))
+
+        for tool, tool_args in candidates.values():
+            if self._stale(session, generation):
+                return
+            if get_cached_equivalent(tool, tool_args, equivalent_calls) is not None:
+                with self.lock:
+                    self.stats["already_cached"] += 1
+                continue
+            with self.lock:
+                if self.pending >= self.max_pending:
+                    self.stats["dropped"] += 1
+                    continue
+                self.pending += 1
+                self.stats["scheduled"] += 1
+            self.executor.submit(self._fetch, session, generation, tool, tool_args, resolve)
+
+    def _take_token(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(max(self.rate, 1), self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def _fetch(self, session, generation, tool, tool_args, resolve):
+        try:
+            self._take_token()
+            # Checked after waiting for the budget, the session may have moved on meanwhile
+            if self._stale(session, generation):
+                with self.lock:
+                    self.stats["cancelled"] += 1
+                return
+            # Guesses never hold up a request the model actually made
+            with tracing.span("prefetch", tool=tool, session=str(session)), priority(BULK, session):
+                # The tool's cache decorator stores the result, and coalesces with the model's call if it comes now
+                resolve(tool)(**tool_args)
+            with self.lock:
+                self.stats["completed"] += 1
+        except Exception as e:
+            logger.warning("Prefetch of %s failed: %r", tool, e)
+            with self.lock:
+                self.stats["failed"] += 1
+        finally:
+            with self.lock:
+                self.pending -= 1
+
+
+prefetcher = Prefetcher()
+
+
+def prefetch_stats():
+    with prefetcher.lock:
+        return dict(prefetcher.stats)
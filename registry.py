@@ -0,0 +1,235 @@
+"""
+Registry of the tools the model can call
+
+Maps each tool name of tools_json to its python function, with an argument validator compiled
+once from the tool's JSON schema and the metadata the dispatcher schedules calls with.
+Calls to unknown tools or with arguments that don't match the schema are rejected before any I/O.
+"""
+import importlib
+import inspect
+import json
+import threading
+
+from tool_schemas import tools_json
+
+DEFAULT_TIMEOUT = 60
+
+# Cost classes: local calls never leave the process, network calls make a few upstream requests,
+# bulk calls many
+LOCAL, NETWORK, BULK = "local", "network", "bulk"
+
+
+class ToolValidationError(ValueError):
+    """Raised for a call to an unknown tool or with arguments its schema rejects"""
+
+
+_JSON_TYPES = {
+    "string": (str,),
+    "integer": (int,),
+    "number": (int, float),
+    "boolean": (bool,),
+    "array": (list,),
+    "object": (dict,),
+}
+
+
+def compile_schema(schema, path="arguments"):
+    """
+    Compiles the subset of JSON schema used in tools_json (type, properties, required, items, enum)
+    :return: callable(value) returning a list of error messages, empty if value is valid
+    """
+    checks = []
+
+    expected = schema.get("type")
+    if expected is not None:
+        types = _JSON_TYPES[expected]
+
+        def check_type(value, path):
+            # bool is an int in python but not in JSON
+            if not isinstance(value, types) or (isinstance(value, bool) and expected != "boolean"):
+                return [f"{path} must be of type {expected}, got {type(value).__name__}"]
+            return []
+        checks.append(check_type)
+
+    if "enum" in schema:
+        allowed = schema["enum"]
+        checks.append(lambda value, path: [] if value in allowed else [f"{path} must be one of {allowed}, got {value!r}"])
+
+    if "properties" in schema or "required" in schema:
+        properties = {name: compile_schema(sub, f"{path}.{name}") for name, sub in schema.get("properties", {}).items()}
+        required = schema.get("required", [])
+
+        def check_object(value, path):
+            if not isinstance(value, dict):
+                return []
+            errors = [f"{path}.{name} is required" for name in required if name not in value]
+            # The python functions would fail on unexpected keyword arguments anyway
+            errors += [f"{path}.{name} is not an argument of this tool" for name in value if name not in properties]
+            for name, validate in properties.items():
+                if name in value:
+                    errors += validate(value[name])
+            return errors
+        checks.append(check_object)
+
+    if "items" in schema:
+        validate_item = compile_schema(schema["items"], f"{path}[]")
+
+        def check_items(value, path):
+            if not isinstance(value, list):
+                return []
+            return [error for item in value for error in validate_item(item)]
+        checks.append(check_items)
+
+    def validate(value):
+        errors = []
+        for check in checks:
+            errors += check(value, path)
+            if errors:
+                break
+        return errors
+
+    return validate
+
+
+class Tool:
+    """
+    A registered tool
+    :param timeout: seconds a call may take before the dispatcher gives up on it
+    :param cacheable: whether results come from the tool cache when possible
+    :param batch: for single variant tools, callable turning a list of call arguments into a list of
+        (batch tool name, batch arguments) calls that fetch them all at once and fill this tool's cache
+    :param cost: LOCAL, NETWORK or BULK
+    """
+
+    def __init__(self, name, module, schema, timeout=DEFAULT_TIMEOUT, cacheable=True, batch=None, cost=NETWORK):
+        self.name = name
+        self.module = module
+        self.schema = schema
+        self.validator = compile_schema(schema["function"]["parameters"])
+        self.timeout = timeout
+        self.cacheable = cacheable
+        self.batch = batch
+        self.cost = cost
+        self._function = None
+        self._lock = threading.Lock()
+
+    @property
+    def function(self):
+        """The python function, its module is only imported on the first call of one of its tools"""
+        if self._function is None:
+            with self._lock:
+                if self._function is None:
+                    module = importlib.import_module(self.module) if isinstance(self.module, str) else self.module
+                    function = getattr(module, self.name)
+                    parameters = inspect.signature(inspect.unwrap(function)).parameters
+                    unknown = set(self.schema["function"]["parameters"].get("properties", {})) - set(parameters)
+                    if unknown:
+                        raise TypeError(f"{self.name} does not take the schema's arguments {sorted(unknown)}")
+                    self._function = function
+        return self._function
+
+    @property
+    def batchable(self):
+        return self.batch is not None
+
+    def validate(self, args):
+        errors = self.validator(args)
+        if errors:
+            raise ToolValidationError(f"Invalid arguments for {self.name}: " + "; ".join(errors))
+        return args
+
+
+def _batch_gnomad(calls):
+    # One batch per field selection, the cache entries are keyed by it
+    by_fields = {}
+    for args in calls:
+        by_fields.setdefault(json.dumps(args.get("fields")), []).append(args["rsid"])
+    return [("tool_query_gnomad_by_rsids", {"rsids": rsids, "fields": json.loads(fields)}) for fields, rsids in by_fields.items()]
+
+
+def _batch_vep_ids(calls):
+    return [("tool_get_variant_consequences_by_ids", {"ids": [args["id"] for args in calls]})]
+
+
+def _batch_vep_hgvs(calls):
+    return [("tool_get_variant_consequences_by_hgvs_codes", {"hgvs_codes": [args["hgvs_code"] for args in calls]})]
+
+
+def _batch_vep_regions(calls):
+    return [("tool_get_variant_consequences_by_regions_and_alleles", {"variants": calls})]
+
+
+def _batch_mutation_taster(calls):
+    return [("tool_get_mutation_tester_results", {"variants": calls})]
+
+
+TOOL_METADATA = {
+    "tool_query_gnomad_by_rsid": dict(timeout=120, batch=_batch_gnomad),
+    "tool_query_gnomad_by_rsids": dict(timeout=180, cost=BULK),
+    "tool_query_single_nucleotide_polymorphisms_db_by_rsid": dict(),
+    "tool_query_genomic_structural_variation_db_by_rsid": dict(),
+    "tool_get_variant_consequences_by_id": dict(batch=_batch_vep_ids),
+    "tool_get_variant_consequences_by_hgvs": dict(batch=_batch_vep_hgvs),
+    "tool_get_variant_consequences_by_region_and_allele": dict(batch=_batch_vep_regions),
+    "tool_get_variant_consequences_by_ids": dict(timeout=180, cost=BULK),
+    "tool_get_variant_consequences_by_hgvs_codes": dict(timeout=180, cost=BULK),
+    "tool_get_variant_consequences_by_regions_and_alleles": dict(timeout=180, cost=BULK),
+    "tool_get_mutation_tester_result": dict(timeout=120, batch=_batch_mutation_taster),
+    "tool_get_mutation_tester_results": dict(timeout=180, cost=BULK),
+    "tool_get_clinvar_data_by_rcv_code": dict(),
+    "tool_get_raw_tool_output": dict(timeout=5, cacheable=False, cost=LOCAL),
+    "tool_resolve_variant_identifiers": dict(timeout=5, cacheable=False, cost=LOCAL),
+    "tool_query_structural_variants_by_region": dict(timeout=5, cacheable=False, cost=LOCAL),
+    "tool_find_nearest_structural_variants": dict(timeout=5, cacheable=False, cost=LOCAL),
+}
+
+
+class ToolRegistry:
+    def __init__(self):
+        self.tools = {}
+
+    def register(self, module, schema, **metadata):
+        """Registers the tool of schema, implemented by the function of the same name in module (a module or its name)"""
+        name = schema["function"]["name"]
+        self.tools[name] = Tool(name, module, schema, **metadata)
+        return self.tools[name]
+
+    def get(self, name):
+        tool = self.tools.get(name)
+        if tool is None:
+            raise ToolValidationError(f"Unknown tool {name!r}, available tools are {', '.join(sorted(self.tools))}")
+        return tool
+
+    def function(self, name):
+        return self.get(name).function
+
+    def validate(self, name, arguments):
+        """
+        Checks a model supplied call
+        :param name: tool name
+        :param arguments: JSON encoded or already decoded arguments
+        :return: (Tool, decoded arguments), raises ToolValidationError for a bad call
+        """
+        tool = self.get(name)
+        if isinstance(arguments, str):
+            try:
+                arguments = json.loads(arguments) if arguments.strip() else {}
+            except ValueError as e:
+                raise ToolValidationError(f"Arguments for {name} are not valid JSON: {e}")
+        return tool, tool.validate(arguments)
+
+    @property
+    def schemas(self):
+        return [tool.schema for tool in self.tools.values()]
+
+
+def build_registry(module="tools", schemas=tools_json):
+    """Registry of every tool in schemas, with its function taken from module (tools or async_tools)"""
+    registry = ToolRegistry()
+    for schema in schemas:
+        name = schema["function"]["name"]
+        registry.register(module, schema, **TOOL_METADATA.get(name, {}))
+    return registry
+
+
+tool_registry = build_registry()
@@ -0,0 +1,288 @@
+"""
+Priority scheduling of upstream requests
+
+Every request to an upstream API first takes a token from the bucket of its host, which keeps the
+process within each API's rate limit whatever mix of chat sessions and batch jobs it serves.
+Requests waiting for a token are served by class: interactive ones (the chat) always go before
+bulk ones (batch annotation, prefetching), so bulk work only gets the capacity the chat leaves,
+and a bucket never lends its last token to bulk work. Within a class the sessions take turns,
+a session with a hundred queued requests does not hold up another's single one.
+
+The class and session are taken from the caller's context:
+
+    with priority(BULK, session="annotate"):
+        ...
+
+Requests made outside of such a block are interactive and of no particular session.
+
+Worker processes take their tokens from the buckets of a parent process with use_shared(*share())
+rather than from buckets of their own, which would multiply every rate by the number of workers.
+"""
+import asyncio
+import contextvars
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from multiprocessing.managers import BaseManager
+
+INTERACTIVE, BULK = "interactive", "bulk"
+# In the order waiting requests are served
+CLASSES = (INTERACTIVE, BULK)
+
+# Set LLMHACK_SCHEDULER=0 to send requests as soon as they are made
+SCHEDULER_ENABLED = os.getenv("LLMHACK_SCHEDULER", "1") != "0"
+
+# NCBI allows 3 requests/s without an API key and 10 with one
+NCBI_API_KEY = os.getenv("NCBI_API_KEY")
+
+# host -> requests per second, with bursts of up to as many requests
+UPSTREAM_RATES = {
+    "rest.ensembl.org": 15,
+    "grch37.rest.ensembl.org": 15,
+    "eutils.ncbi.nlm.nih.gov": 10 if NCBI_API_KEY else 3,
+    "clinicaltables.nlm.nih.gov": 10,
+    "gnomad.broadinstitute.org": 4,
+    "www.genecascade.org": 2,
+}
+# e.g. LLMHACK_UPSTREAM_RATES=rest.ensembl.org=5,gnomad.broadinstitute.org=1
+UPSTREAM_RATES.update({host: float(rate) for host, rate in
+                       (item.split("=", 1) for item in os.getenv("LLMHACK_UPSTREAM_RATES", "").split(",") if item)})
+DEFAULT_RATE = 4
+# Tokens a bucket keeps for interactive requests
+BULK_RESERVE = 1
+# Latest queueing delays kept per class for the percentiles
+DELAY_SAMPLES = 1000
+
+_priority = contextvars.ContextVar("upstream_priority", default=(INTERACTIVE, None))
+
+
+@contextmanager
+def priority(request_class, session=None):
+    """Upstream requests made in the block are of request_class (INTERACTIVE or BULK) and session"""
+    if request_class not in CLASSES:
+        raise ValueError(f"Unknown request class {request_class!r}, expected one of {CLASSES}")
+    token = _priority.set((request_class, session))
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current():
+    """(request class, session) of the caller"""
+    return _priority.get()
+
+
+class _Ticket:
+    """A request waiting for a token, woken when it may be its turn"""
+
+    def __init__(self, request_class, session, loop=None):
+        self.request_class = request_class
+        self.session = session
+        self.queued = time.monotonic()
+        self.loop = loop
+        self.event = asyncio.Event() if loop is not None else threading.Event()
+
+    def wake(self):
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self.event.set)
+
+
+class Upstream:
+    """Token bucket of a host and the requests waiting for it"""
+
+    def __init__(self, host, rate):
+        self.host = host
+        self.rate = rate
+        self.capacity = max(rate, 1)
+        self.reserve = min(BULK_RESERVE, self.capacity - 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        # request class -> session -> tickets, the first session of a class is next in turn
+        self.waiting = {request_class: OrderedDict() for request_class in CLASSES}
+
+    def _head(self):
+        for sessions in self.waiting.values():
+            if sessions:
+                return next(iter(sessions.values()))[0]
+        return None
+
+    def _enqueue(self, ticket):
+        self.waiting[ticket.request_class].setdefault(ticket.session, deque()).append(ticket)
+
+    def _remove(self, ticket):
+        sessions = self.waiting[ticket.request_class]
+        tickets = sessions[ticket.session]
+        tickets.remove(ticket)
+        if tickets:
+            # The session goes to the back of its class, the next session takes its turn
+            sessions.move_to_end(ticket.session)
+        else:
+            del sessions[ticket.session]
+        head = self._head()
+        if head is not None:
+            head.wake()
+
+    def _try_take(self, ticket):
+        """0 when ticket got a token, else seconds until it may get one, None when it isn't its turn"""
+        if self._head() is not ticket:
+            return None
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        needed = 1 + (self.reserve if ticket.request_class == BULK else 0)
+        if self.tokens >= needed:
+            self.tokens -= 1
+            self._remove(ticket)
+            return 0
+        return (needed - self.tokens) / self.rate
+
+    def acquire(self, ticket):
+        with self.lock:
+            self._enqueue(ticket)
+        try:
+            while True:
+                with self.lock:
+                    delay = self._try_take(ticket)
+                    if delay == 0:
+                        return
+                    ticket.event.clear()
+                ticket.event.wait(delay)
+        except BaseException:
+            with self.lock:
+                if ticket in self.waiting[ticket.request_class].get(ticket.session, ()):
+                    self._remove(ticket)
+            raise
+
+    async def acquire_async(self, ticket):
+        with self.lock:
+            self._enqueue(ticket)
+        try:
+            while True:
+                with self.lock:
+                    delay = self._try_take(ticket)
+                    if delay == 0:
+                        return
+                    ticket.event.clear()
+                try:
+                    await asyncio.wait_for(ticket.event.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            # A cancelled task must not stay at the head of the queue
+            with self.lock:
+                if ticket in self.waiting[ticket.request_class].get(ticket.session, ()):
+                    self._remove(ticket)
+            raise
+
+
+class Scheduler:
+    def __init__(self, rates=UPSTREAM_RATES, default_rate=DEFAULT_RATE, enabled=SCHEDULER_ENABLED):
+        self.rates = rates
+        self.default_rate = default_rate
+        self.enabled = enabled
+        self.upstreams = {}
+        self.lock = threading.Lock()
+        self.requests = {request_class: 0 for request_class in CLASSES}
+        self.delays_ms = {request_class: deque(maxlen=DELAY_SAMPLES) for request_class in CLASSES}
+        # Proxy of the scheduler of another process taking the tokens instead, see use_shared()
+        self.remote = None
+
+    def upstream(self, host):
+        with self.lock:
+            if host not in self.upstreams:
+                self.upstreams[host] = Upstream(host, self.rates.get(host, self.default_rate))
+            return self.upstreams[host]
+
+    def _record(self, ticket):
+        delay_ms = (time.monotonic() - ticket.queued) * 1000
+        with self.lock:
+            self.requests[ticket.request_class] += 1
+            self.delays_ms[ticket.request_class].append(delay_ms)
+        return round(delay_ms, 3)
+
+    def acquire(self, host, request_priority=None):
+        """
+        Waits for the turn of a request to host
+        :param request_priority: (request class, session) of the request, by default the caller's
+        :return: milliseconds spent waiting
+        """
+        request_priority = request_priority or current()
+        if self.remote is not None:
+            return self.remote.acquire(host, request_priority)
+        if not self.enabled:
+            return 0.0
+        ticket = _Ticket(*request_priority)
+        self.upstream(host).acquire(ticket)
+        return self._record(ticket)
+
+    async def acquire_async(self, host):
+        """acquire for coroutines, waits without blocking the event loop"""
+        if self.remote is not None:
+            return await asyncio.to_thread(self.remote.acquire, host, current())
+        if not self.enabled:
+            return 0.0
+        ticket = _Ticket(*current(), loop=asyncio.get_running_loop())
+        await self.upstream(host).acquire_async(ticket)
+        return self._record(ticket)
+
+    def stats(self):
+        with self.lock:
+            upstreams = list(self.upstreams.values())
+            classes = {}
+            for request_class in CLASSES:
+                delays = sorted(self.delays_ms[request_class])
+                classes[request_class] = {
+                    "requests": self.requests[request_class],
+                    "queue_p50_ms": round(delays[len(delays) // 2], 1) if delays else None,
+                    "queue_p95_ms": round(delays[min(len(delays) - 1, int(len(delays) * 0.95))], 1) if delays else None,
+                    "queue_max_ms": round(delays[-1], 1) if delays else None,
+                }
+        hosts = {}
+        for upstream in upstreams:
+            with upstream.lock:
+                hosts[upstream.host] = {
+                    "rate": upstream.rate,
+                    "tokens": round(upstream.tokens, 2),
+                    **{f"{request_class}_waiting": sum(len(tickets) for tickets in upstream.waiting[request_class].values())
+                       for request_class in CLASSES},
+                }
+        return {"classes": classes, "hosts": hosts}
+
+
+scheduler = Scheduler()
+
+
+def scheduler_stats():
+    return scheduler.stats()
+
+
+class _SchedulerManager(BaseManager):
+    pass
+
+
+_SchedulerManager.register("scheduler", callable=lambda: scheduler, exposed=("acquire",))
+
+
+def share():
+    """
+    Serves the scheduler of this process to others, from a thread of its own
+    :return: (address, authkey) to pass to use_shared() in the other processes
+    """
+    authkey = secrets.token_bytes(32)
+    server = _SchedulerManager(authkey=authkey).get_server()
+    threading.Thread(target=server.serve_forever, name="scheduler-server", daemon=True).start()
+    return server.address, authkey
+
+
+def use_shared(address, authkey):
+    """Makes this process wait for the tokens of the scheduler served by share(), e.g. as a pool initializer"""
+    manager = _SchedulerManager(address=address, authkey=authkey)
+    manager.connect()
+    scheduler.remote = manager.scheduler()
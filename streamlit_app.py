@@ -2,8 +2,16 @@ import streamlit as st
 from mistralai.client import MistralClient
 from mistralai.models.chat_completion import ChatMessage
 import os 
-from tools import *
+from registry import tool_registry
+from dispatch import run_tool_calls
+from chat import TOOL_MODEL, stream_chat, tool_round
+import tracing
+from context import ContextManager
+from prefetch import PREFETCH_ENABLED, prefetcher
+from tool_service import connect
+from scheduler import INTERACTIVE, priority
 import json
+import uuid
 
 
 api_key = os.getenv("MISTRAL_API_KEY")
@@ -13,7 +21,13 @@ if not api_key:
         api_key = st.session_state["api_key"]
     api_key = st.session_state["api_key"]
 
-client = MistralClient(api_key=api_key)
+@st.cache_resource(show_spinner=False)
+def get_client(api_key):
+    # One client, and its HTTP connection pool, per API key for the whole server process instead of one per rerun
+    return MistralClient(api_key=api_key)
+
+
+client = get_client(api_key)
 
 # Initialize the model in session state if it's not already set
 if "mistral_model" not in st.session_state:
@@ -22,21 +36,37 @@ if "mistral_model" not in st.session_state:
 model_options = ('mistral-small-latest', 'mistral-medium-latest', 'mistral-large-latest')
 st.session_state["mistral_model"] = st.selectbox('Select a model', model_options, index=model_options.index(st.session_state["mistral_model"]), key="model_select")
 
+# Picking tools is a simpler task than writing the answer, a smaller model does it faster
+tool_model_options = ("Same as the answer model",) + model_options
+if "tool_model" not in st.session_state:
+    st.session_state["tool_model"] = TOOL_MODEL if TOOL_MODEL in model_options else ""
+tool_model = st.sidebar.selectbox('Model picking the tools', tool_model_options, index=tool_model_options.index(st.session_state["tool_model"] or tool_model_options[0]))
+st.session_state["tool_model"] = tool_model if tool_model in model_options else ""
+
 st.title("Genetic Variant Analysis Bot")
 
 def response_generator():
-    chat_response = client.chat(
+    completion = stream_chat(
+        client,
         model=st.session_state.mistral_model,
         messages=st.session_state.messages,
     )
 
-    return chat_response.choices[0].message.content
+    yield from completion
 
 first_prompt = "Hello 👋. I'm your personal assistant for genetic variant analysis. I have access to all the tools listed in the widely accepted framework from Richards et al 2015. Please explain the task you would like me to help with:"
 
 if "messages" not in st.session_state:
     st.session_state.messages = []
 
+if "session_id" not in st.session_state:
+    st.session_state["session_id"] = uuid.uuid4().hex
+
+# Rolling summary of the conversation once it outgrows the context budget
+if "context_state" not in st.session_state:
+    st.session_state["context_state"] = {}
+context_manager = ContextManager()
+
 if not "system_prompt" in st.session_state:
     st.session_state["system_prompt"] = "You are an expert in genomic medicine here to help me with my tasks in genetic variant analysis. You should help me to analyse the clinical significance of a variant. Please follow the standards set out in the Sue Richards et al 2015 paper and the framework adopted by the American College of Medical Genetics and Genomics and the Association for Molecular Pathology. Please aim to stablish the variant's frequency in the population, determine the variant's impact on protein function and evaluate the variant's clinical significance. Make use of the tools available"
 
@@ -44,45 +74,69 @@ if st.session_state["system_prompt"] and not any(message.role == "system" for me
     st.session_state.messages.insert(0, ChatMessage(role="system", content=st.session_state["system_prompt"]))
     st.session_state.messages.insert(1, ChatMessage(role="assistant", content=first_prompt))
 
-for message in st.session_state.messages:
-    if message.role != 'system':  
-        with st.chat_message(message.role):
-            st.markdown(message.content) 
+# Only the latest messages are rendered on a rerun, so its cost stays flat as a case review grows
+HISTORY_PAGE_SIZE = 30
+
+
+def render_message(message):
+    if message.role == "tool":
+        # Raw tool payloads are for the model, they stay collapsed
+        with st.expander(f"Output of {(message.name or 'tool')[5:]}"):
+            st.code(message.content, language="json")
+    elif message.tool_calls and not message.content:
+        st.caption("Used " + ", ".join(call.function.name[5:] for call in message.tool_calls))
+    else:
+        st.markdown(message.content)
+
+
+history = [message for message in st.session_state.messages if message.role != "system"]
+hidden = max(0, len(history) - HISTORY_PAGE_SIZE)
+if hidden and not st.toggle(f"Show {hidden} earlier messages", key="show_full_history"):
+    history = history[hidden:]
+
+with tracing.span("render", what="history", messages=len(history)):
+    for message in history:
+        with st.chat_message("assistant" if message.role == "tool" else message.role):
+            render_message(message)
 
 if prompt := st.chat_input("Explain genomic variant analysis task..."):
-    st.session_state.messages.append(ChatMessage(role="user", content=prompt))
-    with st.chat_message("user"):
-        st.markdown(prompt)
-    
-    completion = client.chat(model=st.session_state.mistral_model, messages=st.session_state.messages, tools=tools_json, tool_choice="auto").choices[0]
-    print(completion)
-    st.session_state.messages.append(completion.message)
-    if completion.message.tool_calls is not None and len(completion.message.tool_calls) > 0:  
-        print("USE TOOLS")
-        for tool in  completion.message.tool_calls:
-            function_name = tool.function.name
-            with st.chat_message("assistant"):
-                st.write(f"Please wait, I'm using the tool {function_name[5:]} to find out more...")
-            arguments = tool.function.arguments
-
-            args_dict = json.loads(arguments)
-
-            print(f"Calling {function_name} with {args_dict}")
-
-            output = json.dumps(eval(function_name)(**args_dict))
-            tool_message = ChatMessage(role="tool", function_name=function_name, content=output)
-            print(f"received output from {function_name}: {output}")
-            st.session_state.messages.append(tool_message)
-        
-        print("here")
-        completion = client.chat(model=st.session_state.mistral_model, messages=st.session_state.messages, tools=tools_json, tool_choice="none").choices[0]
+    with tracing.span("turn", model=st.session_state.mistral_model) as turn:
+        st.session_state["last_trace_id"] = turn.trace_id
+        st.session_state.messages.append(ChatMessage(role="user", content=prompt))
+        with st.chat_message("user"):
+            st.markdown(prompt)
+
+        # Text of a direct answer is rendered as it arrives, tool calls are dispatched as soon as they are complete
+        completion, deltas = tool_round(client, st.session_state["tool_model"], st.session_state.mistral_model, messages=context_manager.prepare(client, st.session_state.messages, st.session_state["context_state"]), tools=tool_registry.schemas)
+        if deltas is not None:
+            with st.chat_message("assistant"), tracing.span("render", what="answer"):
+                st.write_stream(deltas)
         st.session_state.messages.append(completion.message)
-        chat_response = completion.message.content
-        with st.chat_message("assistant"):
-            st.write(chat_response)
-    else:
-        print("PRINT")
-        chat_response = completion.message.content
-        with st.chat_message("assistant"):
-            st.write(chat_response)
-        
\ No newline at end of file
+        if completion.tool_calls:
+            for tool in  completion.tool_calls:
+                function_name = tool.function.name
+                with st.chat_message("assistant"):
+                    st.write(f"Please wait, I'm using the tool {function_name[5:]} to find out more...")
+
+            # Independent tool calls run in parallel, results keep the model's order
+            # With LLMHACK_TOOL_SERVICE set they run on workers shared with the other sessions
+            tool_service = connect()
+            with priority(INTERACTIVE, st.session_state["session_id"]):
+                outputs = tool_service.run_tool_calls(completion.tool_calls) if tool_service is not None else run_tool_calls(completion.tool_calls, tool_registry)
+            for function_name, output in outputs:
+                tool_message = ChatMessage(role="tool", name=function_name, function_name=function_name, content=output)
+                st.session_state.messages.append(tool_message)
+
+            # Warms the cache for the tools the next turn will likely call on the same variants, on the service's workers if there is one
+            if PREFETCH_ENABLED:
+                resolve = tool_service.function if tool_service is not None else tool_registry.function
+                prefetcher.schedule(st.session_state["session_id"], completion.tool_calls, resolve)
+
+            completion = stream_chat(client, model=st.session_state.mistral_model, messages=context_manager.prepare(client, st.session_state.messages, st.session_state["context_state"]), tools=tool_registry.schemas, tool_choice="none")
+            with st.chat_message("assistant"), tracing.span("render", what="answer"):
+                st.write_stream(completion)
+            st.session_state.messages.append(completion.message)
+
+if st.sidebar.checkbox("Show debug trace") and "last_trace_id" in st.session_state:
+    # Spans of the last turn: LLM round trips, tool calls, HTTP requests, parses and renders
+    st.sidebar.dataframe(tracing.recent_spans(st.session_state["last_trace_id"]))
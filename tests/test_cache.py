@@ -0,0 +1,174 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import cache
+from cache import ToolCache, cache_key, cached
+
+
+class Clock:
+    """Stands in for time.time, one second passes on every reading"""
+
+    def __init__(self):
+        self.now = 1000000.0
+
+    def __call__(self):
+        self.now += 1
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def tool_cache(tmp_path, monkeypatch):
+    """A fresh cache behind get_cached, set_cached and the cached decorator"""
+    tool_cache = ToolCache(str(tmp_path / "cache.sqlite"))
+    monkeypatch.setattr(cache, "tool_cache", tool_cache)
+    return tool_cache
+
+
+def test_entries_expire_after_their_ttl(tmp_path, clock):
+    tool_cache = ToolCache(str(tmp_path / "cache.sqlite"))
+    tool_cache.set("short", "clinvar", {"a": 1}, ttl=10)
+    tool_cache.set("long", "gnomad", {"b": 2}, ttl=1000)
+    assert tool_cache.get("short") == {"a": 1}
+
+    clock.now += 100
+    assert tool_cache.get("short") is None
+    assert tool_cache.get("long") == {"b": 2}
+    # Expired on disk as well, not only in memory
+    assert ToolCache(tool_cache.path).get("short") is None
+
+
+def test_memory_keeps_the_most_recently_used(tmp_path):
+    tool_cache = ToolCache(str(tmp_path / "cache.sqlite"), memory_max_entries=2)
+    for key in ("a", "b"):
+        tool_cache.set(key, "gnomad", key, ttl=1000)
+    tool_cache.get("a")
+    tool_cache.set("c", "gnomad", "c", ttl=1000)
+
+    assert list(tool_cache.memory) == ["a", "c"]
+    assert tool_cache.stats["evictions"] == 1
+    # Still on disk
+    assert tool_cache.get("b") == "b"
+    assert tool_cache.stats["disk_hits"] == 1
+
+
+def test_disk_keeps_the_most_recently_read(tmp_path, clock):
+    tool_cache = ToolCache(str(tmp_path / "cache.sqlite"), memory_max_entries=0, disk_max_entries=50)
+    for i in range(60):
+        tool_cache.set(f"k{i}", "gnomad", i, ttl=10 ** 6)
+    for i in range(10):
+        assert tool_cache.get(f"k{i}") == i
+    # The 100th write trims the file to the 50 entries read or written last
+    for i in range(60, 100):
+        tool_cache.set(f"k{i}", "gnomad", i, ttl=10 ** 6)
+
+    kept = {key for key, in tool_cache._connection().execute("SELECT key FROM responses")}
+    assert kept == {f"k{i}" for i in list(range(10)) + list(range(60, 100))}
+
+
+def test_values_are_copies(tmp_path):
+    tool_cache = ToolCache(str(tmp_path / "cache.sqlite"))
+    value = {"frequencies": [1, 2]}
+    tool_cache.set("key", "gnomad", value, ttl=1000)
+    value["frequencies"].append(3)
+    tool_cache.get("key")["frequencies"].append(4)
+    assert tool_cache.get("key") == {"frequencies": [1, 2]}
+
+
+def test_cache_key_normalization():
+    assert cache_key("tool", {"rsid": " RS699 ", "fields": ["af"]}) == cache_key("tool", {"fields": ["af"], "rsid": "rs699"})
+    assert cache_key("tool", {"ids": {"id": "Rs1"}}) == cache_key("tool", {"ids": {"id": "rs1"}})
+    # Only rsIDs are case insensitive
+    assert cache_key("tool", {"hgvs_code": "NM_000.1:c.1A>G"}) != cache_key("tool", {"hgvs_code": "nm_000.1:c.1a>g"})
+    assert cache_key("tool", {"rsid": "rs1"}) != cache_key("other_tool", {"rsid": "rs1"})
+
+
+def test_failed_lookups_are_not_cached(tool_cache):
+    results = [None, {"found": True}]
+
+    @cached("gnomad")
+    def lookup(rsid):
+        return results.pop(0)
+
+    assert lookup("rs1") is None
+    assert lookup("rs1") == {"found": True}
+    assert lookup("RS1") == {"found": True}
+    assert results == []
+
+
+def test_concurrent_calls_are_coalesced(tool_cache):
+    calls, release = [], threading.Event()
+
+    @cached("gnomad")
+    def lookup(rsid):
+        calls.append(rsid)
+        release.wait(5)
+        return {"rsid": rsid}
+
+    results = [None] * 8
+    coalesced = cache.single_flight.stats["coalesced"]
+
+    def call(i):
+        results[i] = lookup("rs699")
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(len(results))]
+    for thread in threads:
+        thread.start()
+    # The leader is held until all the others wait for it
+    deadline = time.monotonic() + 5
+    while cache.single_flight.stats["coalesced"] - coalesced < len(results) - 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert calls == ["rs699"]
+    assert results == [{"rsid": "rs699"}] * len(results)
+    # Every caller got a copy of its own
+    assert len({id(result) for result in results}) == len(results)
+
+
+def test_concurrent_coroutines_are_coalesced(tool_cache):
+    calls = []
+
+    @cached("gnomad")
+    async def lookup(rsid):
+        calls.append(rsid)
+        await asyncio.sleep(0.05)
+        return {"rsid": rsid}
+
+    async def main():
+        return await asyncio.gather(*(lookup("rs699") for _ in range(8)))
+
+    results = asyncio.run(main())
+    assert calls == ["rs699"]
+    assert results == [{"rsid": "rs699"}] * 8
+
+
+def test_leader_uses_a_result_stored_after_the_lookup(tool_cache, monkeypatch):
+    calls = []
+
+    @cached("gnomad")
+    def lookup(rsid):
+        calls.append(rsid)
+        return {"rsid": rsid, "fresh": True}
+
+    # As if an earlier leader stored the result between this call's lookup and it taking over the key
+    monkeypatch.setattr(cache, "get_cached_equivalent", lambda *args: None)
+    tool_cache.set(cache_key("lookup", {"rsid": "rs699"}), "gnomad", {"rsid": "rs699"}, ttl=1000)
+    misses = tool_cache.stats["misses"]
+
+    assert lookup("rs699") == {"rsid": "rs699"}
+    assert calls == []
+    assert lookup("rs700") == {"rsid": "rs700", "fresh": True}
+    # The second look of a miss isn't counted again
+    assert tool_cache.stats["misses"] == misses
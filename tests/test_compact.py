@@ -0,0 +1,52 @@
+import json
+import os
+
+import pytest
+
+import compact
+from cache import ToolCache
+from compact import compact_tool_output, get_raw_output
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmark_fixtures")
+
+
+@pytest.fixture(autouse=True)
+def raw_output_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(compact, "raw_output_cache", ToolCache(str(tmp_path / "raw.sqlite")))
+
+
+def _fixture(name):
+    with open(os.path.join(FIXTURES, name)) as f:
+        return json.load(f)
+
+
+@pytest.mark.parametrize("function_name, args, fixture", [
+    ("tool_query_gnomad_by_rsid", {"rsid": "rs699"}, "gnomad_variant.json"),
+    ("tool_get_variant_consequences_by_id", {"id": "rs699"}, "vep.json"),
+])
+def test_summary_is_smaller_and_the_payload_retrievable(function_name, args, fixture):
+    result = _fixture(fixture)
+    compacted = compact_tool_output(function_name, args, result)
+
+    assert set(compacted) == {"summary", "raw_ref"}
+    assert len(json.dumps(compacted)) < len(json.dumps(result))
+    assert get_raw_output(compacted["raw_ref"]) == {"tool": function_name, "arguments": args, "output": result}
+    # The same payload gets the same reference
+    assert compact_tool_output(function_name, args, result)["raw_ref"] == compacted["raw_ref"]
+
+
+def test_gnomad_summary_keeps_the_variant():
+    variant = _fixture("gnomad_variant.json")["data"]["variant"]
+    summary = compact_tool_output("tool_query_gnomad_by_rsid", {"rsid": "rs699"}, {"data": {"variant": variant}})["summary"]
+    assert {key: summary["variant"][key] for key in ("variantId", "rsid")} == {key: variant[key] for key in ("variantId", "rsid")}
+
+
+def test_other_outputs_are_sent_as_is():
+    assert compact_tool_output("tool_get_clinvar_data_by_rcv_code", {"rcv": "RCV000019686"}, {"a": 1}) == {"a": 1}
+    assert compact_tool_output("tool_query_gnomad_by_rsid", {"rsid": "rs1"}, None) is None
+    # A payload the summarizer doesn't understand is better sent whole than lost
+    assert compact_tool_output("tool_query_gnomad_by_rsid", {"rsid": "rs1"}, ["unexpected"]) == ["unexpected"]
+
+
+def test_unknown_reference():
+    assert get_raw_output("raw-0000000000000000") is None
@@ -0,0 +1,120 @@
+import json
+
+import pytest
+from mistralai.models.chat_completion import (
+    ChatCompletionResponse, ChatCompletionResponseChoice, ChatMessage, FunctionCall, ToolCall,
+)
+from mistralai.models.common import UsageInfo
+
+from context import ContextManager, count_tokens
+
+
+class SummaryClient:
+    """Stands in for MistralClient.chat, answers every summary request with a fixed text or raises"""
+
+    def __init__(self, summary="rs699 is benign", error=None):
+        self.summary = summary
+        self.error = error
+        self.requests = []
+
+    def chat(self, model, messages, **kwargs):
+        self.requests.append(messages)
+        if self.error is not None:
+            raise self.error
+        return ChatCompletionResponse(
+            id="test", object="chat.completion", created=0, model=model,
+            usage=UsageInfo(prompt_tokens=100, completion_tokens=10, total_tokens=110),
+            choices=[ChatCompletionResponseChoice(
+                index=0, message=ChatMessage(role="assistant", content=self.summary), finish_reason="stop",
+            )],
+        )
+
+
+def _conversation(turns, payload_size):
+    messages = [ChatMessage(role="system", content="You annotate variants.")]
+    for i in range(turns):
+        messages += [
+            ChatMessage(role="user", content=f"What about rs{1000 + i}?"),
+            ChatMessage(role="assistant", content="", tool_calls=[ToolCall(
+                id=f"call{i}", function=FunctionCall(name="tool_query_gnomad_by_rsid", arguments=json.dumps({"rsid": f"rs{1000 + i}"})),
+            )]),
+            ChatMessage(role="tool", name="tool_query_gnomad_by_rsid", content=json.dumps({"data": "x" * payload_size, "raw_ref": f"raw{i}"})),
+            ChatMessage(role="assistant", content=f"rs{1000 + i} is rare."),
+        ]
+    return messages
+
+
+def test_within_budget_is_sent_as_is():
+    messages = _conversation(3, 100)
+    client = SummaryClient()
+    assert ContextManager(budget_tokens=10000).prepare(client, messages, {}) is messages
+    assert client.requests == []
+
+
+def test_stale_tool_payloads_are_elided_first():
+    messages = _conversation(3, 4000)
+    client = SummaryClient()
+    prepared = ContextManager(budget_tokens=1500).prepare(client, messages, {})
+    assert len(prepared) == len(messages)
+    assert json.loads(prepared[3].content) == {"elided": "output of an earlier tool call, summarized in the conversation", "raw_ref": "raw0"}
+    assert prepared[-2].content == messages[-2].content
+    assert client.requests == []
+
+
+def test_older_turns_are_summarized_with_variants_pinned():
+    messages = _conversation(6, 4000)
+    client = SummaryClient()
+    state = {}
+    manager = ContextManager(budget_tokens=1200, keep_recent_turns=2)
+    prepared = manager.prepare(client, messages, state)
+
+    assert prepared[0].role == "system"
+    assert prepared[0].content.startswith("You annotate variants.")
+    assert "Variants under discussion: " + ", ".join(f"rs{1000 + i}" for i in range(6)) in prepared[0].content
+    assert prepared[0].content.endswith("Summary of the earlier conversation: rs699 is benign")
+    # The two latest turns follow, only the latest one with its tool payload
+    assert [m.content for m in prepared[1:] if m.role != "tool"] == [m.content for m in messages[-8:] if m.role != "tool"]
+    assert json.loads(prepared[3].content)["elided"]
+    assert prepared[-2].content == messages[-2].content
+    assert count_tokens(prepared) < count_tokens(messages)
+    assert len(client.requests) == 1
+
+    # The same turn prepared again (e.g. for the answer after the tool calls) reuses the summary
+    manager.prepare(client, messages + [ChatMessage(role="assistant", content="more")], state)
+    assert len(client.requests) == 1
+
+
+def test_failed_summary_falls_back_to_elided_messages():
+    messages = _conversation(6, 4000)
+    client = SummaryClient(error=RuntimeError("rate limited"))
+    state = {}
+    manager = ContextManager(budget_tokens=1200)
+    prepared = manager.prepare(client, messages, state)
+    assert len(prepared) == len(messages)
+    assert json.loads(prepared[3].content)["elided"]
+    assert "summary" not in state
+
+    # Not retried within the same turn
+    manager.prepare(client, messages, state)
+    assert len(client.requests) == 1
+
+
+def test_failed_summary_keeps_the_previous_one():
+    messages = _conversation(6, 4000)
+    client = SummaryClient()
+    state = {}
+    manager = ContextManager(budget_tokens=1200)
+    manager.prepare(client, messages[:-8], state)
+    covered = state["summary"][0]
+
+    client.error = RuntimeError("rate limited")
+    prepared = manager.prepare(client, messages, state)
+    assert state["summary"][0] == covered
+    assert prepared[0].content.endswith("Summary of the earlier conversation: rs699 is benign")
+    # Everything the previous summary doesn't cover is still sent
+    assert [m.content for m in prepared[1:] if m.role == "user"] == [m.content for m in messages[covered:] if m.role == "user"]
+
+
+def test_at_least_one_recent_turn_is_kept():
+    with pytest.raises(ValueError):
+        ContextManager(keep_recent_turns=0)
@@ -0,0 +1,89 @@
+import gzip
+import random
+import sys
+from array import array
+
+import pytest
+
+import dbvar_index
+
+TYPES = ("deletion", "duplication", "copy number variation")
+
+
+@pytest.fixture(scope="module")
+def indexed(tmp_path_factory):
+    """An index of random structural variants, some of them huge, and the variants as imported"""
+    path = tmp_path_factory.mktemp("dbvar")
+    rng = random.Random(1)
+    variants = []
+    with gzip.open(path / "nr.tsv.gz", "wt") as f:
+        f.write("#chr\touttermost\toutermost_start\toutermost_stop\tvariant_type\tvariant\tclinical_assertion\n")
+        for i in range(20000):
+            chrom, start = rng.choice(["1", "2", "X"]), rng.randint(1, 5000000)
+            end = start + int(rng.expovariate(1 / 5000)) + (5000000 if rng.random() < 0.001 else 0)
+            variant_type = rng.choice(TYPES)
+            variants.append((chrom, start, end, variant_type, f"nsv{i}"))
+            f.write(f"{chrom}\tx\t{start}\t{end}\t{variant_type}\tnsv{i}\t\n")
+    with open(path / "calls.vcf", "w") as f:
+        f.write("##fileformat=VCFv4.1\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n")
+        for i in range(500):
+            start = rng.randint(1, 5000000)
+            end = start + rng.randint(1, 10000)
+            variants.append(("2", start, end, "inversion", f"essv{i}"))
+            f.write(f"2\t{start}\tessv{i}\tN\t<INV>\t.\t.\tSVTYPE=INV;END={end}\n")
+    dbvar_index.import_files([str(path / "nr.tsv.gz"), str(path / "calls.vcf")], str(path / "index"))
+    return dbvar_index.DbvarIndex(str(path / "index")), variants
+
+
+def _queries(count):
+    rng = random.Random(2)
+    for _ in range(count):
+        start = rng.randint(1, 5000000)
+        yield rng.choice(["1", "2", "X"]), start, start + rng.randint(0, 20000)
+
+
+def test_overlapping_and_nearest_match_a_scan(indexed):
+    index, variants = indexed
+    for chrom, start, end in _queries(200):
+        found = sorted(index.variant(row)["id"] for row in index.overlapping_rows(chrom, start, end))
+        assert found == sorted(v[4] for v in variants if v[0] == chrom and v[1] <= end and v[2] >= start), (chrom, start, end)
+
+        distances = sorted(max(0, v[1] - start, start - v[2]) for v in variants if v[0] == chrom)[:5]
+        assert [distance for distance, _ in index.nearest_rows(chrom, start, 5)] == distances, (chrom, start)
+
+
+def test_query_region_ranks_like_a_scan(indexed, monkeypatch):
+    index, variants = indexed
+    monkeypatch.setattr(dbvar_index, "get_index", lambda path=None: index)
+    for chrom, start, end in _queries(100):
+        for variant_type in (None, "deletion"):
+            expected = []
+            for v_chrom, v_start, v_end, v_type, accession in variants:
+                if v_chrom == chrom and v_start <= end and v_end >= start and variant_type in (None, v_type):
+                    overlap = min(end, v_end) - max(start, v_start) + 1
+                    expected.append((round(min(overlap / (v_end - v_start + 1), overlap / (end - start + 1)), 4), accession))
+            result = dbvar_index.query_region(chrom, start, end, variant_type, max_results=10)
+            assert result["total"] == len(expected)
+            ranked = [(v["reciprocal_overlap"], v["id"]) for v in result["structural_variants"]]
+            assert [r for r, _ in ranked] == sorted((r for r, _ in expected), reverse=True)[:10]
+            assert set(ranked) <= set(expected)
+
+
+def test_order_sorted_in_runs_without_numpy(tmp_path, monkeypatch):
+    # Few distinct keys, ties have to keep their row order
+    keys = array("Q", [(row * 7919) % 100 << 40 | row % 7 for row in range(5000)])
+    with open(tmp_path / "keys.bin", "wb") as f:
+        keys.tofile(f)
+    expected = sorted(range(len(keys)), key=keys.__getitem__)
+
+    dbvar_index._write_order(str(tmp_path / "keys.bin"), str(tmp_path / "numpy.bin"), len(keys))
+    monkeypatch.setitem(sys.modules, "numpy", None)
+    monkeypatch.setattr(dbvar_index, "SORT_CHUNK", 700)
+    monkeypatch.setattr(dbvar_index, "WRITE_BATCH", 300)
+    dbvar_index._write_order(str(tmp_path / "keys.bin"), str(tmp_path / "runs.bin"), len(keys))
+
+    for name in ("numpy.bin", "runs.bin"):
+        order = array("Q")
+        with open(tmp_path / name, "rb") as f:
+            order.frombytes(f.read())
+        assert list(order) == expected, name
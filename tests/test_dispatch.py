@@ -0,0 +1,110 @@
+import json
+import sys
+import threading
+import time
+
+import pytest
+from mistralai.models.chat_completion import FunctionCall, ToolCall
+
+from dispatch import run_tool_calls
+from registry import LOCAL, ToolRegistry
+
+release = threading.Event()
+started = []
+
+
+def tool_sleep(label, seconds):
+    started.append(label)
+    time.sleep(seconds)
+    return {"label": label}
+
+
+def tool_hang():
+    # Until the test is over, a thread can't be stopped
+    release.wait(10)
+    return {"hung": True}
+
+
+def tool_fail(reason):
+    raise RuntimeError(reason)
+
+
+def tool_echo(text):
+    return {"text": text}
+
+
+def _schema(name, **properties):
+    return {"type": "function", "function": {
+        "name": name, "description": name,
+        "parameters": {"type": "object", "properties": properties, "required": list(properties)},
+    }}
+
+
+@pytest.fixture
+def registry():
+    module = sys.modules[__name__]
+    registry = ToolRegistry()
+    registry.register(module, _schema("tool_sleep", label={"type": "string"}, seconds={"type": "number"}), cacheable=False)
+    registry.register(module, _schema("tool_hang"), timeout=0.2, cacheable=False)
+    registry.register(module, _schema("tool_fail", reason={"type": "string"}), cacheable=False)
+    registry.register(module, _schema("tool_echo", text={"type": "string"}), cacheable=False, cost=LOCAL)
+    started.clear()
+    release.clear()
+    yield registry
+    release.set()
+
+
+def _call(name, **args):
+    return ToolCall(function=FunctionCall(name=name, arguments=json.dumps(args)))
+
+
+def _outputs(results):
+    return [(name, json.loads(output)) for name, output in results]
+
+
+def test_calls_run_in_parallel_and_keep_the_model_order(registry):
+    calls = [_call("tool_sleep", label=str(i), seconds=0.3 - 0.1 * i) for i in range(3)] + [_call("tool_echo", text="local")]
+    begin = time.monotonic()
+    results = _outputs(run_tool_calls(calls, registry))
+
+    assert time.monotonic() - begin < 0.5
+    assert results == [("tool_sleep", {"label": "0"}), ("tool_sleep", {"label": "1"}), ("tool_sleep", {"label": "2"}),
+                       ("tool_echo", {"text": "local"})]
+    assert sorted(started) == ["0", "1", "2"]
+
+
+def test_a_slow_call_times_out_alone(registry):
+    begin = time.monotonic()
+    results = _outputs(run_tool_calls([_call("tool_hang"), _call("tool_sleep", label="quick", seconds=0)], registry))
+
+    assert time.monotonic() - begin < 1
+    assert results == [("tool_hang", {"error": "tool_hang timed out after 0.2 seconds"}), ("tool_sleep", {"label": "quick"})]
+
+
+def test_timeout_overrides_the_tools_own(registry):
+    results = _outputs(run_tool_calls([_call("tool_sleep", label="slow", seconds=0.5)], registry, timeout=0.1))
+    assert results == [("tool_sleep", {"error": "tool_sleep timed out after 0.1 seconds"})]
+
+
+def test_failures_become_error_outputs(registry):
+    results = _outputs(run_tool_calls([_call("tool_fail", reason="upstream down"), _call("tool_echo", text="ok")], registry))
+    assert results == [("tool_fail", {"error": "tool_fail failed: upstream down"}), ("tool_echo", {"text": "ok"})]
+
+
+def test_invalid_calls_are_answered_without_running(registry):
+    calls = [
+        _call("tool_missing"),
+        _call("tool_sleep", label="no seconds"),
+        _call("tool_sleep", label="typo", seconds="1"),
+        ToolCall(function=FunctionCall(name="tool_echo", arguments="{not json")),
+        _call("tool_echo", text="valid"),
+    ]
+    results = _outputs(run_tool_calls(calls, registry))
+
+    assert [name for name, _ in results] == ["tool_missing", "tool_sleep", "tool_sleep", "tool_echo", "tool_echo"]
+    assert results[0][1]["error"].startswith("Unknown tool 'tool_missing'")
+    assert results[1][1] == {"error": "Invalid arguments for tool_sleep: arguments.seconds is required"}
+    assert results[2][1] == {"error": "Invalid arguments for tool_sleep: arguments.seconds must be of type number, got str"}
+    assert results[3][1]["error"].startswith("Arguments for tool_echo are not valid JSON")
+    assert results[4][1] == {"text": "valid"}
+    assert started == []
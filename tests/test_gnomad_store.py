@@ -0,0 +1,115 @@
+import json
+import os
+import sys
+from array import array
+
+import pytest
+
+import gnomad_store
+
+FIXTURE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmark_fixtures", "gnomad_variant.json")
+VCF_HEADER = "##fileformat=VCFv4.2\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n"
+
+
+def _r21_record(variant, sequencing_type, faf95):
+    """A gnomAD r2.1 sites VCF line with the counts of an API response"""
+    data = variant[sequencing_type]
+    info = {"AC": data["ac"], "AN": data["an"], "AF": data["ac"] / data["an"], "nhomalt": data["ac_hom"]}
+    for population in data["populations"]:
+        if population["id"] in gnomad_store.GNOMAD_POPULATIONS:
+            info[f"AC_{population['id']}"] = population["ac"]
+            info[f"AN_{population['id']}"] = population["an"]
+            info[f"nhomalt_{population['id']}"] = population["ac_hom"]
+    info.update({f"faf95_{population}": value for population, value in faf95.items()})
+    return "\t".join([variant["chrom"], str(variant["pos"]), variant["rsid"], variant["ref"], variant["alt"], ".", "PASS",
+                      ";".join(f"{key}={value}" for key, value in info.items())]) + "\n"
+
+
+def test_local_variant_matches_api_response(tmp_path):
+    with open(FIXTURE) as f:
+        expected = json.load(f)["data"]["variant"]
+    # asj and fin have higher filtering allele frequencies, the API's popmax leaves them out
+    faf95 = {"afr": 0.0121, "amr": 0.0187, "asj": 0.04, "eas": 0.0054, "fin": 0.05, "nfe": 0.0213, "oth": 0.03, "sas": 0.0102}
+    for sequencing_type in gnomad_store.SEQUENCING_TYPES:
+        vcf = tmp_path / f"{sequencing_type}s.vcf"
+        vcf.write_text(VCF_HEADER + _r21_record(expected, sequencing_type, faf95))
+        gnomad_store.import_vcfs([str(vcf)], str(tmp_path / "store"), sequencing_type)
+
+    variant = gnomad_store.GnomadStore(str(tmp_path / "store")).variant(expected["chrom"], expected["pos"], expected["ref"], expected["alt"])
+    for key in ("variantId", "reference_genome", "chrom", "pos", "ref", "alt", "rsid", "flags"):
+        assert variant[key] == expected[key], key
+    for sequencing_type in gnomad_store.SEQUENCING_TYPES:
+        for key in ("ac", "an", "ac_hemi", "ac_hom", "faf95", "filters"):
+            assert variant[sequencing_type][key] == expected[sequencing_type][key], (sequencing_type, key)
+        # The store keeps the main populations, not the per sex ones
+        populations = [p for p in expected[sequencing_type]["populations"] if p["id"] in gnomad_store.GNOMAD_POPULATIONS]
+        assert variant[sequencing_type]["populations"] == populations, sequencing_type
+
+
+def test_rsid_index_sorted_in_runs_without_numpy(tmp_path, monkeypatch):
+    rsids = array("I", [(row * 7919) % 1000 if row % 3 else 0 for row in range(5000)])
+    with open(tmp_path / "rsid.bin", "wb") as f:
+        rsids.tofile(f)
+    expected = sorted(rsid << 32 | row for row, rsid in enumerate(rsids) if rsid)
+
+    gnomad_store._write_rsid_index(str(tmp_path / "rsid.bin"), str(tmp_path / "numpy.bin"), len(rsids))
+    monkeypatch.setitem(sys.modules, "numpy", None)
+    monkeypatch.setattr(gnomad_store, "RSID_SORT_CHUNK", 700)
+    monkeypatch.setattr(gnomad_store, "WRITE_BATCH", 300)
+    gnomad_store._write_rsid_index(str(tmp_path / "rsid.bin"), str(tmp_path / "runs.bin"), len(rsids))
+
+    for name in ("numpy.bin", "runs.bin"):
+        index = array("Q")
+        with open(tmp_path / name, "rb") as f:
+            index.frombytes(f.read())
+        assert list(index) == expected, name
+
+
+@pytest.fixture
+def fixture_variant():
+    with open(FIXTURE) as f:
+        return json.load(f)["data"]["variant"]
+
+
+def _import(tmp_path, variant, sequencing_type, chromosomes=None, faf95=None):
+    vcf = tmp_path / f"{sequencing_type}s.vcf"
+    vcf.write_text(VCF_HEADER + _r21_record(variant, sequencing_type, faf95 or {"nfe": 0.0213}))
+    gnomad_store.import_vcfs([str(vcf)], str(tmp_path / "store"), sequencing_type, chromosomes)
+
+
+@pytest.fixture
+def local_store(tmp_path, monkeypatch):
+    get_store = gnomad_store.get_store
+    monkeypatch.setattr(gnomad_store, "get_store", lambda path=None: get_store(str(tmp_path / "store")))
+
+
+def test_full_store_answers(tmp_path, fixture_variant, local_store):
+    for sequencing_type in gnomad_store.SEQUENCING_TYPES:
+        _import(tmp_path, fixture_variant, sequencing_type)
+    answer = gnomad_store.query_frequencies(fixture_variant["rsid"], ["frequencies"])
+    assert answer["data"]["variant"]["exome"]["ac"] == fixture_variant["exome"]["ac"]
+    assert answer["data"]["variant"]["genome"] is not None
+
+
+def test_exome_only_store_leaves_queries_to_the_api(tmp_path, fixture_variant, local_store):
+    _import(tmp_path, fixture_variant, "exome")
+    assert gnomad_store.query_frequencies(fixture_variant["rsid"], ["frequencies"]) is None
+
+
+def test_store_of_other_chromosomes_leaves_queries_to_the_api(tmp_path, fixture_variant, local_store):
+    _import(tmp_path, fixture_variant, "exome")
+    # The variant is on chromosome 1, the genome import only has 2 and X
+    _import(tmp_path, fixture_variant, "genome", chromosomes=["2", "X"])
+    assert gnomad_store.query_frequencies(fixture_variant["rsid"], ["frequencies"]) is None
+
+
+def test_store_is_opened_again_after_an_import(tmp_path, fixture_variant):
+    path = str(tmp_path / "store")
+    assert gnomad_store.get_store(path) is None
+    for sequencing_type in gnomad_store.SEQUENCING_TYPES:
+        _import(tmp_path, fixture_variant, sequencing_type)
+    key = (fixture_variant["chrom"], fixture_variant["pos"], fixture_variant["ref"], fixture_variant["alt"])
+    assert gnomad_store.get_store(path).variant(*key)["exome"]["faf95"]["popmax"] == 0.0213
+
+    _import(tmp_path, fixture_variant, "exome", faf95={"afr": 0.03})
+    assert gnomad_store.get_store(path).variant(*key)["exome"]["faf95"] == {"popmax": 0.03, "popmax_population": "afr"}
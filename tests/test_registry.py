@@ -0,0 +1,59 @@
+import pytest
+
+from registry import ToolValidationError, build_registry, compile_schema
+
+SCHEMA = {
+    "type": "object",
+    "properties": {
+        "rsid": {"type": "string"},
+        "count": {"type": "integer"},
+        "strict": {"type": "boolean"},
+        "dataset": {"type": "string", "enum": ["gnomad_r2_1", "gnomad_r4"]},
+        "variants": {"type": "array", "items": {
+            "type": "object",
+            "properties": {"chromosome": {"type": "string"}, "position": {"type": "integer"}},
+            "required": ["chromosome", "position"],
+        }},
+    },
+    "required": ["rsid"],
+}
+
+
+@pytest.mark.parametrize("value, errors", [
+    ({"rsid": "rs699"}, []),
+    ({"rsid": "rs699", "count": 3, "strict": False, "dataset": "gnomad_r4", "variants": [{"chromosome": "1", "position": 5}]}, []),
+    ({}, ["arguments.rsid is required"]),
+    ({"rsid": "rs699", "extra": 1}, ["arguments.extra is not an argument of this tool"]),
+    ({"rsid": 699}, ["arguments.rsid must be of type string, got int"]),
+    # bool is an int in python but not in JSON
+    ({"rsid": "rs699", "count": True}, ["arguments.count must be of type integer, got bool"]),
+    ({"rsid": "rs699", "count": 2.5}, ["arguments.count must be of type integer, got float"]),
+    ({"rsid": "rs699", "dataset": "exac"}, ["arguments.dataset must be one of ['gnomad_r2_1', 'gnomad_r4'], got 'exac'"]),
+    ({"rsid": "rs699", "variants": [{"chromosome": "1"}]}, ["arguments.variants[].position is required"]),
+    ({"rsid": "rs699", "variants": [{"chromosome": 1, "position": 5}]}, ["arguments.variants[].chromosome must be of type string, got int"]),
+    ([], ["arguments must be of type object, got list"]),
+])
+def test_schema_validation(value, errors):
+    assert compile_schema(SCHEMA)(value) == errors
+
+
+def test_every_tool_takes_its_schema_arguments():
+    registry = build_registry()
+    for name in registry.tools:
+        assert callable(registry.function(name))
+    async_registry = build_registry("async_tools")
+    for name in async_registry.tools:
+        assert callable(async_registry.function(name))
+
+
+def test_calls_are_validated_before_running():
+    registry = build_registry()
+    tool, args = registry.validate("tool_query_gnomad_by_rsid", '{"rsid": "rs699"}')
+    assert tool.name == "tool_query_gnomad_by_rsid" and args == {"rsid": "rs699"}
+    assert registry.validate("tool_resolve_variant_identifiers", {"identifier": "rs699"})[1] == {"identifier": "rs699"}
+    with pytest.raises(ToolValidationError, match="Unknown tool"):
+        registry.validate("tool_rm_rf", "{}")
+    with pytest.raises(ToolValidationError, match="not valid JSON"):
+        registry.validate("tool_query_gnomad_by_rsid", "{'rsid': 'rs699'}")
+    with pytest.raises(ToolValidationError, match="arguments.rsid is required"):
+        registry.validate("tool_query_gnomad_by_rsid", "")
@@ -0,0 +1,88 @@
+import threading
+import time
+
+import pytest
+
+from scheduler import BULK, INTERACTIVE, Scheduler, current, priority
+
+HOST = "upstream.test"
+
+
+def _drained(rate):
+    """A scheduler whose bucket for HOST is empty, so every request has to queue"""
+    scheduler = Scheduler(rates={HOST: rate}, enabled=True)
+    upstream = scheduler.upstream(HOST)
+    upstream.tokens, upstream.updated = 0, time.monotonic()
+    return scheduler
+
+
+def _waiting(upstream):
+    with upstream.lock:
+        return sum(len(tickets) for sessions in upstream.waiting.values() for tickets in sessions.values())
+
+
+def _queue(scheduler, served, request_class, session, label):
+    """Starts a request in a thread, returns once it waits for its token"""
+    def request():
+        with priority(request_class, session):
+            scheduler.acquire(HOST)
+        served.append(label)
+
+    upstream = scheduler.upstream(HOST)
+    waiting = _waiting(upstream)
+    thread = threading.Thread(target=request, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 2
+    while _waiting(upstream) == waiting and time.monotonic() < deadline:
+        time.sleep(0.001)
+    return thread
+
+
+def test_priority_is_taken_from_the_context():
+    assert current() == (INTERACTIVE, None)
+    with priority(BULK, "annotate"):
+        assert current() == (BULK, "annotate")
+    assert current() == (INTERACTIVE, None)
+    with pytest.raises(ValueError):
+        with priority("urgent"):
+            pass
+
+
+def test_interactive_requests_go_before_queued_bulk_ones():
+    scheduler = _drained(rate=20)
+    served = []
+    threads = [_queue(scheduler, served, BULK, "annotate", f"bulk{i}") for i in range(3)]
+    threads.append(_queue(scheduler, served, INTERACTIVE, "chat", "chat"))
+    for thread in threads:
+        thread.join(5)
+
+    assert served[0] == "chat"
+    assert sorted(served[1:]) == ["bulk0", "bulk1", "bulk2"]
+    stats = scheduler.stats()["classes"]
+    assert stats[INTERACTIVE]["requests"] == 1 and stats[BULK]["requests"] == 3
+
+
+def test_sessions_of_a_class_take_turns():
+    scheduler = _drained(rate=20)
+    served = []
+    threads = [_queue(scheduler, served, INTERACTIVE, "busy", f"busy{i}") for i in range(4)]
+    threads.append(_queue(scheduler, served, INTERACTIVE, "other", "other"))
+    for thread in threads:
+        thread.join(5)
+
+    # The other session's single request is served right after the busy one's first
+    assert served.index("other") == 1
+    assert len(served) == 5
+
+
+def test_bulk_requests_leave_a_token_to_interactive_ones():
+    scheduler = _drained(rate=10)
+    upstream = scheduler.upstream(HOST)
+    upstream.tokens = 1
+    served = []
+    _queue(scheduler, served, BULK, "annotate", "bulk")
+    time.sleep(0.02)
+    # The last token is kept back from the bulk request
+    assert served == []
+    with priority(INTERACTIVE, "chat"):
+        assert scheduler.acquire(HOST) < 50
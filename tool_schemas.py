@@ -0,0 +1,382 @@
+# Function calling schemas of the tools, kept apart from their implementation so the app can
+# send them to the model without importing the tools and their HTTP stack
+tools_json = [
+    {
+        "type": "function",
+        "function": {
+            "name": "tool_query_gnomad_by_rsid",
+            "description": "Queries the gnomad API for detailed information about a variant based on its rsid.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "rsid": {
+                        "type": "string",
+                        "description": "The rsid of the variant"
+                    },
+                    "fields": {
+                        "type": "array",
+                        "items": {
+                            "type": "string",
+                            "enum": ["frequencies", "consequences", "colocated_variants", "age_distribution", "quality_metrics", "acmg", "everything"]
+                        },
+                        "description": "Field groups to return. Use [\"frequencies\"] for population frequency only, [\"acmg\"] for frequencies and consequences. Defaults to everything."
+                    }
+                },
+                "required": ["rsid"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "tool_query_gnomad_by_rsids",
+            "description": "Queries the gnomad API for many variants at once based on their rsids. Returns the variant data keyed by rsid.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "rsids": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "List of variant rsids"
+                    },
+                    "fields": {
+                        "type": "array",
+                        "items": {
+                            "type": "string",
+                            "enum": ["frequencies", "consequences", "colocated_variants", "age_distribution", "quality_metrics", "acmg", "everything"]
+                        },
+                        "description": "Field groups to return. Use [\"frequencies\"] for population frequency only, [\"acmg\"] for frequencies and consequences. Defaults to everything."
+                    }
+                },
+                "required": ["rsids"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "tool_query_single_nucleotide_polymorphisms_db_by_rsid",
+            "description": "Queries the Single Nucleotide Polymorphisms Database (dbSNP) using an rsid. (Note: The function is missing the URL of the API endpoint).",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "rsid": {
+                        "type": "string",
+                        "description": "The rsid of the variant"
+                    }
+                },
+                "required": ["rsid"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "tool_query_genomic_structural_variation_db_by_rsid",
+            "description": "Queries the Database of Genomic Structural Variation (dbVar) data set provided by NCBI. The subset served by this API is the germline data for assembly GRCh37.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "rsid": {
+                        "type": "string",
+                        "description": "The rsid of the variant"
+                    }
+                },
+                "required": ["rsid"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "tool_get_variant_consequences_by_id",
+            "description": "Fetches variant consequences from Ensembl VEP based on a dbSNP, COSMIC, or HGMD identifier.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "id": {
+                        "type": "string",
+                        "description": "dbSNP, COSMIC, or HGMD identifier"
+                    }
+                },
+                "required": ["id"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "tool_get_variant_consequences_by_hgvs",
+            "description": "Fetches variant consequences from Ensembl VEP based on an HGVS code.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "hgvs_code": {
+                        "type": "string",
+                        "description": "The HGVS code"
+                    }
+                },
+                "required": ["hgvs_code"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "tool_get_variant_consequences_by_region_and_allele",
+            "description": "Fetches variant consequences from Ensembl VEP based on a genomic region and allele.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "region": {
+                        "type": "string",
+                        "description": "The genomic region"
+                    },
+                    "allele": {
+                        "type": "string",
+                        "description": "The allele"
+                    }
+                },
+                "required": ["region", "allele"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "tool_get_variant_consequences_by_ids",
+            "description": "Fetches variant consequences from Ensembl VEP for many dbSNP, COSMIC or HGMD identifiers at once, for example a whole gene panel. Returns the consequences keyed by identifier.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "ids": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "List of dbSNP, COSMIC or HGMD identifiers"
+                    }
+                },
+                "required": ["ids"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "tool_get_variant_consequences_by_hgvs_codes",
+            "description": "Fetches variant consequences from Ensembl VEP for many HGVS codes at once. Returns the consequences keyed by HGVS code.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "hgvs_codes": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "List of HGVS codes"
+                    }
+                },
+                "required": ["hgvs_codes"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "tool_get_variant_consequences_by_regions_and_alleles",
+            "description": "Fetches variant consequences from Ensembl VEP for many genomic region and allele pairs at once. Returns the consequences keyed by \"region allele\".",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "variants": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "region": {
+                                    "type": "string",
+                                    "description": "The genomic region, for example 9:22125503-22125503:1"
+                                },
+                                "allele": {
+                                    "type": "string",
+                                    "description": "The allele"
+                                }
+                            },
+                            "required": ["region", "allele"]
+                        },
+                        "description": "List of region and allele pairs"
+                    }
+                },
+                "required": ["variants"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "tool_get_mutation_tester_result",
+            "description": "Fetches results from the MutationTaster API, providing predictions on a variant's potential impact.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "chromosome_coordinate": {
+                        "type": "string",
+                        "description": "Likely a variant identifier"
+                    },
+                    "original_reference_allele": {
+                        "type": "string",
+                        "description": "original reference allele of the nucleotide substitution in capital, for example, C"
+                    },
+                    "new_allele": {
+                        "type": "string",
+                        "description": "new allele after the nucleotide substitution, for example C"
+                    }
+                },
+                "required": ["chromosome_coordinate", "original_reference_allele", "new_allele"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "tool_get_mutation_tester_results",
+            "description": "Fetches MutationTaster predictions for many variants at once. Returns the predictions keyed by variant, for example 21:33039603A>C.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "variants": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "chromosome_coordinate": {
+                                    "type": "string",
+                                    "description": "chromosome and position, for example 21:33039603"
+                                },
+                                "original_reference_allele": {
+                                    "type": "string",
+                                    "description": "original reference allele of the nucleotide substitution in capital, for example, C"
+                                },
+                                "new_allele": {
+                                    "type": "string",
+                                    "description": "new allele after the nucleotide substitution, for example C"
+                                }
+                            },
+                            "required": ["chromosome_coordinate", "original_reference_allele", "new_allele"]
+                        },
+                        "description": "List of variants"
+                    }
+                },
+                "required": ["variants"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "tool_get_raw_tool_output",
+            "description": "Fetches the full, uncompacted output of an earlier tool call. Tool outputs are summarized to their ACMG relevant fields and carry a raw_ref; only use this when a field missing from the summary is needed.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "raw_ref": {
+                        "type": "string",
+                        "description": "The raw_ref of the earlier tool output, for example raw-0123456789abcdef"
+                    }
+                },
+                "required": ["raw_ref"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "tool_resolve_variant_identifiers",
+            "description": "Translates a variant identifier (rsID, HGVS, gnomAD variant id like 1-230845794-A-G, chromosome coordinate like 21:33039603A>C, or VEP region like 1:230845794-230845794/G) into its other known identifiers and ready to use arguments for the other tools. Answers instantly from earlier tool results without calling any API; use it instead of calling a tool only to convert identifier formats.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "identifier": {
+                        "type": "string",
+                        "description": "The variant identifier to translate"
+                    }
+                },
+                "required": ["identifier"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "tool_query_structural_variants_by_region",
+            "description": "Lists the structural variants of the dbVar germline data set (GRCh37) overlapping a genomic region, e.g. the span of a small variant or of a gene, with their type, size, clinical significance and how much they overlap the region. Answers instantly from a local index.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "chromosome": {
+                        "type": "string",
+                        "description": "Chromosome, e.g. 1 or X"
+                    },
+                    "start": {
+                        "type": "integer",
+                        "description": "First position of the region on GRCh37"
+                    },
+                    "end": {
+                        "type": "integer",
+                        "description": "Last position of the region on GRCh37, equal to start for a single position"
+                    },
+                    "variant_type": {
+                        "type": "string",
+                        "description": "Only list structural variants of this type, e.g. deletion, duplication, copy number variation"
+                    }
+                },
+                "required": ["chromosome", "start", "end"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "tool_find_nearest_structural_variants",
+            "description": "Finds the structural variants of the dbVar germline data set (GRCh37) closest to a genomic position, with their distance in base pairs (0 when they overlap it). Answers instantly from a local index.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "chromosome": {
+                        "type": "string",
+                        "description": "Chromosome, e.g. 1 or X"
+                    },
+                    "position": {
+                        "type": "integer",
+                        "description": "Position on GRCh37"
+                    },
+                    "count": {
+                        "type": "integer",
+                        "description": "Number of structural variants to return, 5 by default"
+                    },
+                    "variant_type": {
+                        "type": "string",
+                        "description": "Only consider structural variants of this type, e.g. deletion"
+                    }
+                },
+                "required": ["chromosome", "position"]
+            }
+        }
+    }
+]
+
+'''
+    {
+        "type": "function",
+        "function": {
+            "name": "tool_get_clinvar_data_by_rcv_code",
+            "description": "Uses the clinvar library to retrieve and analyze data from ClinVar based on an RCV accession code.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "rcv": {
+                        "type": "string",
+                        "description": "A ClinVar RCV accession code, for example: RCV000009910",
+                    }
+                },
+                "required": ["rcv"]
+            }
+        }
+    }'''
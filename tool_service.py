@@ -0,0 +1,489 @@
+"""
+Tool execution service shared by every chat session
+
+Without it each Streamlit session runs its tool calls on threads of its own, so the number of
+upstream requests in flight grows with the number of open sessions. The service has a fixed tier
+of workers (threads, or processes with --processes) fed by a bounded job queue: when the queue is
+full submitters wait up to LLMHACK_TOOL_SERVICE_QUEUE_TIMEOUT seconds and then get an error
+output, rather than piling more load on the upstream APIs.
+
+Sessions of one Streamlit server share an in-process service with LLMHACK_TOOL_SERVICE=local,
+several Streamlit servers share one started with
+
+    python tool_service.py serve --port 8790 --workers 8
+    LLMHACK_TOOL_SERVICE=127.0.0.1:8790 streamlit run streamlit_app.py
+    python tool_service.py stats --address 127.0.0.1:8790
+
+stats gives the queue depth, the worker utilization and the latency of each tool.
+
+Clients and service authenticate with a shared key, and a connection that passes can run code
+in the service (requests are pickled), so the key is never a fixed default: it is taken from
+LLMHACK_TOOL_SERVICE_KEY or, failing that, generated by the service into a file only its owner
+can read, where clients of the same user find it. The service refuses to listen on anything but
+a loopback address unless LLMHACK_TOOL_SERVICE_KEY is set.
+"""
+import argparse
+import contextvars
+import functools
+import ipaddress
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import secrets
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+from multiprocessing.connection import Client, Listener
+
+import tracing
+import scheduler
+from dispatch import _run_batch, _warm_batches, run_tool_call, run_tool_calls as run_tool_calls_inline
+from registry import LOCAL, ToolValidationError, build_registry
+
+logger = logging.getLogger(__name__)
+
+# Unset: every session runs its own tool calls, "local": one service per process, host:port: a remote service
+TOOL_SERVICE = os.getenv("LLMHACK_TOOL_SERVICE", "")
+TOOL_SERVICE_KEY = os.getenv("LLMHACK_TOOL_SERVICE_KEY")
+# Where the service writes the key it generates when LLMHACK_TOOL_SERVICE_KEY is unset
+TOOL_SERVICE_KEY_PATH = os.getenv("LLMHACK_TOOL_SERVICE_KEY_PATH",
+                                  os.path.join(os.path.dirname(os.path.abspath(__file__)), ".tool_service_key"))
+TOOL_SERVICE_WORKERS = int(os.getenv("LLMHACK_TOOL_SERVICE_WORKERS", "8"))
+TOOL_SERVICE_QUEUE = int(os.getenv("LLMHACK_TOOL_SERVICE_QUEUE", "64"))
+# Seconds a submitter waits for room in a full queue before its call is answered with an error
+QUEUE_TIMEOUT = float(os.getenv("LLMHACK_TOOL_SERVICE_QUEUE_TIMEOUT", "10"))
+DEFAULT_PORT = 8790
+# Latest durations kept per tool for the percentiles
+LATENCY_SAMPLES = 500
+
+
+class ServiceKeyMissing(RuntimeError):
+    """Raised when a client finds neither LLMHACK_TOOL_SERVICE_KEY nor a key file written by the service"""
+
+
+def service_key(create=False, path=TOOL_SERVICE_KEY_PATH):
+    """
+    Authentication key of the service, LLMHACK_TOOL_SERVICE_KEY or the key in the owner-only file at path
+    :param create: generate the file when there is none, done by the service
+    """
+    if TOOL_SERVICE_KEY:
+        return TOOL_SERVICE_KEY.encode()
+    if create and not os.path.exists(path):
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            # Another service generated it meanwhile
+            pass
+        else:
+            with os.fdopen(fd, "w") as f:
+                f.write(secrets.token_hex(32))
+    try:
+        with open(path) as f:
+            return f.read().strip().encode()
+    except FileNotFoundError:
+        raise ServiceKeyMissing(f"No tool service key: set LLMHACK_TOOL_SERVICE_KEY or start the service first, "
+                                f"it writes one to {path}") from None
+
+
+def _is_loopback(host):
+    try:
+        return ipaddress.ip_address(socket.gethostbyname(host)).is_loopback
+    except (OSError, ValueError):
+        return False
+
+
+class ServiceBusy(RuntimeError):
+    """Raised when the job queue stays full for longer than the queue timeout"""
+
+
+class ToolServiceError(RuntimeError):
+    """Raised when the service answers a request with an error"""
+
+
+def _percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+class _ToolStats:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.latencies_ms = deque(maxlen=LATENCY_SAMPLES)
+        self.queue_ms = deque(maxlen=LATENCY_SAMPLES)
+
+    def summary(self):
+        latencies = list(self.latencies_ms)
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "p50_ms": _percentile(latencies, 50),
+            "p95_ms": _percentile(latencies, 95),
+            "max_ms": max(latencies) if latencies else None,
+            "queue_p95_ms": _percentile(list(self.queue_ms), 95),
+        }
+
+
+_process_registries = {}
+
+
+def _execute(module, function_name, args, warmup, request_priority):
+    """Runs a job in a worker process, which builds its own registry on the first job"""
+    registry = _process_registries.get(module)
+    if registry is None:
+        registry = _process_registries[module] = build_registry(module)
+    with scheduler.priority(*request_priority):
+        if warmup:
+            return _run_batch(registry, function_name, args)
+        return run_tool_call(registry, function_name, args)
+
+
+class ToolService:
+    """
+    Worker tier and job queue
+    :param module: name of the module implementing the tools
+    :param workers: number of jobs run at once, the bound on concurrent tool calls across sessions
+    :param max_queue: number of jobs waiting for a worker before submitters are held back
+    :param processes: run the jobs in worker processes instead of threads
+    """
+
+    def __init__(self, module="tools", workers=TOOL_SERVICE_WORKERS, max_queue=TOOL_SERVICE_QUEUE, processes=False):
+        self.module = module
+        self.registry = build_registry(module)
+        self.workers = workers
+        self.max_queue = max_queue
+        self.jobs = queue.Queue(maxsize=max_queue)
+        # spawn, forking a process whose threads hold locks can deadlock the child. The workers take their
+        # upstream tokens from the scheduler of this process, so rates hold across all of them.
+        self.pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                        initializer=scheduler.use_shared, initargs=scheduler.share()) if processes else None
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.busy = 0
+        self.busy_seconds = 0.0
+        self.counters = {"submitted": 0, "completed": 0, "failed": 0, "rejected": 0, "cancelled": 0}
+        self.tool_stats = {}
+        self.threads = [threading.Thread(target=self._work, name=f"tool-worker-{i}", daemon=True) for i in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, function_name, args, warmup=False, timeout=QUEUE_TIMEOUT):
+        """
+        Queues a validated tool call
+        :param warmup: run the batch call only to fill the cache, its result is None
+        :param timeout: seconds to wait for room in the queue, raises ServiceBusy after that
+        :return: Future of the JSON encoded tool output
+        """
+        future = Future()
+        job = (future, function_name, args, warmup, contextvars.copy_context(), time.monotonic())
+        try:
+            self.jobs.put(job, timeout=timeout)
+        except queue.Full:
+            with self.lock:
+                self.counters["rejected"] += 1
+            raise ServiceBusy(f"tool service queue is full ({self.max_queue} calls waiting)")
+        with self.lock:
+            self.counters["submitted"] += 1
+        return future
+
+    def _work(self):
+        while True:
+            future, function_name, args, warmup, context, queued = self.jobs.get()
+            # A call that timed out while queued is never run
+            if not future.set_running_or_notify_cancel():
+                with self.lock:
+                    self.counters["cancelled"] += 1
+                continue
+            start = time.monotonic()
+            with self.lock:
+                self.busy += 1
+            error = None
+            try:
+                if self.pool is not None:
+                    request_priority = context.run(scheduler.current)
+                    result = self.pool.submit(_execute, self.module, function_name, args, warmup, request_priority).result()
+                elif warmup:
+                    result = context.run(_run_batch, self.registry, function_name, args)
+                else:
+                    result = context.run(run_tool_call, self.registry, function_name, args)
+            except BaseException as e:
+                error = e
+            end = time.monotonic()
+            with self.lock:
+                self.busy -= 1
+                self.busy_seconds += end - start
+                self.counters["failed" if error is not None else "completed"] += 1
+                stats = self.tool_stats.setdefault(function_name, _ToolStats())
+                stats.calls += 1
+                stats.errors += error is not None
+                stats.latencies_ms.append(round((end - start) * 1000, 1))
+                stats.queue_ms.append(round((start - queued) * 1000, 1))
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def run_tool_calls(self, tool_calls, timeout=None):
+        """
+        Same contract as dispatch.run_tool_calls, with the network calls run by the service's workers
+        :param tool_calls: tool calls of a completion, or (function_name, arguments) pairs
+        :return: list of (function_name, output) in the same order as tool_calls
+        """
+        calls = []
+        for function_name, arguments in _call_pairs(tool_calls):
+            try:
+                tool, args = self.registry.validate(function_name, arguments)
+                calls.append((function_name, tool, args, None))
+            except ToolValidationError as e:
+                logger.warning("Rejected %s: %s", function_name, e)
+                calls.append((function_name, None, None, json.dumps({"error": str(e)})))
+
+        started = time.monotonic()
+
+        def call_timeout(tool):
+            return timeout if timeout is not None else tool.timeout
+
+        def submit_warmup(func, registry, batch_name, batch_args):
+            return self.submit(batch_name, batch_args, warmup=True)
+
+        futures = {}
+        try:
+            warmups = _warm_batches(calls, self.registry, submit_warmup)
+        except ServiceBusy as e:
+            warmups = {}
+            logger.warning("Skipped batching: %s", e)
+        # Calls filled by a batch are only queued once it is done, a worker never waits on another job
+        for index, (function_name, tool, args, error) in enumerate(calls):
+            if tool is not None and tool.cost != LOCAL and index not in warmups:
+                futures[index] = self._submit_or_error(function_name, args)
+        for index, (function_name, tool, args, error) in enumerate(calls):
+            if index in warmups:
+                wait(warmups[index], timeout=max(0, started + call_timeout(tool) - time.monotonic()))
+                futures[index] = self._submit_or_error(function_name, args)
+
+        results = []
+        for index, (function_name, tool, args, error) in enumerate(calls):
+            if error is not None:
+                results.append((function_name, error))
+            elif index not in futures:
+                try:
+                    output = run_tool_call(self.registry, function_name, args)
+                except Exception as e:
+                    logger.warning("%s failed: %r", function_name, e)
+                    output = json.dumps({"error": f"{function_name} failed: {e}"})
+                results.append((function_name, output))
+            else:
+                results.append((function_name, self._output(function_name, futures[index], started, call_timeout(tool))))
+        return results
+
+    def function(self, name):
+        """Callable running the tool on the service, as registry.function gives for running it here"""
+        return functools.partial(_run_one, self, name)
+
+    def _submit_or_error(self, function_name, args):
+        try:
+            return self.submit(function_name, args)
+        except ServiceBusy as e:
+            logger.warning("%s rejected: %s", function_name, e)
+            future = Future()
+            future.set_exception(e)
+            return future
+
+    def _output(self, function_name, future, started, call_timeout):
+        wait([future], timeout=max(0, started + call_timeout - time.monotonic()))
+        if not future.done():
+            # Dropped if it is still queued, a running call is left to finish and fill the cache
+            future.cancel()
+            logger.warning("%s timed out after %ss", function_name, call_timeout)
+            return json.dumps({"error": f"{function_name} timed out after {call_timeout} seconds"})
+        if future.exception() is not None:
+            logger.warning("%s failed: %r", function_name, future.exception())
+            return json.dumps({"error": f"{function_name} failed: {future.exception()}"})
+        return future.result()
+
+    def stats(self):
+        with self.lock:
+            uptime = time.monotonic() - self.started
+            return {
+                "workers": self.workers,
+                "processes": self.pool is not None,
+                "queue_depth": self.jobs.qsize(),
+                "max_queue": self.max_queue,
+                "busy_workers": self.busy,
+                "utilization": round(self.busy_seconds / (self.workers * uptime), 3) if uptime > 0 else 0.0,
+                **self.counters,
+                "tools": {name: stats.summary() for name, stats in sorted(self.tool_stats.items())},
+                "upstreams": scheduler.scheduler_stats(),
+            }
+
+
+def _run_one(service, function_name, **args):
+    [(_, output)] = service.run_tool_calls([(function_name, json.dumps(args))])
+    result = json.loads(output)
+    if isinstance(result, dict) and "error" in result:
+        raise ToolServiceError(result["error"])
+    return result
+
+
+def _call_pairs(tool_calls):
+    pairs = []
+    for tool_call in tool_calls:
+        if isinstance(tool_call, (tuple, list)):
+            pairs.append((tool_call[0], tool_call[1]))
+        else:
+            pairs.append((tool_call.function.name, tool_call.function.arguments))
+    return pairs
+
+
+def parse_address(address):
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def _handle(connection, service):
+    with connection:
+        while True:
+            try:
+                request = connection.recv()
+            except (EOFError, OSError):
+                return
+            try:
+                if request.get("op") == "run":
+                    with scheduler.priority(*request.get("priority", (scheduler.INTERACTIVE, None))):
+                        response = {"results": service.run_tool_calls(request["calls"], request.get("timeout"))}
+                elif request.get("op") == "stats":
+                    response = {"stats": service.stats()}
+                else:
+                    response = {"error": f"unknown operation {request.get('op')!r}"}
+            except Exception as e:
+                response = {"error": repr(e)}
+            connection.send(response)
+
+
+def serve(service, address=("127.0.0.1", DEFAULT_PORT), authkey=None):
+    """
+    Answers clients on a socket until interrupted, one thread per connected client
+    :param authkey: key clients must have, by default the one of service_key()
+    """
+    if authkey is None:
+        if not TOOL_SERVICE_KEY and not _is_loopback(address[0]):
+            raise ValueError(f"Refusing to listen on {address[0]} with a generated key, "
+                             f"set LLMHACK_TOOL_SERVICE_KEY for a service reachable from other hosts")
+        authkey = service_key(create=True)
+    with Listener(address, authkey=authkey) as listener:
+        print(f"Tool service listening on {listener.address[0]}:{listener.address[1]}")
+        while True:
+            try:
+                connection = listener.accept()
+            except multiprocessing.AuthenticationError as e:
+                logger.warning("Refused a tool service client: %s", e)
+                continue
+            threading.Thread(target=_handle, args=(connection, service), daemon=True).start()
+
+
+class ToolServiceClient:
+    """
+    Client of a tool service on a local socket, with the ToolService interface
+    Each thread has its own connection, Streamlit runs every session in a thread of its own.
+    """
+
+    def __init__(self, address, authkey=None, registry=None):
+        self.address = parse_address(address) if isinstance(address, str) else tuple(address)
+        self.authkey = authkey if authkey is not None else service_key()
+        # Used when the service can't be reached, the calls then run in this process
+        self.registry = registry if registry is not None else build_registry()
+        self.local = threading.local()
+
+    def _request(self, request):
+        # A connection broken by a restart of the service is opened again once
+        for attempt in range(2):
+            connection = getattr(self.local, "connection", None)
+            try:
+                if connection is None:
+                    connection = self.local.connection = Client(self.address, authkey=self.authkey)
+                connection.send(request)
+                response = connection.recv()
+                break
+            except (EOFError, OSError):
+                self.local.connection = None
+                if attempt:
+                    raise
+        if "error" in response:
+            raise ToolServiceError(f"tool service error: {response['error']}")
+        return response
+
+    def run_tool_calls(self, tool_calls, timeout=None):
+        pairs = _call_pairs(tool_calls)
+        try:
+            with tracing.span("tool_service", calls=len(pairs)):
+                return [tuple(result) for result in self._request({"op": "run", "calls": pairs, "timeout": timeout, "priority": scheduler.current()})["results"]]
+        except (EOFError, OSError) as e:
+            logger.warning("Tool service at %s:%s unreachable (%r), running the calls here", *self.address, e)
+            return run_tool_calls_inline(tool_calls, self.registry, timeout)
+        except ToolServiceError as e:
+            # Same outputs as a call failing in dispatch, the model is told and the turn goes on
+            logger.warning("%s", e)
+            return [(function_name, json.dumps({"error": f"{function_name} failed: {e}"})) for function_name, _ in pairs]
+
+    def function(self, name):
+        """Callable running the tool on the service, as registry.function gives for running it here"""
+        return functools.partial(_run_one, self, name)
+
+    def stats(self):
+        return self._request({"op": "stats"})["stats"]
+
+
+_services = {}
+_services_lock = threading.Lock()
+
+
+def connect(address=TOOL_SERVICE):
+    """
+    Service the calls of this process go to, shared by all its sessions
+    :param address: "local" for an in-process service, host:port for one over a socket
+    :return: ToolService, ToolServiceClient or None when address is empty
+    """
+    if not address:
+        return None
+    with _services_lock:
+        if address not in _services:
+            _services[address] = ToolService() if address == "local" else ToolServiceClient(address)
+        return _services[address]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = subparsers.add_parser("serve", help="run the service")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    serve_parser.add_argument("--workers", type=int, default=TOOL_SERVICE_WORKERS, help="tool calls run at once")
+    serve_parser.add_argument("--queue", type=int, default=TOOL_SERVICE_QUEUE, help="tool calls waiting for a worker")
+    serve_parser.add_argument("--processes", action="store_true", help="run the calls in worker processes")
+    serve_parser.add_argument("--module", default="tools", help="module implementing the tools")
+
+    stats_parser = subparsers.add_parser("stats", help="print the metrics of a running service")
+    stats_parser.add_argument("--address", default=TOOL_SERVICE or f"127.0.0.1:{DEFAULT_PORT}")
+
+    args = parser.parse_args()
+    if args.command == "serve":
+        service = ToolService(args.module, args.workers, args.queue, args.processes)
+        try:
+            serve(service, (args.host, args.port))
+        except ValueError as e:
+            parser.error(str(e))
+        except KeyboardInterrupt:
+            pass
+    else:
+        print(json.dumps(ToolServiceClient(args.address).stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,453 +1,375 @@
-import requests
 import json
+from concurrent.futures import ThreadPoolExecutor
+import transport
+import tracing
+import gnomad
+import gnomad_store
+import dbvar_index
+from cache import cached, get_cached, get_cached_equivalent, set_cached
+from xref import equivalent_calls, resolve
+from tool_schemas import tools_json
 
-tools_json = [
-    {
-        "type": "function",
-        "function": {
-            "name": "tool_query_gnomad_by_rsid",
-            "description": "Queries the gnomad API for detailed information about a variant based on its rsid.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "rsid": {
-                        "type": "string",
-                        "description": "The rsid of the variant"
-                    }
-                },
-                "required": ["rsid"]
-            }
-        }
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "tool_query_single_nucleotide_polymorphisms_db_by_rsid",
-            "description": "Queries the Single Nucleotide Polymorphisms Database (dbSNP) using an rsid. (Note: The function is missing the URL of the API endpoint).",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "rsid": {
-                        "type": "string",
-                        "description": "The rsid of the variant"
-                    }
-                },
-                "required": ["rsid"]
-            }
-        }
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "tool_query_genomic_structural_variation_db_by_rsid",
-            "description": "Queries the Database of Genomic Structural Variation (dbVar) data set provided by NCBI. The subset served by this API is the germline data for assembly GRCh37.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "rsid": {
-                        "type": "string",
-                        "description": "The rsid of the variant"
-                    }
-                },
-                "required": ["rsid"]
-            }
-        }
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "tool_get_variant_consequences_by_id",
-            "description": "Fetches variant consequences from Ensembl VEP based on a dbSNP, COSMIC, or HGMD identifier.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "id": {
-                        "type": "string",
-                        "description": "dbSNP, COSMIC, or HGMD identifier"
-                    }
-                },
-                "required": ["id"]
-            }
-        }
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "tool_get_variant_consequences_by_hgvs",
-            "description": "Fetches variant consequences from Ensembl VEP based on an HGVS code.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "hgvs_code": {
-                        "type": "string",
-                        "description": "The HGVS code"
-                    }
-                },
-                "required": ["hgvs_code"]
-            }
-        }
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "tool_get_variant_consequences_by_region_and_allele",
-            "description": "Fetches variant consequences from Ensembl VEP based on a genomic region and allele.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "region": {
-                        "type": "string",
-                        "description": "The genomic region"
-                    },
-                    "allele": {
-                        "type": "string",
-                        "description": "The allele"
-                    }
-                },
-                "required": ["region", "allele"]
-            }
-        }
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "tool_get_mutation_tester_result",
-            "description": "Fetches results from the MutationTaster API, providing predictions on a variant's potential impact.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "chromosome_coordinate": {
-                        "type": "string",
-                        "description": "Likely a variant identifier"
-                    },
-                    "original_reference_allele": {
-                        "type": "string",
-                        "description": "original reference allele of the nucleotide substitution in capital, for example, C"
-                    },
-                    "new_allele": {
-                        "type": "string",
-                        "description": "new allele after the nucleotide substitution, for example C"
-                    }
-                },
-                "required": ["chromosome_coordinate", "original_reference_allele", "new_allele"]
-            }
-        }
-    }
-]
-
-'''
-    {
-        "type": "function",
-        "function": {
-            "name": "tool_get_clinvar_data_by_rcv_code",
-            "description": "Uses the clinvar library to retrieve and analyze data from ClinVar based on an RCV accession code.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "rcv": {
-                        "type": "string",
-                        "description": "A ClinVar RCV accession code, for example: RCV000009910",
-                    }
-                },
-                "required": ["rcv"]
-            }
-        }
-    }'''
-
-def tool_query_gnomad_by_rsid(rsid):
-    """calls the gnomad api and filters by rsid of the variant, returning all fields possible"""
-    query_for_variants = """
-        {
-            variant(rsid: "%s", dataset: gnomad_r2_1) {
-            variantId
-            reference_genome
-            chrom
-            pos
-            ref
-            alt
-            colocatedVariants
-            multiNucleotideVariants {
-            combined_variant_id
-            changes_amino_acids
-            n_individuals
-            other_constituent_snvs
-            }
-            exome {
-            ac
-            an
-            ac_hemi
-            ac_hom
-            faf95 {
-                popmax
-                popmax_population
-            }
-            filters
-            populations {
-                id
-                ac
-                an
-                ac_hemi
-                ac_hom
-            }
-            age_distribution {
-                het {
-                bin_edges
-                bin_freq
-                n_smaller
-                n_larger
-                }
-                hom {
-                bin_edges
-                bin_freq
-                n_smaller
-                n_larger
-                }
-            }
-            qualityMetrics {
-                alleleBalance {
-                alt {
-                    bin_edges
-                    bin_freq
-                    n_smaller
-                    n_larger
-                }
-                }
-                genotypeDepth {
-                all {
-                    bin_edges
-                    bin_freq
-                    n_smaller
-                    n_larger
-                }
-                alt {
-                    bin_edges
-                    bin_freq
-                    n_smaller
-                    n_larger
-                }
-                }
-                genotypeQuality {
-                all {
-                    bin_edges
-                    bin_freq
-                    n_smaller
-                    n_larger
-                }
-                alt {
-                    bin_edges
-                    bin_freq
-                    n_smaller
-                    n_larger
-                }
-                }
-            }
-            }
-            genome {
-            ac
-            an
-            ac_hemi
-            ac_hom
-            faf95 {
-                popmax
-                popmax_population
-            }
-            filters
-            populations {
-                id
-                ac
-                an
-                ac_hemi
-                ac_hom
-            }
-            age_distribution {
-                het {
-                bin_edges
-                bin_freq
-                n_smaller
-                n_larger
-                }
-                hom {
-                bin_edges
-                bin_freq
-                n_smaller
-                n_larger
-                }
-            }
-            qualityMetrics {
-                alleleBalance {
-                alt {
-                    bin_edges
-                    bin_freq
-                    n_smaller
-                    n_larger
-                }
-                }
-                genotypeDepth {
-                all {
-                    bin_edges
-                    bin_freq
-                    n_smaller
-                    n_larger
-                }
-                alt {
-                    bin_edges
-                    bin_freq
-                    n_smaller
-                    n_larger
-                }
-                }
-                genotypeQuality {
-                all {
-                    bin_edges
-                    bin_freq
-                    n_smaller
-                    n_larger
-                }
-                alt {
-                    bin_edges
-                    bin_freq
-                    n_smaller
-                    n_larger
-                }
-                }
-            }
-            }
-            flags
-            rsid
-            sortedTranscriptConsequences {
-            canonical
-            gene_id
-            gene_version
-            gene_symbol
-            hgvs
-            hgvsc
-            hgvsp
-            lof
-            lof_flags
-            lof_filter
-            major_consequence
-            polyphen_prediction
-            sift_prediction
-            transcript_id
-            transcript_version
-            }
-        }
-        
-        }
-    """
-    query = query_for_variants % (rsid.lower())
-    end_point = "https://gnomad.broadinstitute.org/api/"
+def _chunks(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
 
-    response = requests.post(end_point, data={'query': query}, timeout=1000)
+@cached("gnomad")
+def tool_query_gnomad_by_rsid(rsid, fields=None):
+    """calls the gnomad api and filters by rsid of the variant, returning the requested field groups (all fields possible by default)"""
+    # Frequency only queries are answered by the local store when one was imported
+    local = gnomad_store.query_frequencies(rsid, fields)
+    if local is not None:
+        return local
+    query = gnomad.build_query(rsid, fields)
+    end_point = gnomad.GNOMAD_API
+
+    response = transport.post(end_point, data={'query': query})
 
     if response.status_code == 200:
-        data_dict = response.json()
+        data_dict = tracing.parse_json(response)
         return data_dict
     else:
         print("API request failed. Status code:", response.status_code)
         return None
+
+# Variants per aliased GraphQL request, gnomAD rejects overly expensive queries
+GNOMAD_BATCH_SIZE = 25
+
+def tool_query_gnomad_by_rsids(rsids, fields=None):
+    """
+    Batch version of tool_query_gnomad_by_rsid, aliasing many variants into one GraphQL request
+    :param rsids: list of rsids
+    :param fields: field groups to request, see gnomad.FIELD_GROUPS and gnomad.PRESETS
+    :return: dictionary rsid -> variant data, None for variants gnomAD does not know
+    """
+    results = {}
+    missing = []
+    for rsid in dict.fromkeys(rsids):
+        hit = get_cached("tool_query_gnomad_by_rsid", {"rsid": rsid, "fields": fields}) or gnomad_store.query_frequencies(rsid, fields)
+        if hit is not None:
+            results[rsid] = (hit.get("data") or {}).get("variant")
+        else:
+            missing.append(rsid)
+
+    for chunk in _chunks(missing, GNOMAD_BATCH_SIZE):
+        response = transport.post(gnomad.GNOMAD_API, data={'query': gnomad.build_query(chunk, fields)})
+        if response.status_code != 200:
+            print("API request failed. Status code:", response.status_code)
+            continue
+        data = tracing.parse_json(response).get("data") or {}
+        for i, rsid in enumerate(chunk):
+            variant = data.get(f"v{i}")
+            results[rsid] = variant
+            if variant is not None:
+                set_cached("tool_query_gnomad_by_rsid", {"rsid": rsid, "fields": fields}, "gnomad",
+                           {"data": {"variant": variant}})
+
+    return {rsid: results.get(rsid) for rsid in rsids}
     
+@cached("dbvar")
 def tool_query_genomic_structural_variation_db_by_rsid(rsid):
+    # dbVar accessions are answered by the local index when one was imported
+    local = dbvar_index.query_term(rsid)
+    if local is not None:
+        return local
     end_point = f"https://clinicaltables.nlm.nih.gov/api/dbvar/v3/search?terms={rsid}"
-    response = requests.get(end_point)
+    response = transport.get(end_point)
     if response.status_code == 200:
-        data_dict = response.json()
+        data_dict = tracing.parse_json(response)
         return data_dict
     else:
         print("API request failed. Status code:", response.status_code)
         return None
 
+@cached("dbsnp")
 def tool_query_single_nucleotide_polymorphisms_db_by_rsid(rsid):
     end_point = f"https://clinicaltables.nlm.nih.gov/api/snps/v3/search?terms={rsid}"
-    response = requests.get(end_point)
+    response = transport.get(end_point)
     if response.status_code == 200:
-        data_dict = response.json()
+        data_dict = tracing.parse_json(response)
         return data_dict
     else:
         print("API request failed. Status code:", response.status_code)
         return None
 
+@cached("ensembl")
 def tool_get_variant_consequences_by_id(id):
     """id supports dbSNP, COSMIC and HGMD identifiers"""
     server = "https://rest.ensembl.org"
     ext = f"/vep/human/id/{id}?Geno2MP=1"
     
-    response = requests.get(server+ext, headers={ "Content-Type" : "application/json"})
+    response = transport.get(server+ext, headers={ "Content-Type" : "application/json"})
     if response.status_code == 200:  # Check for successful response
-        data_dict = response.json()
+        data_dict = tracing.parse_json(response)
         return data_dict
     else:
         print("API request failed. Status code:", response.status_code)
         return None 
     
+@cached("ensembl", equivalents=equivalent_calls)
 def tool_get_variant_consequences_by_hgvs(hgvs_code):
     #ensembl Fetch variant consequences based on a HGVS notation
 
     server = "https://rest.ensembl.org"
     ext = f"/vep/human/hgvs/{hgvs_code}?Geno2MP=1"
     
-    response = requests.get(server+ext, headers={ "Content-Type" : "application/json"})
+    response = transport.get(server+ext, headers={ "Content-Type" : "application/json"})
     if response.status_code == 200:  # Check for successful response
-        data_dict = response.json()
+        data_dict = tracing.parse_json(response)
         return data_dict
     else:
         print("API request failed. Status code:", response.status_code)
         return None
     
+@cached("ensembl", equivalents=equivalent_calls)
 def tool_get_variant_consequences_by_region_and_allele(region,allele):
     #ensembl Fetch variant consequences based on a specific region and allele
     server = "https://rest.ensembl.org"
     ext = f"/vep/human/region/{region}/{allele}?Geno2MP=1"
     
-    response = requests.get(server+ext, headers={ "Content-Type" : "application/json"})
+    response = transport.get(server+ext, headers={ "Content-Type" : "application/json"})
     if response.status_code == 200:  # Check for successful response
-        data_dict = response.json()
+        data_dict = tracing.parse_json(response)
         return data_dict
     else:
         print("API request failed. Status code:", response.status_code)
         return None
     
-def tool_get_mutation_tester_result(chromosome_coordinate, original_reference_allele, new_allele):
-    def parse_line(line):
-        fields = line.decode('utf-8').strip().split('\t')
-        while len(fields) < 15:
-            fields.append('')
-        return {
-            'id': fields[0],
-            'chr': fields[1],
-            'pos': fields[2],
-            'ref': fields[3],
-            'alt': fields[4],
-            'transcript_stable': fields[5],
-            'NCBI_geneid': fields[6],
-            'prediction': fields[7],
-            'model': fields[8],
-            'tree_vote': fields[9].split('|'),  # Handle multiple values
-            'note': fields[10],
-            'splicesite': fields[11],
-            'distance_from_splicesite': fields[12],
-            'disease_mutation': fields[13],
-            'polymorphism': fields[14]
-        }
-    #exapmle target url with two variants 
-    #target_url = "https://www.genecascade.org/MT2021/MT_API102.cgi?variants=21:33039603A>C,2:233391374T>C"
-    #example with one variant
-    target_url = f"https://www.genecascade.org/MT2021/MT_API102.cgi?variants={chromosome_coordinate}{original_reference_allele}>{new_allele}"
+# Ensembl REST accepts at most 200 variants per VEP POST
+VEP_POST_MAX_SIZE = 200
+VEP_MAX_CONCURRENCY = 4
 
-    response = requests.get(target_url)
-    if response.status_code == 200:  # Check for successful response
-        lines = response.content.splitlines()[1:] 
-        data = [parse_line(line) for line in lines]
-        json_data = json.dumps(data, indent=2)
-        return json_data
+def _post_vep_chunk(ext, payload_key, chunk):
+    server = "https://rest.ensembl.org"
+    response = transport.post(server+ext, params={"Geno2MP": 1},
+                              headers={ "Content-Type" : "application/json", "Accept" : "application/json"},
+                              json={payload_key: chunk})
+    if response.status_code == 200:
+        return tracing.parse_json(response)
     else:
         print("API request failed. Status code:", response.status_code)
+        return []
+
+def _vep_batch(ext, payload_key, inputs, single_tool, single_args):
+    """
+    Annotates many variants with chunked, concurrent VEP POSTs
+    :param ext: VEP POST endpoint
+    :param payload_key: name of the input list in the POST body
+    :param inputs: VEP input strings, one per variant
+    :param single_tool: name of the matching single variant tool, results are shared with its cache
+    :param single_args: callable giving single_tool's arguments for an input
+    :return: dictionary input -> list of VEP results, None for inputs VEP could not annotate
+    """
+    results = {}
+    missing = []
+    for item in dict.fromkeys(inputs):
+        hit = get_cached_equivalent(single_tool, single_args(item), equivalent_calls)
+        if hit is not None:
+            results[item] = hit
+        else:
+            missing.append(item)
+
+    if missing:
+        chunks = _chunks(missing, VEP_POST_MAX_SIZE)
+        with ThreadPoolExecutor(max_workers=min(len(chunks), VEP_MAX_CONCURRENCY)) as executor:
+            for annotations in executor.map(lambda chunk: _post_vep_chunk(ext, payload_key, chunk), chunks):
+                for annotation in annotations:
+                    results.setdefault(annotation.get("input"), []).append(annotation)
+
+        for item in missing:
+            if item in results:
+                set_cached(single_tool, single_args(item), "ensembl", results[item])
+
+    return {item: results.get(item) for item in inputs}
+
+def tool_get_variant_consequences_by_ids(ids):
+    """batch version of tool_get_variant_consequences_by_id, results keyed by id"""
+    return _vep_batch("/vep/human/id", "ids", ids,
+                      "tool_get_variant_consequences_by_id", lambda item: {"id": item})
+
+def tool_get_variant_consequences_by_hgvs_codes(hgvs_codes):
+    """batch version of tool_get_variant_consequences_by_hgvs, results keyed by HGVS code"""
+    return _vep_batch("/vep/human/hgvs", "hgvs_notations", hgvs_codes,
+                      "tool_get_variant_consequences_by_hgvs", lambda item: {"hgvs_code": item})
+
+def _region_to_vep_input(region, allele):
+    # VEP default input format: "chrom start end ref/alt strand".
+    # The region endpoint only takes the new allele, so the reference is left as N of the region's length,
+    # or - when end < start, which is how Ensembl writes insertions
+    chrom, _, span = region.partition(":")
+    span, _, strand = span.partition(":")
+    start, _, end = span.partition("-")
+    end = end or start
+    length = int(end) - int(start) + 1
+    ref = "N" * length if length > 0 else "-"
+    return f"{chrom} {start} {end} {ref}/{allele} {strand or '1'}"
+
+def tool_get_variant_consequences_by_regions_and_alleles(variants):
+    """batch version of tool_get_variant_consequences_by_region_and_allele, results keyed by "region allele" """
+    by_input = {_region_to_vep_input(v["region"], v["allele"]): v for v in variants}
+    results = _vep_batch("/vep/human/region", "variants", list(by_input), "tool_get_variant_consequences_by_region_and_allele",
+                         lambda item: {"region": by_input[item]["region"], "allele": by_input[item]["allele"]})
+    return {f'{v["region"]} {v["allele"]}': results[item] for item, v in by_input.items()}
+
+MUTATION_TASTER_API = "https://www.genecascade.org/MT2021/MT_API102.cgi"
+# Keep request URLs comfortably below what servers and proxies accept
+MUTATION_TASTER_MAX_URL_LENGTH = 2000
+MUTATION_TASTER_MAX_CONCURRENCY = 4
+
+def _parse_mutation_taster_line(line):
+    fields = line.decode('utf-8').strip().split('\t')
+    while len(fields) < 15:
+        fields.append('')
+    return {
+        'id': fields[0],
+        'chr': fields[1],
+        'pos': fields[2],
+        'ref': fields[3],
+        'alt': fields[4],
+        'transcript_stable': fields[5],
+        'NCBI_geneid': fields[6],
+        'prediction': fields[7],
+        'model': fields[8],
+        'tree_vote': fields[9].split('|'),  # Handle multiple values
+        'note': fields[10],
+        'splicesite': fields[11],
+        'distance_from_splicesite': fields[12],
+        'disease_mutation': fields[13],
+        'polymorphism': fields[14]
+    }
+
+def _iter_mutation_taster_rows(variants):
+    """
+    Streams the parsed TSV rows of one MutationTaster request
+    :param variants: list of variant strings like 21:33039603A>C
+    :return: generator of row dictionaries, None if the request failed
+    """
+    #exapmle target url with two variants
+    #target_url = "https://www.genecascade.org/MT2021/MT_API102.cgi?variants=21:33039603A>C,2:233391374T>C"
+    target_url = f"{MUTATION_TASTER_API}?variants={','.join(variants)}"
+
+    response = transport.get(target_url, stream=True)
+    if response.status_code != 200:
+        print("API request failed. Status code:", response.status_code)
+        response.close()
+        return None
+
+    def rows():
+        with response, tracing.span("parse", format="tsv", variants=len(variants)) as s:
+            lines = response.iter_lines()
+            next(lines, None)  # header
+            count = 0
+            for line in lines:
+                if line:
+                    count += 1
+                    yield _parse_mutation_taster_line(line)
+            s.set(rows=count)
+
+    return rows()
+
+def _mutation_taster_variant(chromosome_coordinate, original_reference_allele, new_allele):
+    return f"{chromosome_coordinate}{original_reference_allele}>{new_allele}"
+
+@cached("mutationtaster", equivalents=equivalent_calls)
+def tool_get_mutation_tester_result(chromosome_coordinate, original_reference_allele, new_allele):
+    rows = _iter_mutation_taster_rows([_mutation_taster_variant(chromosome_coordinate, original_reference_allele, new_allele)])
+    if rows is None:
         return None
+    json_data = json.dumps(list(rows), indent=2)
+    return json_data
+
+def _pack_variants(variants, max_url_length):
+    # Greedily fills each request up to the URL length limit
+    base_length = len(MUTATION_TASTER_API) + len("?variants=")
+    packs, current, length = [], [], base_length
+    for variant in variants:
+        if current and length + len(variant) + 1 > max_url_length:
+            packs.append(current)
+            current, length = [], base_length
+        current.append(variant)
+        length += len(variant) + 1
+    if current:
+        packs.append(current)
+    return packs
+
+def _row_variant(row):
+    chrom = row['chr'][3:] if row['chr'].lower().startswith('chr') else row['chr']
+    return f"{chrom}:{row['pos']}{row['ref']}>{row['alt']}"
+
+def tool_get_mutation_tester_results(variants):
+    """
+    Batch version of tool_get_mutation_tester_result
+    :param variants: list of dictionaries with chromosome_coordinate, original_reference_allele and new_allele
+    :return: dictionary variant string (e.g. 21:33039603A>C) -> list of MutationTaster rows, None if not scored
+    """
+    by_variant = {}
+    for v in variants:
+        args = {"chromosome_coordinate": v["chromosome_coordinate"],
+                "original_reference_allele": v["original_reference_allele"],
+                "new_allele": v["new_allele"]}
+        by_variant[_mutation_taster_variant(**args)] = args
+
+    results = {}
+    missing = []
+    for variant, args in by_variant.items():
+        hit = get_cached_equivalent("tool_get_mutation_tester_result", args, equivalent_calls)
+        if hit is not None:
+            results[variant] = json.loads(hit)
+        else:
+            missing.append(variant)
+
+    def fetch(pack):
+        rows = _iter_mutation_taster_rows(pack)
+        if rows is None:
+            return {}
+        fetched = {}
+        for row in rows:
+            key = row['id'] if row['id'] in by_variant else _row_variant(row)
+            fetched.setdefault(key, []).append(row)
+        return fetched
+
+    if missing:
+        packs = _pack_variants(missing, MUTATION_TASTER_MAX_URL_LENGTH)
+        with ThreadPoolExecutor(max_workers=min(len(packs), MUTATION_TASTER_MAX_CONCURRENCY)) as executor:
+            for fetched in executor.map(fetch, packs):
+                results.update(fetched)
+
+        for variant in missing:
+            if variant in results:
+                set_cached("tool_get_mutation_tester_result", by_variant[variant], "mutationtaster",
+                           json.dumps(results[variant], indent=2))
+
+    return {variant: results.get(variant) for variant in by_variant}
     
-from clinvar import clinvar_rcv_analyser
-from clinvar import clinvar_rcv_retriever
+from clinvar import clinvar_rcv_records
+import clinvar_index
 
+@cached("clinvar")
 def tool_get_clinvar_data_by_rcv_code(rcv):
-    response = clinvar_rcv_retriever(rcv)
-    if response:
-        return clinvar_rcv_analyser(response)
\ No newline at end of file
+    # The local index answers without touching the rate limited eutils API
+    record = clinvar_index.lookup_rcv(rcv)
+    if record is not None:
+        return record
+    records = clinvar_rcv_records(rcv)
+    if records:
+        return records[-1]
+
+from compact import get_raw_output
+
+def tool_get_raw_tool_output(raw_ref):
+    """full payload of an earlier, compacted tool call"""
+    stored = get_raw_output(raw_ref)
+    if stored is None:
+        return {"error": f"No raw output stored under {raw_ref}, call the original tool again"}
+    return stored
+
+def tool_resolve_variant_identifiers(identifier):
+    """equivalent identifiers of a variant, from the cross-reference index learnt from earlier tool results"""
+    return resolve(identifier)
+
+def tool_query_structural_variants_by_region(chromosome, start, end, variant_type=None):
+    """dbVar structural variants overlapping a GRCh37 region, from the local interval index"""
+    return dbvar_index.query_region(chromosome, start, end, variant_type)
+
+def tool_find_nearest_structural_variants(chromosome, position, count=5, variant_type=None):
+    """dbVar structural variants closest to a GRCh37 position, from the local interval index"""
+    return dbvar_index.query_nearest(chromosome, position, count, variant_type)
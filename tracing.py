@@ -0,0 +1,109 @@
+import contextvars
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Spans are kept in memory, set LLMHACK_TRACE_PATH (e.g. to .traces.jsonl) to also append them to a file
+TRACE_PATH = os.getenv("LLMHACK_TRACE_PATH", "")
+RECENT_SPANS = 2000
+
+_current = contextvars.ContextVar("current_span", default=None)
+_ids = itertools.count(1)
+_lock = threading.Lock()
+_recent = deque(maxlen=RECENT_SPANS)
+_trace_file = None
+
+
+class Span:
+    """A timed step of a turn: an LLM round trip, a tool call, an HTTP request, a parse or a render"""
+
+    def __init__(self, name, parent=None, **attrs):
+        self.name = name
+        self.id = next(_ids)
+        self.parent_id = parent.id if parent is not None else None
+        self.trace_id = parent.trace_id if parent is not None else self.id
+        self.attrs = attrs
+        self.start = time.time()
+        self._start = time.perf_counter()
+        self.duration_ms = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self._start) * 1000
+
+    def end(self):
+        if self.duration_ms is not None:
+            return
+        self.duration_ms = self.elapsed_ms()
+        _record(self.as_dict())
+
+    def as_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": round(self.duration_ms, 3) if self.duration_ms is not None else None,
+            "thread": threading.current_thread().name,
+            **self.attrs,
+        }
+
+
+def _record(span_dict):
+    global _trace_file
+    with _lock:
+        _recent.append(span_dict)
+        if not TRACE_PATH:
+            return
+        try:
+            if _trace_file is None:
+                _trace_file = open(TRACE_PATH, "a", buffering=1)
+            _trace_file.write(json.dumps(span_dict, default=str) + "\n")
+        except OSError as e:
+            print("Could not write trace:", e)
+
+
+def current_span():
+    return _current.get()
+
+
+def start_span(name, **attrs):
+    """Starts a span under the current one, the caller has to end() it"""
+    return Span(name, parent=_current.get(), **attrs)
+
+
+@contextmanager
+def span(name, **attrs):
+    """Times the enclosed block as a child of the current span"""
+    s = start_span(name, **attrs)
+    token = _current.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.set(error=repr(e))
+        raise
+    finally:
+        _current.reset(token)
+        s.end()
+
+
+def parse_json(response):
+    """response.json() timed as a parse step"""
+    with span("parse", format="json", bytes=len(response.content)):
+        return response.json()
+
+
+def recent_spans(trace_id=None):
+    """Finished spans kept in memory, optionally only those of one trace"""
+    with _lock:
+        spans = list(_recent)
+    if trace_id is not None:
+        spans = [s for s in spans if s["trace_id"] == trace_id]
+    return spans
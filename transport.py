@@ -0,0 +1,132 @@
+import contextvars
+import os
+import threading
+from urllib.parse import urlsplit, urlunsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import tracing
+from scheduler import current, scheduler
+
+CONNECT_TIMEOUT = float(os.getenv("LLMHACK_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("LLMHACK_READ_TIMEOUT", "60"))
+MAX_RETRIES = int(os.getenv("LLMHACK_MAX_RETRIES", "3"))
+POOL_MAXSIZE = int(os.getenv("LLMHACK_POOL_MAXSIZE", "16"))
+# Sends every upstream request to this base URL instead, e.g. http://127.0.0.1:8765 for the benchmark stub server
+UPSTREAM_OVERRIDE = os.getenv("LLMHACK_UPSTREAM_OVERRIDE")
+
+# Hosts whose answers are known to be slower than the default read timeout
+HOST_READ_TIMEOUTS = {
+    "gnomad.broadinstitute.org": 120,
+    "www.genecascade.org": 120,
+}
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+# Upstream of the request being sent, for the scheduling of its retries
+_upstream = contextvars.ContextVar("upstream", default=None)
+
+
+class _ScheduledRetry(Retry):
+    """Retry whose retries wait for a scheduler token like the first attempt, after the backoff"""
+
+    def sleep(self, response=None):
+        super().sleep(response)
+        upstream = _upstream.get()
+        if upstream is not None:
+            scheduler.acquire(upstream)
+
+
+def _retry_policy():
+    retry_args = dict(
+        total=MAX_RETRIES,
+        connect=MAX_RETRIES,
+        read=MAX_RETRIES,
+        status=MAX_RETRIES,
+        backoff_factor=0.5,
+        status_forcelist=RETRY_STATUSES,
+        # gnomAD's GraphQL endpoint only takes POST, and it is a read
+        allowed_methods=frozenset(["GET", "POST"]),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    try:
+        return _ScheduledRetry(backoff_jitter=0.5, **retry_args)
+    except TypeError:
+        # urllib3 < 2 has no jitter, plain exponential backoff still applies
+        return _ScheduledRetry(**retry_args)
+
+
+def _new_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_MAXSIZE, max_retries=_retry_policy())
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def session_for(url):
+    """Keep-alive session for the host of url, shared by every caller in the process"""
+    host = urlsplit(url).netloc
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = _sessions[host] = _new_session()
+    return session
+
+
+def timeout_for(url):
+    host = urlsplit(url).hostname
+    return (CONNECT_TIMEOUT, HOST_READ_TIMEOUTS.get(host, READ_TIMEOUT))
+
+
+def redirect(url, base_url):
+    """url with its scheme and host replaced by those of base_url"""
+    parts, base = urlsplit(url), urlsplit(base_url)
+    return urlunsplit((base.scheme, base.netloc, parts.path, parts.query, parts.fragment))
+
+
+def request(method, url, **kwargs):
+    """
+    Sends a request through the pooled session of the target host
+    :param method: HTTP method
+    :param url: full URL
+    :param kwargs: passed on to requests, timeout defaults to (CONNECT_TIMEOUT, read timeout of the host)
+    :return: requests.Response, after retries on 429/5xx and connection errors
+    """
+    kwargs.setdefault("timeout", timeout_for(url))
+    # Scheduled by the real upstream, also when the requests go to the benchmark stub
+    upstream = urlsplit(url).hostname
+    if UPSTREAM_OVERRIDE:
+        url = redirect(url, UPSTREAM_OVERRIDE)
+    parts = urlsplit(url)
+    with tracing.span("http", method=method, host=parts.netloc, path=parts.path) as s:
+        s.set(priority=current()[0], queue_ms=scheduler.acquire(upstream))
+        token = _upstream.set(upstream)
+        try:
+            response = session_for(url).request(method, url, **kwargs)
+        finally:
+            _upstream.reset(token)
+        # requests does not expose DNS/connect separately, they are part of the time to first byte
+        ttfb_ms = response.elapsed.total_seconds() * 1000
+        retries = response.raw.retries.history if getattr(response.raw, "retries", None) else ()
+        s.set(status=response.status_code, ttfb_ms=round(ttfb_ms, 3), retries=len(retries),
+              request_bytes=len(response.request.body or b""))
+        if kwargs.get("stream"):
+            # The body is read later by the caller
+            s.set(response_bytes=int(response.headers.get("Content-Length", 0)) or None)
+        else:
+            s.set(response_bytes=len(response.content), download_ms=round(s.elapsed_ms() - ttfb_ms, 3))
+    return response
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
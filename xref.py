@@ -0,0 +1,336 @@
+"""
+Cross-reference index of variant identifiers
+
+The tools take different identifiers for the same variant: rsIDs for gnomAD, dbSNP and dbVar,
+HGVS or region/allele for VEP, chromosome coordinate plus alleles for MutationTaster.
+Every fresh tool result is mined for the identifiers it links (gnomAD's variantId/rsid,
+VEP's input, location and colocated rsID, MutationTaster's coordinates) and stored here,
+so that equivalent calls are answered from the response cache and the model can translate
+identifiers with tool_resolve_variant_identifiers instead of extra API round trips.
+
+Coordinates are assembly specific and kept per assembly. rsIDs are not allele specific,
+so they are attached to variants but never used to merge two of them.
+"""
+import json
+import os
+import queue
+import re
+import sqlite3
+import threading
+
+from cache import CACHE_PATH, on_store
+
+XREF_PATH = os.getenv("LLMHACK_XREF_PATH", CACHE_PATH)
+
+# gnomAD r2.1 and the MutationTaster 2021 API are on GRCh37, rest.ensembl.org on GRCh38
+GNOMAD_ASSEMBLY = "GRCh37"
+MUTATION_TASTER_ASSEMBLY = "GRCh37"
+
+RSID_PATTERN = re.compile(r"^rs\d+$", re.IGNORECASE)
+COORDINATE_PATTERN = re.compile(r"^(?:chr)?([0-9]{1,2}|X|Y|MT?)[-:_ ](\d+)[-:_ ]?([ACGTN]+)[-/>:_ ]([ACGTN]+)$", re.IGNORECASE)
+REGION_PATTERN = re.compile(r"^(?:chr)?([0-9]{1,2}|X|Y|MT?):(\d+)(?:-(\d+))?(?::-?1)?[ /]([ACGTN-]+)$", re.IGNORECASE)
+
+
+def _chrom(chrom):
+    chrom = str(chrom).strip()
+    chrom = chrom[3:] if chrom.lower().startswith("chr") else chrom
+    chrom = chrom.upper()
+    return "MT" if chrom == "M" else chrom
+
+
+def coordinate(chrom, pos, ref, alt):
+    """Canonical chrom-pos-ref-alt form, the one gnomAD uses as variantId"""
+    return f"{_chrom(chrom)}-{int(pos)}-{ref.upper()}-{alt.upper()}"
+
+
+def vep_region(chrom, start, end, allele):
+    """Canonical form of a VEP region/allele input"""
+    return f"{_chrom(chrom)}:{int(start)}-{int(end)}/{allele.upper()}"
+
+
+def _region_args_key(region, allele):
+    chrom, _, span = region.strip().partition(":")
+    span = span.split(":")[0]
+    start, _, end = span.partition("-")
+    return vep_region(chrom, start, end or start, allele)
+
+
+class XrefIndex:
+    """Variants and their identifiers, in SQLite next to the tool cache so every session learns from the others"""
+
+    def __init__(self, path=XREF_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.pending = queue.Queue()
+        self._writer = None
+
+    def _connection(self):
+        # One connection per thread: with WAL, lookups never wait for the background writer
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = self.local.db = sqlite3.connect(self.path, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            # Derived data that is learnt again anyway, not worth an fsync per tool result
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute("CREATE TABLE IF NOT EXISTS xref_variants (id INTEGER PRIMARY KEY, record TEXT)")
+            db.execute("CREATE TABLE IF NOT EXISTS xref_aliases (alias TEXT, variant INTEGER, PRIMARY KEY (alias, variant))")
+        return db
+
+    @staticmethod
+    def _aliases(record):
+        # Allele specific aliases identify one variant, rsID aliases may be shared by the alleles of a site
+        strong = [f"coord:{assembly}:{key}" for assembly, key in record["coordinates"].items()]
+        strong += [f"region:{key}" for key in record["vep_regions"]]
+        strong += [f"hgvs:{key}" for key in record["hgvs"]]
+        weak = [f"rs:{rsid}" for rsid in record["rsids"]]
+        return strong, weak
+
+    @staticmethod
+    def _merge(record, other):
+        for key in ("rsids", "vep_regions", "hgvs"):
+            record[key] += [item for item in other[key] if item not in record[key]]
+        for assembly, key in other["coordinates"].items():
+            record["coordinates"].setdefault(assembly, key)
+        return record
+
+    def learn(self, rsids=(), coordinates=None, vep_regions=(), hgvs=()):
+        """Records that the given identifiers all belong to one variant, written in the background"""
+        record = {"rsids": [r.lower() for r in dict.fromkeys(rsids) if r],
+                  "coordinates": dict(coordinates or {}), "vep_regions": list(dict.fromkeys(vep_regions)),
+                  "hgvs": [h.strip() for h in dict.fromkeys(hgvs) if h]}
+        if not self._aliases(record)[0]:
+            return
+        # A tool result can hold hundreds of variants, the writer applies them in one transaction off the request path
+        self.pending.put(record)
+        with self.lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_pending, name="xref-writer", daemon=True)
+                self._writer.start()
+
+    def flush(self):
+        """Waits until everything learnt so far is written"""
+        self.pending.join()
+
+    def _write_pending(self):
+        while True:
+            records = [self.pending.get()]
+            while not self.pending.empty():
+                records.append(self.pending.get_nowait())
+            try:
+                db = self._connection()
+                for record in records:
+                    self._write(db, record)
+                db.commit()
+            except sqlite3.Error as e:
+                print("Cross-reference index write failed:", e)
+            for _ in records:
+                self.pending.task_done()
+
+    def _write(self, db, record):
+        strong, _ = self._aliases(record)
+        rows = db.execute(
+            f"SELECT DISTINCT v.id, v.record FROM xref_aliases a JOIN xref_variants v ON v.id = a.variant "
+            f"WHERE a.alias IN ({','.join('?' * len(strong))}) ORDER BY v.id", strong,
+        ).fetchall()
+        if rows:
+            target = rows[0][0]
+            merged = json.loads(rows[0][1])
+            for _, other in rows[1:]:
+                self._merge(merged, json.loads(other))
+            self._merge(merged, record)
+            others = [row[0] for row in rows[1:]]
+            if others:
+                marks = ",".join("?" * len(others))
+                db.execute(f"UPDATE OR IGNORE xref_aliases SET variant = ? WHERE variant IN ({marks})", [target] + others)
+                db.execute(f"DELETE FROM xref_aliases WHERE variant IN ({marks})", others)
+                db.execute(f"DELETE FROM xref_variants WHERE id IN ({marks})", others)
+            db.execute("UPDATE xref_variants SET record = ? WHERE id = ?", (json.dumps(merged), target))
+        else:
+            merged = record
+            target = db.execute("INSERT INTO xref_variants (record) VALUES (?)", (json.dumps(record),)).lastrowid
+        strong, weak = self._aliases(merged)
+        db.executemany("INSERT OR IGNORE INTO xref_aliases (alias, variant) VALUES (?, ?)",
+                       [(alias, target) for alias in strong + weak])
+
+    def lookup(self, aliases):
+        """Records of the variants known under any of the aliases"""
+        if not aliases:
+            return []
+        try:
+            rows = self._connection().execute(
+                f"SELECT DISTINCT v.id, v.record FROM xref_aliases a JOIN xref_variants v ON v.id = a.variant "
+                f"WHERE a.alias IN ({','.join('?' * len(aliases))}) ORDER BY v.id", list(aliases),
+            ).fetchall()
+        except sqlite3.Error as e:
+            print("Cross-reference index read failed:", e)
+            return []
+        return [json.loads(row[1]) for row in rows]
+
+    def clear(self):
+        self.flush()
+        db = self._connection()
+        db.execute("DELETE FROM xref_aliases")
+        db.execute("DELETE FROM xref_variants")
+        db.commit()
+
+
+xref_index = XrefIndex()
+
+
+def learn_gnomad(result):
+    variant = ((result or {}).get("data") or {}).get("variant")
+    if not variant or not all(variant.get(key) for key in ("chrom", "pos", "ref", "alt")):
+        return
+    rsids = variant.get("rsids") or [variant.get("rsid")]
+    assembly = variant.get("reference_genome") or GNOMAD_ASSEMBLY
+    xref_index.learn(rsids=[r for r in rsids if r],
+                     coordinates={assembly: coordinate(variant["chrom"], variant["pos"], variant["ref"], variant["alt"])})
+
+
+def learn_vep(annotations, hgvs_code=None, server_assembly="GRCh38"):
+    """:param server_assembly: assembly of the Ensembl server that answered, region aliases are only learned for GRCh38"""
+    for annotation in annotations or []:
+        alleles = (annotation.get("allele_string") or "").split("/")
+        chrom, start, end = annotation.get("seq_region_name"), annotation.get("start"), annotation.get("end")
+        if len(alleles) < 2 or chrom is None or start is None or end is None:
+            continue
+        rsids = [annotation["id"]] if RSID_PATTERN.match(str(annotation.get("id", ""))) else []
+        if not rsids:
+            colocated = {c["id"] for c in annotation.get("colocated_variants") or [] if RSID_PATTERN.match(str(c.get("id", "")))}
+            # Several colocated rsIDs means several variants at the site, none of them is known to be this one
+            if len(colocated) == 1:
+                rsids = list(colocated)
+        ref, alts = alleles[0], alleles[1:]
+        for alt in alts:
+            coordinates = {}
+            # VEP writes indels with - and without the anchor base, only substitutions map to VCF style coordinates
+            if "-" not in (ref, alt) and len(ref) == end - start + 1:
+                coordinates[annotation.get("assembly_name") or server_assembly] = coordinate(chrom, start, ref, alt)
+            # Region aliases stand for calls of the VEP region tool, which goes to the GRCh38 server
+            vep_regions = [vep_region(chrom, start, end, alt)] if server_assembly == "GRCh38" else []
+            xref_index.learn(rsids=rsids, coordinates=coordinates, vep_regions=vep_regions,
+                             hgvs=[hgvs_code] if hgvs_code and len(alts) == 1 else [])
+
+
+def learn_mutation_taster(rows):
+    if isinstance(rows, str):
+        rows = json.loads(rows)
+    for row in dict((row["id"], row) for row in rows or [] if row.get("pos")).values():
+        xref_index.learn(coordinates={MUTATION_TASTER_ASSEMBLY: coordinate(row["chr"], row["pos"], row["ref"], row["alt"])})
+
+
+@on_store
+def learn(tool_name, args, value):
+    """Mines a fresh tool result for identifiers, registered as a tool cache listener"""
+    if tool_name == "tool_query_gnomad_by_rsid":
+        learn_gnomad(value)
+    elif tool_name.startswith("tool_get_variant_consequences_by_"):
+        learn_vep(value, args.get("hgvs_code"), args.get("assembly", "GRCh38"))
+    elif tool_name == "tool_get_mutation_tester_result":
+        learn_mutation_taster(value)
+
+
+def _call_aliases(tool_name, args):
+    if tool_name == "tool_get_variant_consequences_by_region_and_allele":
+        aliases = [f"region:{_region_args_key(args['region'], args['allele'])}"]
+    elif tool_name == "tool_get_variant_consequences_by_hgvs":
+        aliases = [f"hgvs:{args['hgvs_code'].strip()}"]
+    elif tool_name == "tool_get_mutation_tester_result":
+        chrom, _, pos = args["chromosome_coordinate"].partition(":")
+        aliases = [f"coord:{MUTATION_TASTER_ASSEMBLY}:"
+                   f"{coordinate(chrom, pos, args['original_reference_allele'], args['new_allele'])}"]
+    elif RSID_PATTERN.match(str(args.get("rsid") or args.get("id") or "").strip()):
+        # An rsID may stand for several alleles of a site
+        aliases = [f"rs:{str(args.get('rsid') or args.get('id')).strip().lower()}"]
+    else:
+        aliases = []
+    return aliases
+
+
+def records_for_call(tool_name, args):
+    """Index records of the variants a single variant tool call is about"""
+    try:
+        return xref_index.lookup(_call_aliases(tool_name, args))
+    except (KeyError, ValueError, AttributeError):
+        return []
+
+
+EQUIVALENT_CALL_TOOLS = ("tool_get_variant_consequences_by_region_and_allele", "tool_get_variant_consequences_by_hgvs",
+                         "tool_get_mutation_tester_result")
+
+
+def _record_for_call(tool_name, args):
+    # Lookups by rsID are not allele specific, nothing else answers for them
+    if tool_name not in EQUIVALENT_CALL_TOOLS:
+        return None
+    records = records_for_call(tool_name, args)
+    return records[0] if len(records) == 1 else None
+
+
+def equivalent_calls(tool_name, args):
+    """
+    Other tool calls returning the same data as tool_name(**args), used by the response cache on a miss.
+    A VEP lookup by rsID answers for every allele of the site, so it never stands in for the allele specific ones.
+    """
+    record = _record_for_call(tool_name, args)
+    if record is None:
+        return []
+
+    calls = []
+    if tool_name.startswith("tool_get_variant_consequences_by_"):
+        calls += [("tool_get_variant_consequences_by_hgvs", {"hgvs_code": h}) for h in record["hgvs"]]
+        for region in record["vep_regions"]:
+            span, _, allele = region.partition("/")
+            calls += [("tool_get_variant_consequences_by_region_and_allele", {"region": r, "allele": allele})
+                      for r in (span, f"{span}:1")]
+    elif tool_name == "tool_get_mutation_tester_result" and MUTATION_TASTER_ASSEMBLY in record["coordinates"]:
+        calls.append(("tool_get_mutation_tester_result", mutation_taster_args(record["coordinates"][MUTATION_TASTER_ASSEMBLY])))
+    return [(name, other) for name, other in calls if (name, other) != (tool_name, args)]
+
+
+def mutation_taster_args(key):
+    chrom, pos, ref, alt = key.split("-")
+    return {"chromosome_coordinate": f"{chrom}:{pos}", "original_reference_allele": ref, "new_allele": alt}
+
+
+def identifier_aliases(identifier):
+    """Index aliases an identifier written by a user or the model could be stored under"""
+    identifier = identifier.strip()
+    if RSID_PATTERN.match(identifier):
+        return [f"rs:{identifier.lower()}"]
+    match = COORDINATE_PATTERN.match(identifier)
+    if match:
+        key = coordinate(*match.groups())
+        return [f"coord:{assembly}:{key}" for assembly in ("GRCh37", "GRCh38")]
+    match = REGION_PATTERN.match(identifier)
+    if match:
+        chrom, start, end, allele = match.groups()
+        return [f"region:{vep_region(chrom, start, end or start, allele)}"]
+    return [f"hgvs:{identifier}"]
+
+
+def describe(record):
+    """Known identifiers of a variant, with ready to use arguments for the tools"""
+    arguments = {}
+    if record["rsids"]:
+        arguments["tool_query_gnomad_by_rsid"] = {"rsid": record["rsids"][0]}
+        arguments["tool_get_variant_consequences_by_id"] = {"id": record["rsids"][0]}
+    if record["hgvs"]:
+        arguments["tool_get_variant_consequences_by_hgvs"] = {"hgvs_code": record["hgvs"][0]}
+    if record["vep_regions"]:
+        span, _, allele = record["vep_regions"][0].partition("/")
+        arguments["tool_get_variant_consequences_by_region_and_allele"] = {"region": span, "allele": allele}
+    if MUTATION_TASTER_ASSEMBLY in record["coordinates"]:
+        arguments["tool_get_mutation_tester_result"] = mutation_taster_args(record["coordinates"][MUTATION_TASTER_ASSEMBLY])
+    return {"rsids": record["rsids"], "coordinates": record["coordinates"], "hgvs": record["hgvs"], "tool_arguments": arguments}
+
+
+def resolve(identifier):
+    """Equivalent identifiers of a variant known from earlier tool results, no API is called"""
+    xref_index.flush()
+    records = xref_index.lookup(identifier_aliases(identifier))
+    if not records:
+        return {"identifier": identifier, "variants": [],
+                "note": "Not seen in earlier tool results, query gnomAD or VEP with it to learn its other identifiers"}
+    return {"identifier": identifier, "variants": [describe(record) for record in records]}